@@ -76,7 +76,8 @@ document.getElementById('search-input').addEventListener('keyup', async () => {
 
     document.getElementById('search-list').style.display = 'grid';
 
-    const url = `/api/${operator}/search?query=${encodeURIComponent(document.getElementById('search-input').value)}`;
+    // 候補リストは入力補完用の API から（停留所名・読み・ローマ字の前方一致）
+    const url = `/api/${operator}/suggest?query=${encodeURIComponent(document.getElementById('search-input').value)}`;
         
     try {
         const res = await fetch(url);
@@ -98,7 +99,8 @@ document.getElementById('search-input').addEventListener('focusout', () => {
             return;
         }
 
-        const url = `/api/${operator}/search?query=${encodeURIComponent(document.getElementById('search-input').value)}`;
+        // 入力の打ち間違い・読みの違いも拾う
+        const url = `/api/${operator}/search?query=${encodeURIComponent(document.getElementById('search-input').value)}&fuzzy=true`;
         
         try {
             const res = await fetch(url);
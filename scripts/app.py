@@ -1,29 +1,79 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
 from pydantic import BaseModel
 from fastapi.middleware.cors import CORSMiddleware
 
+from common import metrics
+from common import realtime_snapshot
+from common import stop_index
+from common import timetable
+
 import yokohamaMunicipal.search_stop
 import yokohamaMunicipal.get_departures
 import yokohamaMunicipal.get_realtime_data
+import yokohamaMunicipal.plan_journey
+import yokohamaMunicipal.congestion_profile
 
 import rinkoBus.search_stop
 import rinkoBus.get_departures
 import rinkoBus.get_realtime_data
+import rinkoBus.plan_journey
 
 import toBus.search_stop
 import toBus.get_departures
 import toBus.get_realtime_data
+import toBus.plan_journey
 
 import map.yokohamaMunicipal.get_data
 
+import federated_search
+
+import contextlib
+import os
 import time
 from datetime import datetime, date
 
 class Req(BaseModel):
     trips: list
     id: str
-    
-app = FastAPI()
+
+# 起動時に読み込んでおくもの（最初のリクエストでインデックスの読み込みを待たせない）
+WARM_UP_TASKS = (
+    yokohamaMunicipal.search_stop.load_index,
+    yokohamaMunicipal.search_stop.load_suggest_index,
+    yokohamaMunicipal.get_realtime_data.load_stop_sequence,
+    yokohamaMunicipal.plan_journey.load_timetable,
+    yokohamaMunicipal.congestion_profile.load_profile,
+    rinkoBus.search_stop.load_index,
+    rinkoBus.search_stop.load_suggest_index,
+    rinkoBus.get_realtime_data.load_stop_sequence,
+    rinkoBus.plan_journey.load_timetable,
+    toBus.search_stop.load_index,
+    toBus.search_stop.load_suggest_index,
+    toBus.get_realtime_data.load_stop_sequence,
+    toBus.plan_journey.load_timetable,
+    federated_search.load_stop_groups,
+    map.yokohamaMunicipal.get_data.get_route,
+    map.yokohamaMunicipal.get_data.get_poles,
+)
+
+def warm_up():
+    started_at = time.monotonic()
+    for task in WARM_UP_TASKS:
+        try:
+            task()
+        except Exception as e:
+            print(f"⚠️ Warm-up '{task.__module__}.{task.__name__}' failed: {e}")
+    print(f'warm-up done in {time.monotonic() - started_at:.1f}s')
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # uvicorn は lifespan の起動処理が終わってからリクエストを受け付ける
+    if os.environ.get('SKIP_WARM_UP') != '1':
+        warm_up()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -33,9 +83,65 @@ app.add_middleware(
     allow_headers=['Content-Type', 'Authorization', 'Access-Control-Allow-Origin'],
 )
 
+# メトリクス
+OPERATORS = ('yokohamaMunicipal', 'rinkoBus', 'toBus')
+route_paths = None
+
+def request_labels(path):
+    # ラベルの種類が増えすぎないよう、登録済みのパス以外はまとめる
+    global route_paths
+    if route_paths is None:
+        route_paths = {route.path for route in app.routes}
+    if path in route_paths:
+        route = path
+    else:
+        # パスに値を含むもの（/{operator}/stop/{stop_id}/live など）は登録したときのパスにまとめる
+        route = next(
+            (registered.path for registered in app.routes if hasattr(registered, 'path_regex') and registered.path_regex.match(path)),
+            'unmatched',
+        )
+    operator = next((part for part in path.split('/') if part in OPERATORS), '')
+    return route, operator
+
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    if request.url.path == '/metrics':
+        return await call_next(request)
+
+    route, operator = request_labels(request.url.path)
+    token = metrics.set_request(route, operator)
+    started_at = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        metrics.REQUEST_DURATION.observe(
+            time.perf_counter() - started_at, route=route, operator=operator, method=request.method, status=status
+        )
+        metrics.reset_request(token)
+
+    size = response.headers.get('content-length')
+    if size is not None:
+        metrics.RESPONSE_SIZE.observe(int(size), route=route, operator=operator)
+    return response
+
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+# 全事業者の停留所検索（operators はカンマ区切りで絞り込み）
+@app.get("/search")
+def search_all(query, limit: int = stop_index.DEFAULT_LIMIT, fuzzy: bool = False, operators: str = ''):
+    return federated_search.search(query, limit, fuzzy, [operator for operator in operators.split(',') if operator] or None)
+
 @app.get("/yokohamaMunicipal/search")
-def search(query):
-    return yokohamaMunicipal.search_stop.search(query)
+def search(query, limit: int = stop_index.DEFAULT_LIMIT, fuzzy: bool = False):
+    return yokohamaMunicipal.search_stop.search(query, limit, fuzzy)
+
+@app.get("/yokohamaMunicipal/suggest")
+def suggest(query, limit: int = stop_index.SUGGEST_LIMIT):
+    return yokohamaMunicipal.search_stop.suggest(query, limit)
 
 @app.get("/yokohamaMunicipal/get_departures")
 def get(id):
@@ -45,9 +151,29 @@ def get(id):
 def rt(req: Req):
     return yokohamaMunicipal.get_realtime_data.get(req)
 
+@app.get("/yokohamaMunicipal/stop/{stop_id}/live")
+def live(stop_id, limit: int = realtime_snapshot.LIVE_LIMIT):
+    return yokohamaMunicipal.get_realtime_data.live(stop_id, limit)
+
+@app.get("/yokohamaMunicipal/plan")
+def plan(origin: str = Query(alias='from'), destination: str = Query(alias='to'), depart_at: str = None):
+    return yokohamaMunicipal.plan_journey.plan(origin, destination, depart_at)
+
+@app.get("/yokohamaMunicipal/reachable")
+def reachable(stop, depart_at: str = None, minutes: int = timetable.DEFAULT_ISOCHRONE_MINUTES):
+    return yokohamaMunicipal.plan_journey.reachable(stop, depart_at, minutes)
+
+@app.get("/yokohamaMunicipal/get_predicted_congestion")
+def predicted_congestion(id):
+    return yokohamaMunicipal.congestion_profile.get(id)
+
 @app.get("/rinkoBus/search")
-def search(query):
-    return rinkoBus.search_stop.search(query)
+def search(query, limit: int = stop_index.DEFAULT_LIMIT, fuzzy: bool = False):
+    return rinkoBus.search_stop.search(query, limit, fuzzy)
+
+@app.get("/rinkoBus/suggest")
+def suggest(query, limit: int = stop_index.SUGGEST_LIMIT):
+    return rinkoBus.search_stop.suggest(query, limit)
 
 @app.get("/rinkoBus/get_departures")
 def get(id):
@@ -57,9 +183,25 @@ def get(id):
 def rt(req: Req):
     return rinkoBus.get_realtime_data.get(req)
 
+@app.get("/rinkoBus/stop/{stop_id}/live")
+def live(stop_id, limit: int = realtime_snapshot.LIVE_LIMIT):
+    return rinkoBus.get_realtime_data.live(stop_id, limit)
+
+@app.get("/rinkoBus/plan")
+def plan(origin: str = Query(alias='from'), destination: str = Query(alias='to'), depart_at: str = None):
+    return rinkoBus.plan_journey.plan(origin, destination, depart_at)
+
+@app.get("/rinkoBus/reachable")
+def reachable(stop, depart_at: str = None, minutes: int = timetable.DEFAULT_ISOCHRONE_MINUTES):
+    return rinkoBus.plan_journey.reachable(stop, depart_at, minutes)
+
 @app.get("/toBus/search")
-def search(query):
-    return toBus.search_stop.search(query)
+def search(query, limit: int = stop_index.DEFAULT_LIMIT, fuzzy: bool = False):
+    return toBus.search_stop.search(query, limit, fuzzy)
+
+@app.get("/toBus/suggest")
+def suggest(query, limit: int = stop_index.SUGGEST_LIMIT):
+    return toBus.search_stop.suggest(query, limit)
 
 @app.get("/toBus/get_departures")
 def get(id):
@@ -69,6 +211,18 @@ def get(id):
 def rt(req: Req):
     return toBus.get_realtime_data.get(req)
 
+@app.get("/toBus/stop/{stop_id}/live")
+def live(stop_id, limit: int = realtime_snapshot.LIVE_LIMIT):
+    return toBus.get_realtime_data.live(stop_id, limit)
+
+@app.get("/toBus/plan")
+def plan(origin: str = Query(alias='from'), destination: str = Query(alias='to'), depart_at: str = None):
+    return toBus.plan_journey.plan(origin, destination, depart_at)
+
+@app.get("/toBus/reachable")
+def reachable(stop, depart_at: str = None, minutes: int = timetable.DEFAULT_ISOCHRONE_MINUTES):
+    return toBus.plan_journey.reachable(stop, depart_at, minutes)
+
 # マップ
 
 @app.get("/map/yokohamaMunicipal/get_routes")
@@ -79,6 +233,17 @@ def get_routes():
 def get_locations():
     return map.yokohamaMunicipal.get_data.get_location()
 
+@app.get("/map/yokohamaMunicipal/get_trails")
+def get_trails(id: str = None, minutes: int = map.yokohamaMunicipal.get_data.DEFAULT_TRAIL_MINUTES):
+    return map.yokohamaMunicipal.get_data.get_trails(id, minutes)
+
+@app.get("/map/yokohamaMunicipal/get_positions")
+def get_positions(at: str = None):
+    try:
+        return map.yokohamaMunicipal.get_data.get_positions(at)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f'invalid at: {at}')
+
 @app.get("/map/yokohamaMunicipal/get_poles")
 def get_poles():
     return map.yokohamaMunicipal.get_data.get_poles()
@@ -0,0 +1,98 @@
+import random
+import threading
+import time
+
+# ローカル用の BusCongestion テーブルの代わり（boto3 の resource / Table の使う部分だけ）
+# unprocessed_rate を指定すると BatchGetItem の一部を UnprocessedKeys として返し、スロットリングを再現する
+
+class FakeTable:
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.items = {}
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def get_item(self, Key):
+        self.wait()
+        with self.lock:
+            self.reads += 1
+            item = self.items.get((Key['trip_id'], int(Key['stop_sequence'])))
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item):
+        self.wait()
+        with self.lock:
+            self.writes += 1
+            self.items[(Item['trip_id'], int(Item['stop_sequence']))] = dict(Item)
+        return {}
+
+class FakeResource:
+    def __init__(self, latency=0.0, unprocessed_rate=0.0, seed=0):
+        self.latency = latency
+        self.unprocessed_rate = unprocessed_rate
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.requested = {}  # キー → 何回目の要求か
+        self.tables = {}
+        self.batch_calls = 0
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.latency)
+        return self.tables[name]
+
+    def is_unprocessed(self, name, key):
+        """キーごとに何回目の要求かで決める（チャンクを並列に投げても、スレッドの順番で結果が変わらない）"""
+        requested = (name, key['trip_id'], int(key['stop_sequence']))
+        with self.lock:
+            count = self.requested[requested] = self.requested.get(requested, 0) + 1
+        return random.Random(f'{self.seed}:{requested}:{count}').random() < self.unprocessed_rate
+
+    def reset_requests(self):
+        """UnprocessedKeys の出方を最初に戻す"""
+        with self.lock:
+            self.requested.clear()
+
+    def batch_get_item(self, RequestItems):
+        if self.latency:
+            time.sleep(self.latency)
+        self.batch_calls += 1
+
+        responses = {}
+        unprocessed = {}
+        for name, request in RequestItems.items():
+            table = self.Table(name)
+            found = []
+            skipped = []
+            for key in request['Keys']:
+                if self.unprocessed_rate and self.is_unprocessed(name, key):
+                    skipped.append(key)
+                    continue
+                with table.lock:
+                    table.reads += 1
+                    item = table.items.get((key['trip_id'], int(key['stop_sequence'])))
+                if item is not None:
+                    found.append(dict(item))
+            responses[name] = found
+            if skipped:
+                unprocessed[name] = {'Keys': skipped}
+
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def seed_congestion(self, keys, seed=0, table_name='BusCongestion'):
+        rnd = random.Random(seed)
+        table = self.Table(table_name)
+        for trip_id, stop_sequence in keys:
+            count = rnd.randint(1, 30)
+            table.items[(trip_id, int(stop_sequence))] = {
+                'trip_id': trip_id,
+                'stop_sequence': int(stop_sequence),
+                'congestion_sum': sum(rnd.randint(0, 4) for _ in range(count)),
+                'count': count,
+            }
@@ -0,0 +1,438 @@
+import argparse
+import csv
+import datetime
+import email.utils
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+from google.transit import gtfs_realtime_pb2
+
+# 静的GTFS（gtfs_data）の時刻表から GTFS-RT を生成してローカルで配信する負荷試験用サーバー
+#   python -m bench.feed_simulator --port 8080 --scale 3
+#   ODPT_API_BASE=http://localhost:8080 python invoker.py
+# 便は時刻表どおりに走り、遅れ・混雑度は乱数で与える（seed が同じなら同じ結果）
+# --scale N で各便を SCALE_OFFSET 秒ずつずらして N 台走らせる（trip_id は同じなので静的データとの突き合わせはそのまま）
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# フィード名の先頭 → operator
+FEED_OPERATORS = (
+    ('YokohamaMunicipalBus', 'yokohamaMunicipal'),
+    ('odpt_KawasakiTsurumiRinkoBus_allrinko', 'rinkoBus'),
+    ('ToeiBus', 'toBus'),
+)
+# odpt:Bus（地図用のJSON）は横浜市営のみ
+BUS_JSON_OPERATOR = 'yokohamaMunicipal'
+# operator → ODPT の事業者名（odpt:Bus の各IDに使う）
+ODPT_OPERATORS = {
+    'yokohamaMunicipal': 'YokohamaMunicipal',
+    'rinkoBus': 'KawasakiTsurumiRinkoBus',
+    'toBus': 'Toei',
+}
+# occupancy_status 0〜6 に対応する odpt:occupancyStatus
+ODPT_OCCUPANCY_STATUSES = (
+    'odpt.OccupancyStatus:Empty',
+    'odpt.OccupancyStatus:ManySeatsAvailable',
+    'odpt.OccupancyStatus:FewSeatsAvailable',
+    'odpt.OccupancyStatus:StandingRoomOnly',
+    'odpt.OccupancyStatus:CrushedStandingRoomOnly',
+    'odpt.OccupancyStatus:Full',
+    'odpt.OccupancyStatus:NotAcceptingPassengers',
+)
+
+SCALE_OFFSET = 97  # 秒
+
+# occupancy_status 0〜6 の出やすさ。ピーク時間帯は PEAK_SHIFT 段階混む側へずらす
+DEFAULT_OCCUPANCY_WEIGHTS = (30, 30, 20, 12, 5, 2, 1)
+PEAK_HOURS = ((7 * 3600, 9 * 3600 + 1800), (17 * 3600, 19 * 3600 + 1800))
+PEAK_SHIFT = 1
+
+# 早発の下限と、運行中かどうかの粗い判定に使う遅れの上限（秒）
+MIN_DELAY = -60
+MAX_DELAY = 6 * 3600
+
+def to_seconds(time_str):
+    h, m, s = map(int, time_str.split(':'))
+    return h * 3600 + m * 60 + s
+
+def read_csv(gtfs_dir, file_name):
+    try:
+        with open(os.path.join(gtfs_dir, file_name), newline='', encoding='utf-8') as f:
+            yield from csv.DictReader(f)
+    except FileNotFoundError:
+        return
+
+def jst(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch) + datetime.timedelta(hours=9)
+
+def is_peak(seconds):
+    seconds %= 86400
+    return any(start <= seconds < end for start, end in PEAK_HOURS)
+
+class Snapshot:
+    def __init__(self, timestamp, vehicles, trip_updates, buses):
+        self.timestamp = timestamp
+        self.vehicles = vehicles
+        self.trip_updates = trip_updates
+        self.buses = buses
+        self.last_modified = email.utils.formatdate(timestamp, usegmt=True)
+        self.etags = {
+            name: '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+            for name, body in (('vehicles', vehicles), ('trip_updates', trip_updates), ('buses', buses))
+        }
+
+class TimetableSimulator:
+    def __init__(self, gtfs_dir, operator, scale=1, delay_mean=60.0, delay_sd=90.0, delay_drift=5.0,
+                 occupancy_weights=DEFAULT_OCCUPANCY_WEIGHTS, interval=15, seed=0):
+        self.gtfs_dir = gtfs_dir
+        self.operator = operator
+        self.scale = scale
+        self.delay_mean = delay_mean
+        self.delay_sd = delay_sd
+        self.delay_drift = delay_drift
+        self.occupancy_weights = occupancy_weights
+        self.interval = interval
+        self.seed = seed
+
+        self.lock = threading.Lock()
+        self.snapshot_cache = None
+        self.trip_profiles = {}
+        self.service_cache = {}
+        self.load()
+
+    def load(self):
+        self.stops = {
+            row['stop_id']: (float(row['stop_lat']), float(row['stop_lon']))
+            for row in read_csv(self.gtfs_dir, 'stops.txt')
+            if row.get('stop_lat') and row.get('stop_lon')
+        }
+        self.trips = {row['trip_id']: (row['route_id'], row['service_id']) for row in read_csv(self.gtfs_dir, 'trips.txt')}
+
+        stop_times = {}
+        for row in read_csv(self.gtfs_dir, 'stop_times.txt'):
+            arrival = row['arrival_time'] or row['departure_time']
+            departure = row['departure_time'] or row['arrival_time']
+            if not arrival:
+                continue
+            stop_times.setdefault(row['trip_id'], []).append(
+                (int(row['stop_sequence']), to_seconds(arrival), to_seconds(departure), row['stop_id'])
+            )
+        for rows in stop_times.values():
+            rows.sort()
+        self.stop_times = stop_times
+
+        self.calendar = list(read_csv(self.gtfs_dir, 'calendar.txt'))
+        self.calendar_dates = list(read_csv(self.gtfs_dir, 'calendar_dates.txt'))
+
+    def active_service_ids(self, date):
+        if date in self.service_cache:
+            return self.service_cache[date]
+
+        date_str = date.strftime('%Y%m%d')
+        weekday = date.strftime('%A').lower()
+        service_ids = {
+            row['service_id'] for row in self.calendar
+            if row['start_date'] <= date_str <= row['end_date'] and row.get(weekday) == '1'
+        }
+        for row in self.calendar_dates:
+            if row['date'] == date_str:
+                if row['exception_type'] == '1':
+                    service_ids.add(row['service_id'])
+                elif row['exception_type'] == '2':
+                    service_ids.discard(row['service_id'])
+
+        self.service_cache[date] = service_ids
+        return service_ids
+
+    def trip_profile(self, trip_id, copy):
+        """便ごとの遅れ（始発での遅れと1停留所ごとの増分）と混雑の傾向"""
+        key = (trip_id, copy)
+        profile = self.trip_profiles.get(key)
+        if profile is None:
+            rnd = random.Random(f'{self.seed}:{trip_id}:{copy}')
+            base = rnd.gauss(self.delay_mean, self.delay_sd)
+            drift = rnd.gauss(self.delay_drift, self.delay_drift)
+            bias = rnd.choices(range(len(self.occupancy_weights)), weights=self.occupancy_weights)[0]
+            profile = self.trip_profiles[key] = (base, drift, bias)
+        return profile
+
+    def delay_at(self, profile, index):
+        base, drift, _ = profile
+        return int(max(MIN_DELAY, base + drift * index))
+
+    def occupancy_at(self, trip_id, copy, profile, index, seconds):
+        rnd = random.Random(f'{self.seed}:{trip_id}:{copy}:{index}')
+        level = profile[2] + rnd.choice((-1, 0, 0, 1))
+        if is_peak(seconds):
+            level += PEAK_SHIFT
+        return max(0, min(len(self.occupancy_weights) - 1, level))
+
+    def running_trips(self, now):
+        """(trip_id, 便の時刻の基準となる0時の epoch) を返す。前日の 24:00 以降の便も含める"""
+        today = jst(now).date()
+        midnight = now - int((jst(now) - datetime.datetime.combine(today, datetime.time())).total_seconds())
+        for days_before in (1, 0):
+            service_date = today - datetime.timedelta(days=days_before)
+            service_ids = self.active_service_ids(service_date)
+            base = midnight - days_before * 86400
+            for trip_id, (_, service_id) in self.trips.items():
+                if service_id in service_ids and trip_id in self.stop_times:
+                    yield trip_id, base
+
+    def snapshot(self, now):
+        timestamp = int(now - now % self.interval)
+        with self.lock:
+            if self.snapshot_cache is not None and self.snapshot_cache.timestamp == timestamp:
+                return self.snapshot_cache
+
+        vehicles = gtfs_realtime_pb2.FeedMessage()
+        vehicles.header.gtfs_realtime_version = '2.0'
+        vehicles.header.timestamp = timestamp
+        trip_updates = gtfs_realtime_pb2.FeedMessage()
+        trip_updates.header.gtfs_realtime_version = '2.0'
+        trip_updates.header.timestamp = timestamp
+        buses = []
+
+        for trip_id, base in self.running_trips(timestamp):
+            rows = self.stop_times[trip_id]
+            for copy in range(self.scale):
+                offset = base + copy * SCALE_OFFSET
+                # 遅れを考慮しても時間外なら飛ばす（プロファイルを作らずに済ませる）
+                if timestamp < offset + rows[0][2] + MIN_DELAY or timestamp > offset + rows[-1][1] + MAX_DELAY:
+                    continue
+
+                profile = self.trip_profile(trip_id, copy)
+                if not offset + rows[0][2] + self.delay_at(profile, 0) <= timestamp < offset + rows[-1][1] + self.delay_at(profile, len(rows) - 1):
+                    continue
+
+                self.add_vehicle(vehicles, trip_updates, buses, trip_id, copy, profile, rows, offset, timestamp)
+
+        snapshot = Snapshot(
+            timestamp,
+            vehicles.SerializeToString(),
+            trip_updates.SerializeToString(),
+            json.dumps(buses, ensure_ascii=False).encode('utf-8'),
+        )
+        with self.lock:
+            self.snapshot_cache = snapshot
+        return snapshot
+
+    def add_vehicle(self, vehicles, trip_updates, buses, trip_id, copy, profile, rows, offset, timestamp):
+        # 次に到着する停留所
+        index = next(
+            i for i, (_, arrival, _, _) in enumerate(rows)
+            if offset + arrival + self.delay_at(profile, i) > timestamp
+        )
+        seq, arrival, _, stop_id = rows[index]
+        prev_seq, prev_arrival, prev_departure, prev_stop_id = rows[index - 1]
+        prev_delay = self.delay_at(profile, index - 1)
+        departed_at = offset + prev_departure + prev_delay
+
+        vehicle_id = f'{trip_id}.{copy}' if copy else trip_id
+        stopped = timestamp < departed_at
+
+        lat, lon = self.stops.get(stop_id, (0.0, 0.0))
+        if stopped:
+            lat, lon = self.stops.get(prev_stop_id, (lat, lon))
+        else:
+            # 前の停留所を出てからの経過で直線補間
+            arrived_at = offset + arrival + self.delay_at(profile, index)
+            ratio = (timestamp - departed_at) / max(1, arrived_at - departed_at)
+            prev_lat, prev_lon = self.stops.get(prev_stop_id, (lat, lon))
+            lat = prev_lat + (lat - prev_lat) * ratio
+            lon = prev_lon + (lon - prev_lon) * ratio
+
+        occupancy = self.occupancy_at(trip_id, copy, profile, index, timestamp - offset)
+
+        entity = vehicles.entity.add()
+        entity.id = vehicle_id
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = trip_id
+        vehicle.trip.route_id = self.trips[trip_id][0]
+        vehicle.vehicle.id = vehicle_id
+        vehicle.current_stop_sequence = prev_seq if stopped else seq
+        vehicle.stop_id = prev_stop_id if stopped else stop_id
+        vehicle.current_status = vehicle.STOPPED_AT if stopped else vehicle.IN_TRANSIT_TO
+        vehicle.occupancy_status = occupancy
+        vehicle.position.latitude = lat
+        vehicle.position.longitude = lon
+        vehicle.timestamp = timestamp
+
+        entity = trip_updates.entity.add()
+        entity.id = vehicle_id
+        trip_update = entity.trip_update
+        trip_update.trip.trip_id = trip_id
+        trip_update.trip.route_id = self.trips[trip_id][0]
+        trip_update.vehicle.id = vehicle_id
+        trip_update.timestamp = timestamp
+        for i in range(index, len(rows)):
+            row_seq, row_arrival, row_departure, row_stop_id = rows[i]
+            delay = self.delay_at(profile, i)
+            update = trip_update.stop_time_update.add()
+            update.stop_sequence = row_seq
+            update.stop_id = row_stop_id
+            update.arrival.delay = delay
+            update.arrival.time = offset + row_arrival + delay
+            update.departure.delay = delay
+            update.departure.time = offset + row_departure + delay
+
+        # odpt:Bus 相当（地図が使う項目のみ）
+        # 本物の系統パターン・標柱のIDは GTFS の route_id / stop_id とは別物だが、形だけ合わせて route_id / stop_id から作る
+        odpt_operator = ODPT_OPERATORS.get(self.operator, self.operator)
+        buses.append({
+            '@type': 'odpt:Bus',
+            'owl:sameAs': f'odpt.Bus:{odpt_operator}.{vehicle_id}',
+            'odpt:busNumber': vehicle_id,
+            'odpt:busroutePattern': f'odpt.BusroutePattern:{odpt_operator}.{self.trips[trip_id][0]}',
+            'odpt:fromBusstopPole': f'odpt.BusstopPole:{odpt_operator}.{prev_stop_id}',
+            'odpt:toBusstopPole': f'odpt.BusstopPole:{odpt_operator}.{stop_id}',
+            'odpt:occupancyStatus': ODPT_OCCUPANCY_STATUSES[occupancy],
+            'geo:lat': lat,
+            'geo:long': lon,
+            'dc:date': jst(timestamp).strftime('%Y-%m-%dT%H:%M:%S+09:00'),
+        })
+
+class Clock:
+    """start（epoch）から speed 倍で進む時計。start が None なら現在時刻"""
+    def __init__(self, start=None, speed=1.0):
+        self.started_at = time.time()
+        self.start = start if start is not None else self.started_at
+        self.speed = speed
+
+    def now(self):
+        return self.start + (time.time() - self.started_at) * self.speed
+
+class Handler(BaseHTTPRequestHandler):
+    simulators = {}
+    clock = None
+    verbose = False
+
+    def do_GET(self):
+        request_path = urlparse(self.path).path
+        feed = request_path.rsplit('/', 1)[-1]
+
+        if request_path.endswith('/odpt:Bus') or request_path.endswith('/odpt:Bus.json'):
+            simulator = self.simulators.get(BUS_JSON_OPERATOR)
+            kind, content_type = 'buses', 'application/json'
+        elif '/gtfs/realtime/' in request_path:
+            simulator = next((self.simulators.get(operator) for prefix, operator in FEED_OPERATORS if feed.startswith(prefix)), None)
+            if feed.endswith('_trip_update'):
+                kind, content_type = 'trip_updates', 'application/x-protobuf'
+            else:
+                kind, content_type = 'vehicles', 'application/x-protobuf'
+        else:
+            simulator = None
+
+        if simulator is None:
+            self.send_error(404)
+            return
+
+        snapshot = simulator.snapshot(self.clock.now())
+        etag = snapshot.etags[kind]
+        if self.not_modified(snapshot, etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', snapshot.last_modified)
+            self.end_headers()
+            return
+
+        body = getattr(snapshot, kind)
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', snapshot.last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_modified(self, snapshot, etag):
+        """If-None-Match があればそれで、なければ If-Modified-Since で判定する（本物のAPIと同じ）"""
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            return if_none_match == etag
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since is None:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since.timestamp() >= snapshot.timestamp
+
+    def log_message(self, format, *args):
+        if self.verbose:
+            super().log_message(format, *args)
+
+def parse_start(date_str, time_str):
+    if not date_str and not time_str:
+        return None
+    now = jst(time.time())
+    date = datetime.datetime.strptime(date_str, '%Y%m%d').date() if date_str else now.date()
+    clock = datetime.datetime.strptime(time_str, '%H:%M').time() if time_str else now.time()
+    started = datetime.datetime.combine(date, clock, tzinfo=datetime.timezone(datetime.timedelta(hours=9)))
+    return started.timestamp()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='時刻表から GTFS-RT を生成して配信')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--operators', nargs='+', default=[operator for _, operator in FEED_OPERATORS])
+    parser.add_argument('--gtfs-dir', action='append', default=[], metavar='OPERATOR=PATH',
+                        help='operator の gtfs_data の代わりに使うディレクトリ')
+    parser.add_argument('--scale', type=int, default=1, help='実際の何倍の台数を走らせるか')
+    parser.add_argument('--delay-mean', type=float, default=60.0, help='始発時点の遅れの平均（秒）')
+    parser.add_argument('--delay-sd', type=float, default=90.0, help='始発時点の遅れの標準偏差（秒）')
+    parser.add_argument('--delay-drift', type=float, default=5.0, help='1停留所ごとに増える遅れの平均（秒）')
+    parser.add_argument('--occupancy-weights', default=','.join(map(str, DEFAULT_OCCUPANCY_WEIGHTS)),
+                        help='occupancy_status 0〜6 の重み（カンマ区切り）')
+    parser.add_argument('--interval', type=int, default=15, help='フィードの更新間隔（秒）')
+    parser.add_argument('--date', help='模擬する日付 YYYYMMDD（JST）')
+    parser.add_argument('--time', help='模擬する開始時刻 HH:MM（JST）')
+    parser.add_argument('--speed', type=float, default=1.0, help='時計の進む速さ')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    gtfs_dirs = dict(item.split('=', 1) for item in args.gtfs_dir)
+    weights = tuple(float(w) for w in args.occupancy_weights.split(','))
+
+    simulators = {}
+    for operator in args.operators:
+        gtfs_dir = gtfs_dirs.get(operator, os.path.join(SCRIPTS_DIR, operator, 'gtfs_data'))
+        if not os.path.isfile(os.path.join(gtfs_dir, 'stop_times.txt')):
+            print(f'⚠️ {operator}: no gtfs_data at {gtfs_dir}, skipped')
+            continue
+        started_at = time.monotonic()
+        simulators[operator] = TimetableSimulator(
+            gtfs_dir, operator, scale=args.scale, delay_mean=args.delay_mean, delay_sd=args.delay_sd,
+            delay_drift=args.delay_drift, occupancy_weights=weights, interval=args.interval, seed=args.seed,
+        )
+        print(f'{operator}: {len(simulators[operator].stop_times)} trips loaded in {time.monotonic() - started_at:.1f}s')
+
+    if not simulators:
+        return 1
+
+    Handler.simulators = simulators
+    Handler.clock = Clock(parse_start(args.date, args.time), args.speed)
+    Handler.verbose = args.verbose
+
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    print(f'serving on http://{args.host}:{args.port} (ODPT_API_BASE=http://{args.host}:{args.port})')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+import argparse
+import datetime
+import importlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from google.transit import gtfs_realtime_pb2
+from common import feed_capture
+from common import feed_fetcher
+from bench.fake_dynamodb import FakeResource
+from bench.run import percentile, redirect
+
+# GTFS_RT_CAPTURE_DIR で保存したフィードを record_congestion に流し直す
+#   python -m bench.replay <capture_dir> yokohamaMunicipal 20261019             # できるだけ速く
+#   python -m bench.replay <capture_dir> yokohamaMunicipal 20261019 --speed 1   # 取得時と同じ間隔
+# DynamoDB の代わりに FakeResource に書き込み、サイクルごとの処理時間・エンティティ数・書き込み数を出す
+
+# フィード名 → 処理する関数
+FEEDS = (
+    ('gtfs_rt', 'process_vehicle_feed'),
+    ('trip_update', 'process_trip_update_feed'),
+)
+
+def setup(module, gtfs_dir, latency):
+    workspace = tempfile.mkdtemp(prefix='buscom-replay-')
+    os.makedirs(os.path.join(workspace, 'cache'))
+    os.symlink(os.path.realpath(gtfs_dir), os.path.join(workspace, 'gtfs_data'))
+    redirect((module,), workspace)
+
+    dynamodb = FakeResource(latency=latency)
+    if hasattr(module, 'table'):
+        module.table = dynamodb.Table('BusCongestion')
+
+    if hasattr(module, 'init'):
+        module.init()
+    if hasattr(module, 'reset'):
+        module.reset()
+
+    return workspace, dynamodb.Table('BusCongestion')
+
+def load_cycles(module, capture_dir, operator, date):
+    cycles = []
+    for feed, func_name in FEEDS:
+        if not hasattr(module, func_name):
+            continue
+        for fetched_at, file_path in feed_capture.list_captures(capture_dir, os.path.join(operator, feed), date):
+            cycles.append((fetched_at, feed, getattr(module, func_name), file_path))
+    cycles.sort(key=lambda cycle: cycle[0])
+    return cycles
+
+def jst_seconds(fetched_at):
+    now = datetime.datetime.utcfromtimestamp(fetched_at) + datetime.timedelta(hours=9)
+    return now.hour * 3600 + now.minute * 60 + now.second
+
+def replay(module, cycles, table, speed, verbose):
+    results = []
+    started_at = time.monotonic()
+    first_fetched_at = cycles[0][0]
+
+    for fetched_at, feed, process, file_path in cycles:
+        if speed > 0:
+            wait = (fetched_at - first_fetched_at) / speed - (time.monotonic() - started_at)
+            if wait > 0:
+                time.sleep(wait)
+
+        with open(file_path, 'rb') as f:
+            content = f.read()
+        message = gtfs_realtime_pb2.FeedMessage()
+        message.ParseFromString(content)
+
+        # 運行中かどうかの判定は取得時刻で行う
+        module.get_current_seconds = lambda fetched_at=fetched_at: jst_seconds(fetched_at)
+
+        reads, writes = table.reads, table.writes
+        cycle_started_at = time.perf_counter()
+        process(content, feed_fetcher.feed_version(content))
+        elapsed = time.perf_counter() - cycle_started_at
+
+        result = {
+            'fetched_at': fetched_at,
+            'feed': feed,
+            'bytes': len(content),
+            'entities': len(message.entity),
+            'elapsed_ms': elapsed * 1000,
+            'reads': table.reads - reads,
+            'writes': table.writes - writes,
+        }
+        results.append(result)
+
+        if verbose:
+            clock = (datetime.datetime.utcfromtimestamp(fetched_at) + datetime.timedelta(hours=9)).strftime('%H:%M:%S')
+            print(f"{clock} {feed:<12} {result['entities']:>6} entities {result['elapsed_ms']:>9.1f} ms {result['writes']:>5} writes")
+
+    return results
+
+def summarize(results):
+    summary = {}
+    for feed in sorted({result['feed'] for result in results}):
+        rows = [result for result in results if result['feed'] == feed]
+        elapsed = sorted(result['elapsed_ms'] for result in rows)
+        entities = sum(result['entities'] for result in rows)
+        summary[feed] = {
+            'cycles': len(rows),
+            'entities': entities,
+            'entities_per_sec': entities / (sum(elapsed) / 1000) if sum(elapsed) else 0.0,
+            'p50_ms': percentile(elapsed, 50),
+            'p90_ms': percentile(elapsed, 90),
+            'max_ms': elapsed[-1],
+            'reads': sum(result['reads'] for result in rows),
+            'writes': sum(result['writes'] for result in rows),
+        }
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='保存した GTFS-RT フィードを record_congestion で再生')
+    parser.add_argument('capture_dir')
+    parser.add_argument('operator', choices=('yokohamaMunicipal', 'rinkoBus', 'toBus'))
+    parser.add_argument('date', help='YYYYMMDD（JST）')
+    parser.add_argument('--speed', type=float, default=0, help='再生速度（1 で取得時と同じ間隔、0 でできるだけ速く）')
+    parser.add_argument('--gtfs-dir', help='静的GTFSのディレクトリ（省略時は operator の gtfs_data）')
+    parser.add_argument('--dynamodb-latency', type=float, default=0.0, help='GetItem / PutItem 1回あたりの遅延（ミリ秒）')
+    parser.add_argument('--quiet', action='store_true', help='サイクルごとの行を出さない')
+    parser.add_argument('--json', help='結果をJSONで保存')
+    args = parser.parse_args(argv)
+
+    module = importlib.import_module(args.operator + '.record_congestion')
+    gtfs_dir = args.gtfs_dir or os.path.join(os.path.dirname(module.__file__), 'gtfs_data')
+
+    cycles = load_cycles(module, args.capture_dir, args.operator, args.date)
+    if not cycles:
+        print('no captures found:', os.path.join(args.capture_dir, args.operator, '*', args.date))
+        return 1
+
+    workspace, table = setup(module, gtfs_dir, args.dynamodb_latency / 1000)
+    try:
+        results = replay(module, cycles, table, args.speed, not args.quiet)
+    finally:
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    summary = summarize(results)
+    print(f"{'feed':<12} {'cycles':>7} {'entities':>9} {'ent/s':>9} {'p50 ms':>9} {'p90 ms':>9} {'max ms':>9} {'writes':>7}")
+    for feed, s in summary.items():
+        print(f"{feed:<12} {s['cycles']:>7} {s['entities']:>9} {s['entities_per_sec']:>9.0f} {s['p50_ms']:>9.1f} {s['p90_ms']:>9.1f} {s['max_ms']:>9.1f} {s['writes']:>7}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'summary': summary, 'cycles': results}, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
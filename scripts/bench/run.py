@@ -0,0 +1,307 @@
+import argparse
+import datetime
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yokohamaMunicipal.prepare_gtfs_data
+import yokohamaMunicipal.search_stop
+import yokohamaMunicipal.get_departures
+import yokohamaMunicipal.get_realtime_data
+import yokohamaMunicipal.plan_journey
+from common import congestion_client
+from common import realtime_snapshot
+from bench import synthetic_gtfs
+from bench.fake_dynamodb import FakeResource
+
+# ホットパスのベンチマーク
+# 合成GTFSとローカルの DynamoDB の代わりで、ODPT のデータなしに計測する
+#   python -m bench.run                          # 計測して表示
+#   python -m bench.run --save-baseline          # bench/baseline.json に保存
+#   python -m bench.run --compare                # baseline.json と比べて遅くなっていたら終了コード1
+# baseline.json は既定の引数で保存したもの。計測するマシンが変わったら、そのマシンで --save-baseline し直してコミットする
+
+DEFAULT_BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# 遅くなったとみなす割合と、誤差として無視する差（ミリ秒）
+DEFAULT_TOLERANCE = 0.25
+NOISE_FLOOR_MS = 0.5
+
+OPERATOR_MODULES = (
+    yokohamaMunicipal.prepare_gtfs_data,
+    yokohamaMunicipal.search_stop,
+    yokohamaMunicipal.get_departures,
+    yokohamaMunicipal.get_realtime_data,
+    yokohamaMunicipal.plan_journey,
+)
+
+CASES = []
+
+def case(name, rounds=50, warmup=3):
+    def register(func):
+        CASES.append((name, func, rounds, warmup))
+        return func
+    return register
+
+class Event:
+    # get_rt_data のリクエストボディの代わり
+    def __init__(self, trips, id):
+        self.trips = trips
+        self.id = id
+
+def redirect(modules, workspace):
+    """各モジュールのファイルパス定数を workspace 配下へ向け直す"""
+    for module in modules:
+        root = os.path.dirname(module.__file__)
+        for name, value in list(vars(module).items()):
+            if isinstance(value, str) and value.startswith(root):
+                setattr(module, name, workspace + value[len(root):])
+
+class Context:
+    def __init__(self, workspace, summary, dynamodb):
+        self.workspace = workspace
+        self.summary = summary
+        self.dynamodb = dynamodb
+        self.date = summary['start_date'] + datetime.timedelta(days=7)
+        self.state = {}
+
+def setup(args):
+    workspace = tempfile.mkdtemp(prefix='buscom-bench-')
+    gtfs_dir = os.path.join(workspace, 'gtfs_data')
+    os.makedirs(os.path.join(workspace, 'cache'))
+
+    summary = synthetic_gtfs.generate(
+        gtfs_dir, stops=args.stops, routes=args.routes, trips=args.trips,
+        service_days=args.service_days, seed=args.seed
+    )
+    redirect(OPERATOR_MODULES, workspace)
+
+    dynamodb = FakeResource(latency=args.dynamodb_latency / 1000, unprocessed_rate=args.unprocessed_rate, seed=args.seed)
+    congestion_client.get_resource = lambda remaining=None: dynamodb
+    # 待ち時間の乱数（full jitter）が計測の大半を占めて --compare がぶれるので、その平均で待つ
+    congestion_client._backoff = lambda attempt: min(congestion_client.MAX_BACKOFF, congestion_client.BASE_BACKOFF * (2 ** attempt)) / 2
+
+    context = Context(workspace, summary, dynamodb)
+
+    # 一番便の多い停留所を基準にする
+    yokohamaMunicipal.prepare_gtfs_data.build_and_upload_index()
+    index = yokohamaMunicipal.search_stop.load_index()
+    busiest = max(range(len(index.stop_ids)), key=index.services)
+    context.stop_id = index.stop_ids[busiest]
+
+    departures = yokohamaMunicipal.get_departures.get_departures_at_stop(
+        context.stop_id, context.date.year, context.date.month, context.date.day
+    )
+    context.congestion_keys = [(dep['trip_id'], dep['stop_sequence']) for dep in departures]
+    dynamodb.seed_congestion(context.congestion_keys[::2], seed=args.seed)
+
+    # リアルタイムデータ（朝8時）
+    service_ids = yokohamaMunicipal.get_departures.get_service_ids(context.date.year, context.date.month, context.date.day)
+    timestamp = int(datetime.datetime.combine(context.date, datetime.time(8), realtime_snapshot.JST).timestamp())
+    vehicles, trip_updates = synthetic_gtfs.build_realtime_feeds(gtfs_dir, 8 * 3600, service_ids, timestamp, seed=args.seed)
+    with open(yokohamaMunicipal.get_realtime_data.GTFS_RT_DATA_KEY, 'wb') as f:
+        f.write(vehicles.SerializeToString())
+    # ポーラーが書き出す予測時刻
+    context.rt_feeds = [vehicles, trip_updates]
+    context.rt_timestamp = timestamp
+    # フィードの時刻は計測する時刻と違うので、古い予測時刻として捨てないようにする
+    realtime_snapshot.STALE_SECONDS = float('inf')
+    bench_publish_realtime(context)
+    context.rt_trips = [entity.vehicle.trip.trip_id for entity in vehicles.entity][:40]
+    context.rt_stop = vehicles.entity[0].vehicle.stop_id if len(vehicles.entity) else context.stop_id
+
+    return context
+
+# ==== 計測対象 ====
+@case('build_and_upload_index', rounds=3, warmup=0)
+def bench_build_index(context):
+    yokohamaMunicipal.prepare_gtfs_data.build_and_upload_index()
+
+SEARCH_QUERIES = ('駅', '中央', 'さくら', 'みなと', '保土ケ谷', 'ｴｷﾏｴ', 'zzz')
+
+@case('search_stop')
+def bench_search_stop(context):
+    i = context.state.get('query', 0)
+    context.state['query'] = i + 1
+    yokohamaMunicipal.search_stop.search_stop(SEARCH_QUERIES[i % len(SEARCH_QUERIES)])
+
+SUGGEST_QUERIES = ('と', 'とつ', '戸塚', 'totsu', 'ほどが', 'zzz')
+
+@case('suggest')
+def bench_suggest(context):
+    i = context.state.get('suggest', 0)
+    context.state['suggest'] = i + 1
+    yokohamaMunicipal.search_stop.suggest(SUGGEST_QUERIES[i % len(SUGGEST_QUERIES)])
+
+@case('get_departures_at_stop', rounds=20)
+def bench_get_departures(context):
+    yokohamaMunicipal.get_departures.get_departures_at_stop(
+        context.stop_id, context.date.year, context.date.month, context.date.day
+    )
+
+@case('batch_get_congestion_cold', rounds=20)
+def bench_batch_get_congestion_cold(context):
+    congestion_client.clear_cache()
+    # どの回も同じキーが同じ回数だけ UnprocessedKeys になるように（回数を変えても分布が変わらない）
+    context.dynamodb.reset_requests()
+    yokohamaMunicipal.get_departures.batch_get_congestion(context.congestion_keys)
+
+@case('batch_get_congestion_warm')
+def bench_batch_get_congestion_warm(context):
+    yokohamaMunicipal.get_departures.batch_get_congestion(context.congestion_keys)
+
+@case('publish_realtime', rounds=20)
+def bench_publish_realtime(context):
+    realtime_snapshot.publish_snapshot(
+        yokohamaMunicipal.get_realtime_data.REALTIME_DIR, yokohamaMunicipal.plan_journey.load_timetable(),
+        context.rt_feeds, context.rt_timestamp
+    )
+
+@case('get_realtime_data.get')
+def bench_get_realtime_data(context):
+    yokohamaMunicipal.get_realtime_data.get(Event(context.rt_trips, context.rt_stop))
+
+@case('stop_live')
+def bench_stop_live(context):
+    yokohamaMunicipal.get_realtime_data.live(context.rt_stop)
+
+@case('plan_journey', rounds=20)
+def bench_plan_journey(context):
+    # 一番便の多い停留所から、順に違う停留所へ
+    table = yokohamaMunicipal.plan_journey.load_timetable()
+    i = context.state.get('plan', 0)
+    context.state['plan'] = i + 1
+    destination = table.stop_ids[(i * 7919) % len(table.stop_ids)]
+    table.plan(context.stop_id, destination, context.date, 8 * 3600)
+
+@case('reachable_cold', rounds=10)
+def bench_reachable_cold(context):
+    table = yokohamaMunicipal.plan_journey.load_timetable()
+    table.profile_cache.clear()
+    table.reachable(context.stop_id, context.date, 8 * 3600, 30)
+
+@case('reachable_warm')
+def bench_reachable_warm(context):
+    # 同じ区切りの中で出発時刻を動かす（地図で時刻を動かしたとき）
+    i = context.state.get('reachable', 0)
+    context.state['reachable'] = i + 1
+    yokohamaMunicipal.plan_journey.load_timetable().reachable(context.stop_id, context.date, 8 * 3600 + (i * 37) % 600, 30)
+
+# ==== 集計 ====
+def percentile(sorted_samples, p):
+    # nearest-rank
+    index = max(0, min(len(sorted_samples) - 1, int(round(p / 100 * len(sorted_samples) + 0.5)) - 1))
+    return sorted_samples[index]
+
+def measure(func, context, rounds, warmup):
+    for _ in range(warmup):
+        func(context)
+
+    samples = []
+    for _ in range(rounds):
+        gc.collect()
+        started_at = time.perf_counter()
+        func(context)
+        samples.append((time.perf_counter() - started_at) * 1000)
+
+    # メモリは別に1回だけ（tracemalloc を有効にすると遅くなるので）
+    gc.collect()
+    tracemalloc.start()
+    func(context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        'rounds': rounds,
+        'mean_ms': sum(samples) / len(samples),
+        'p50_ms': percentile(samples, 50),
+        'p90_ms': percentile(samples, 90),
+        'p99_ms': percentile(samples, 99),
+        'max_ms': samples[-1],
+        'peak_kib': peak / 1024,
+    }
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if base is None:
+            continue
+
+        for key, noise in (('p50_ms', NOISE_FLOOR_MS), ('p90_ms', NOISE_FLOOR_MS), ('peak_kib', 64)):
+            limit = base[key] * (1 + tolerance)
+            if result[key] > limit and result[key] - base[key] > noise:
+                regressions.append(f'{name}: {key} {result[key]:.2f} > {base[key]:.2f} (+{tolerance:.0%})')
+    return regressions
+
+def print_results(results):
+    print(f"{'case':<30} {'mean':>9} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9} {'peak KiB':>10}")
+    for name, r in results.items():
+        print(f"{name:<30} {r['mean_ms']:>9.2f} {r['p50_ms']:>9.2f} {r['p90_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['max_ms']:>9.2f} {r['peak_kib']:>10.0f}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ホットパスのベンチマーク')
+    parser.add_argument('-k', dest='pattern', help='名前にこの文字列を含むケースだけ実行')
+    parser.add_argument('--stops', type=int, default=2000)
+    parser.add_argument('--routes', type=int, default=120)
+    parser.add_argument('--trips', type=int, default=12000)
+    parser.add_argument('--service-days', type=int, default=90)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--dynamodb-latency', type=float, default=5.0, help='BatchGetItem 1回あたりの遅延（ミリ秒）')
+    parser.add_argument('--unprocessed-rate', type=float, default=0.1, help='UnprocessedKeys として返す割合')
+    parser.add_argument('--rounds', type=int, help='全ケースの計測回数を上書き')
+    parser.add_argument('--json', help='結果をJSONで保存')
+    parser.add_argument('--save-baseline', nargs='?', const=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--compare', nargs='?', const=DEFAULT_BASELINE_PATH)
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    context = setup(args)
+    try:
+        results = {}
+        for name, func, rounds, warmup in CASES:
+            if args.pattern and args.pattern not in name:
+                continue
+            results[name] = measure(func, context, args.rounds or rounds, warmup)
+    finally:
+        shutil.rmtree(context.workspace, ignore_errors=True)
+
+    print_results(results)
+
+    report = {
+        'params': {key: value for key, value in vars(args).items() if key in ('stops', 'routes', 'trips', 'service_days', 'seed', 'dynamodb_latency', 'unprocessed_rate')},
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print('baseline saved:', args.save_baseline)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('params') != report['params']:
+            print('⚠️ baseline was recorded with different parameters:', baseline.get('params'))
+        regressions = compare(results, baseline, args.tolerance)
+        for line in regressions:
+            print('❌ regression:', line)
+        if regressions:
+            return 1
+        print('✅ no regressions against', args.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
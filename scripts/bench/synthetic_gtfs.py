@@ -0,0 +1,235 @@
+import argparse
+import csv
+import datetime
+import os
+import random
+
+from google.transit import gtfs_realtime_pb2
+
+# ベンチマーク用の合成GTFS
+# 同じ引数・seed なら毎回同じデータになる
+
+NAME_PARTS = (
+    ('駅前', 'えきまえ'), ('市役所', 'しやくしょ'), ('中央', 'ちゅうおう'), ('病院', 'びょういん'),
+    ('公園', 'こうえん'), ('小学校', 'しょうがっこう'), ('本町', 'ほんちょう'), ('新町', 'しんまち'),
+    ('北口', 'きたぐち'), ('南口', 'みなみぐち'), ('団地', 'だんち'), ('車庫', 'しゃこ'),
+    ('入口', 'いりぐち'), ('神社', 'じんじゃ'), ('橋', 'はし'), ('ヶ丘', 'がおか'),
+)
+PLACE_PARTS = (
+    ('桜木', 'さくらぎ'), ('港', 'みなと'), ('山手', 'やまて'), ('青葉', 'あおば'), ('緑', 'みどり'),
+    ('戸塚', 'とつか'), ('磯子', 'いそご'), ('金沢', 'かなざわ'), ('保土ケ谷', 'ほどがや'), ('旭', 'あさひ'),
+    ('泉', 'いずみ'), ('瀬谷', 'せや'), ('栄', 'さかえ'), ('港南', 'こうなん'), ('鶴見', 'つるみ'), ('神奈川', 'かながわ'),
+)
+
+# 平日・土曜・休日ダイヤ
+SERVICES = (
+    ('WEEKDAY', (1, 1, 1, 1, 1, 0, 0)),
+    ('SATURDAY', (0, 0, 0, 0, 0, 1, 0)),
+    ('HOLIDAY', (0, 0, 0, 0, 0, 0, 1)),
+)
+
+FIRST_DEPARTURE = 5 * 3600 + 30 * 60
+LAST_DEPARTURE = 24 * 3600 + 30 * 60
+
+BASE_LAT = 35.45
+BASE_LON = 139.60
+
+def format_time(seconds):
+    return '%02d:%02d:%02d' % (seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+def write_csv(out_dir, file_name, header, rows):
+    with open(os.path.join(out_dir, file_name), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+def generate(out_dir, stops=500, routes=40, trips=4000, service_days=60, stops_per_route=20, seed=0,
+             start_date=datetime.date(2026, 4, 1)):
+    """stops 個の停留所・routes 系統・1日あたり約 trips 便の GTFS を out_dir に書き出す"""
+    rnd = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # --- stops.txt / translations.txt ---
+    # 同じ名前の停留所（のりば違い）も混ぜる
+    stop_rows = []
+    translation_rows = []
+    names = []
+    for i in range(stops):
+        if names and rnd.random() < 0.3:
+            name, kana = names[rnd.randrange(len(names))]
+        else:
+            place = PLACE_PARTS[rnd.randrange(len(PLACE_PARTS))]
+            part = NAME_PARTS[rnd.randrange(len(NAME_PARTS))]
+            number = '' if rnd.random() < 0.6 else str(rnd.randint(1, 9))
+            name = place[0] + number + part[0]
+            kana = place[1] + number + part[1]
+            names.append((name, kana))
+
+        lat = BASE_LAT + rnd.uniform(-0.08, 0.08)
+        lon = BASE_LON + rnd.uniform(-0.1, 0.1)
+        stop_rows.append(('S%05d' % i, name, '%.6f' % lat, '%.6f' % lon))
+
+    for name, kana in names:
+        translation_rows.append(('stops', 'stop_name', 'ja-Hrkt', kana, name))
+        translation_rows.append(('stops', 'stop_name', 'en', kana, name))
+
+    write_csv(out_dir, 'stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'), stop_rows)
+    write_csv(out_dir, 'translations.txt', ('table_name', 'field_name', 'language', 'translation', 'field_value'), translation_rows)
+
+    # --- routes.txt ---
+    route_rows = []
+    patterns = []
+    for r in range(routes):
+        route_id = 'R%04d' % r
+        route_rows.append((route_id, '', '%03d' % (r + 1), '%d系統' % (r + 1), 3))
+
+        # 近い停留所をつなぐ経路（往復で2パターン）
+        start = rnd.randrange(stops)
+        pattern = [start]
+        while len(pattern) < min(stops_per_route, stops):
+            last = stop_rows[pattern[-1]]
+            candidates = rnd.sample(range(stops), min(8, stops))
+            candidates = [c for c in candidates if c not in pattern] or [c for c in range(stops) if c not in pattern]
+            nearest = min(candidates, key=lambda c: (float(stop_rows[c][2]) - float(last[2])) ** 2 + (float(stop_rows[c][3]) - float(last[3])) ** 2)
+            pattern.append(nearest)
+        patterns.append((route_id, pattern))
+        patterns.append((route_id, pattern[::-1]))
+
+    write_csv(out_dir, 'routes.txt', ('route_id', 'agency_id', 'route_short_name', 'route_long_name', 'route_type'), route_rows)
+
+    # --- calendar.txt / calendar_dates.txt ---
+    end_date = start_date + datetime.timedelta(days=max(1, service_days) - 1)
+    calendar_rows = [
+        (service_id,) + days + (start_date.strftime('%Y%m%d'), end_date.strftime('%Y%m%d'))
+        for service_id, days in SERVICES
+    ]
+    write_csv(out_dir, 'calendar.txt', ('service_id', 'monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                                        'saturday', 'sunday', 'start_date', 'end_date'), calendar_rows)
+
+    # 平日の祝日（休日ダイヤに差し替え）
+    calendar_date_rows = []
+    day = start_date
+    while day <= end_date:
+        if day.weekday() < 5 and rnd.random() < 0.05:
+            date_str = day.strftime('%Y%m%d')
+            calendar_date_rows.append(('WEEKDAY', date_str, 2))
+            calendar_date_rows.append(('HOLIDAY', date_str, 1))
+        day += datetime.timedelta(days=1)
+    write_csv(out_dir, 'calendar_dates.txt', ('service_id', 'date', 'exception_type'), calendar_date_rows)
+
+    # --- trips.txt / stop_times.txt ---
+    trip_rows = []
+    stop_time_rows = []
+    trips_per_pattern = max(1, trips // max(1, len(patterns)))
+    span = LAST_DEPARTURE - FIRST_DEPARTURE
+
+    for p, (route_id, pattern) in enumerate(patterns):
+        headsign = stop_rows[pattern[-1]][1]
+        for service_id, _ in SERVICES:
+            # 休日は本数を減らす
+            count = trips_per_pattern if service_id == 'WEEKDAY' else max(1, trips_per_pattern * 2 // 3)
+            headway = span // count
+            offset = rnd.randrange(max(1, headway))
+            for t in range(count):
+                trip_id = '%s_%d_%s_%04d' % (route_id, p % 2, service_id, t)
+                trip_rows.append((route_id, service_id, trip_id, headsign, p % 2))
+
+                departure = FIRST_DEPARTURE + offset + t * headway
+                for seq, stop_index in enumerate(pattern, 1):
+                    time_str = format_time(departure)
+                    stop_time_rows.append((trip_id, time_str, time_str, stop_rows[stop_index][0], seq, headsign, 0, 0))
+                    departure += 60 + rnd.randrange(120)
+
+    write_csv(out_dir, 'trips.txt', ('route_id', 'service_id', 'trip_id', 'trip_headsign', 'direction_id'), trip_rows)
+    write_csv(out_dir, 'stop_times.txt', ('trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence',
+                                          'stop_headsign', 'pickup_type', 'drop_off_type'), stop_time_rows)
+
+    return {
+        'stops': len(stop_rows),
+        'routes': len(route_rows),
+        'trips': len(trip_rows),
+        'stop_times': len(stop_time_rows),
+        'start_date': start_date,
+        'end_date': end_date,
+    }
+
+def read_csv(gtfs_dir, file_name):
+    with open(os.path.join(gtfs_dir, file_name), newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+def to_seconds(time_str):
+    h, m, s = map(int, time_str.split(':'))
+    return h * 3600 + m * 60 + s
+
+def build_realtime_feeds(gtfs_dir, seconds, service_ids, timestamp, seed=0):
+    """seconds（0時からの秒）に走っている便の VehiclePosition / TripUpdate の FeedMessage を返す"""
+    rnd = random.Random(seed)
+    stops = {row['stop_id']: row for row in read_csv(gtfs_dir, 'stops.txt')}
+    trips = {row['trip_id'] for row in read_csv(gtfs_dir, 'trips.txt') if row['service_id'] in service_ids}
+
+    stop_times = {}
+    for row in read_csv(gtfs_dir, 'stop_times.txt'):
+        if row['trip_id'] in trips:
+            stop_times.setdefault(row['trip_id'], []).append(
+                (int(row['stop_sequence']), to_seconds(row['departure_time']), row['stop_id'])
+            )
+
+    vehicles = gtfs_realtime_pb2.FeedMessage()
+    vehicles.header.gtfs_realtime_version = '2.0'
+    vehicles.header.timestamp = timestamp
+    trip_updates = gtfs_realtime_pb2.FeedMessage()
+    trip_updates.header.gtfs_realtime_version = '2.0'
+    trip_updates.header.timestamp = timestamp
+
+    for trip_id, rows in stop_times.items():
+        rows.sort()
+        if not rows[0][1] <= seconds < rows[-1][1]:
+            continue
+
+        delay = int(rnd.expovariate(1 / 90))
+        position = next(i for i, row in enumerate(rows) if row[1] + delay > seconds)
+        seq, _, stop_id = rows[position]
+
+        entity = vehicles.entity.add()
+        entity.id = 'V_' + trip_id
+        vehicle = entity.vehicle
+        vehicle.trip.trip_id = trip_id
+        vehicle.vehicle.id = entity.id
+        vehicle.current_stop_sequence = seq
+        vehicle.stop_id = stop_id
+        vehicle.current_status = gtfs_realtime_pb2.VehiclePosition.IN_TRANSIT_TO
+        vehicle.occupancy_status = min(6, int(rnd.expovariate(1 / 1.5)))
+        vehicle.position.latitude = float(stops[stop_id]['stop_lat'])
+        vehicle.position.longitude = float(stops[stop_id]['stop_lon'])
+        vehicle.timestamp = timestamp
+
+        entity = trip_updates.entity.add()
+        entity.id = 'TU_' + trip_id
+        trip_update = entity.trip_update
+        trip_update.trip.trip_id = trip_id
+        for seq, departure, stop_id in rows[position:]:
+            update = trip_update.stop_time_update.add()
+            update.stop_sequence = seq
+            update.stop_id = stop_id
+            update.departure.delay = delay
+            update.departure.time = timestamp - seconds + departure + delay
+
+    return vehicles, trip_updates
+
+def main():
+    parser = argparse.ArgumentParser(description='合成GTFSを生成')
+    parser.add_argument('out_dir')
+    parser.add_argument('--stops', type=int, default=500)
+    parser.add_argument('--routes', type=int, default=40)
+    parser.add_argument('--trips', type=int, default=4000)
+    parser.add_argument('--service-days', type=int, default=60)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    summary = generate(args.out_dir, stops=args.stops, routes=args.routes, trips=args.trips,
+                       service_days=args.service_days, seed=args.seed)
+    print(summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+import concurrent.futures
+import math
+import random
+import threading
+import time
+
+from common import metrics
+
+# BusCongestion テーブルの読み出しクライアント
+# (trip_id, stop_sequence) → (congestion_sum, count) をプロセス内でTTLキャッシュする
+# boto3 は読み込みに時間がかかるので、最初に DynamoDB を使うときに import する
+
+REGION = 'ap-northeast-1'
+TABLE_NAME = 'BusCongestion'
+
+# DynamoDBのBatchGetItemは最大100件
+BATCH_SIZE = 100
+MAX_WORKERS = 4
+
+# 平均値はゆっくりしか変わらないので数分はメモリから返す
+CACHE_TTL = 300  # 秒
+MAX_CACHE_ENTRIES = 200000
+
+# UnprocessedKeys / スロットリング時の再試行
+DEADLINE = 2.0  # 秒
+BASE_BACKOFF = 0.05
+MAX_BACKOFF = 0.8
+# 読み出しの1回のリクエストの期限は残りの DEADLINE から決める（この刻みで切り上げ、スレッドごとにリソースを使い回す）
+# 再試行は上のループだけで行い、boto3 には再試行させない
+TIMEOUT_STEP = 0.5  # 秒
+
+# 書き込み側（record_congestion）の1回のリクエストの期限と boto3 の再試行（ワーカーのスレッドを長く塞がない）
+CLIENT_CONNECT_TIMEOUT = 2  # 秒
+CLIENT_READ_TIMEOUT = 5
+CLIENT_MAX_ATTEMPTS = 3
+
+RETRYABLE_ERRORS = {
+    'ProvisionedThroughputExceededException',
+    'ThrottlingException',
+    'RequestLimitExceeded',
+    'InternalServerError',
+}
+
+_local = threading.local()
+_executor = None
+_executor_lock = threading.Lock()
+
+_cache = {}  # key → (expires_at, (congestion_sum, count) or None)
+_cache_lock = threading.Lock()
+
+def client_config(timeout=None, total_attempts=None):
+    """timeout（秒）を省略すると書き込み用の期限と boto3 の再試行"""
+    from botocore.config import Config
+    if timeout is None:
+        return Config(
+            connect_timeout=CLIENT_CONNECT_TIMEOUT,
+            read_timeout=CLIENT_READ_TIMEOUT,
+            retries={'max_attempts': CLIENT_MAX_ATTEMPTS, 'mode': 'standard'},
+        )
+    return Config(
+        connect_timeout=timeout,
+        read_timeout=timeout,
+        retries={'total_max_attempts': total_attempts or 1, 'mode': 'standard'},
+    )
+
+def get_resource(remaining=DEADLINE):
+    """残り remaining 秒で終わる（TIMEOUT_STEP 刻みで切り上げた期限の）リソース"""
+    timeout = max(1, math.ceil(remaining / TIMEOUT_STEP)) * TIMEOUT_STEP
+    # boto3 のリソースはスレッドセーフではないのでスレッドごとに作る
+    resources = getattr(_local, 'dynamodb', None)
+    if resources is None:
+        resources = _local.dynamodb = {}
+    resource = resources.get(timeout)
+    if resource is None:
+        import boto3
+        resource = resources[timeout] = boto3.session.Session().resource('dynamodb', region_name=REGION, config=client_config(timeout))
+    return resource
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='congestion')
+        return _executor
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+def _backoff(attempt):
+    # full jitter
+    return random.uniform(0, min(MAX_BACKOFF, BASE_BACKOFF * (2 ** attempt)))
+
+def _fetch_chunk(keys, deadline):
+    from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+    items = {}
+    request_keys = [{'trip_id': trip_id, 'stop_sequence': stop_sequence} for trip_id, stop_sequence in keys]
+    attempt = 0
+
+    while request_keys:
+        try:
+            response = get_resource(deadline - time.monotonic()).batch_get_item(
+                RequestItems={
+                    TABLE_NAME: {
+                        'Keys': request_keys
+                    }
+                }
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERRORS:
+                raise
+            response = None
+        except (ConnectionError, HTTPClientError):
+            # 接続できない・期限内に応答がない（ReadTimeoutError など）。期限が残っていればやり直す
+            response = None
+
+        if response is not None:
+            for item in response['Responses'].get(TABLE_NAME, []):
+                key = (item['trip_id'], int(item['stop_sequence']))
+                items[key] = (item['congestion_sum'], item['count'])
+            request_keys = response.get('UnprocessedKeys', {}).get(TABLE_NAME, {}).get('Keys', [])
+            if not request_keys:
+                break
+
+        delay = _backoff(attempt)
+        attempt += 1
+        if time.monotonic() + delay >= deadline:
+            break
+        time.sleep(delay)
+
+    # 期限内に取れなかったキー
+    unresolved = {(key['trip_id'], int(key['stop_sequence'])) for key in request_keys}
+    return items, unresolved
+
+def _fetch(keys, deadline):
+    chunks = [keys[i:i + BATCH_SIZE] for i in range(0, len(keys), BATCH_SIZE)]
+    items = {}
+    unresolved = set()
+
+    if len(chunks) == 1:
+        results = [_fetch_chunk(chunks[0], deadline)]
+    else:
+        futures = [get_executor().submit(_fetch_chunk, chunk, deadline) for chunk in chunks]
+        results = [future.result() for future in futures]
+
+    for chunk_items, chunk_unresolved in results:
+        items.update(chunk_items)
+        unresolved |= chunk_unresolved
+    return items, unresolved
+
+def _store(entries, expires_at):
+    with _cache_lock:
+        if len(_cache) + len(entries) > MAX_CACHE_ENTRIES:
+            now = time.monotonic()
+            for key in [key for key, (expires, _) in _cache.items() if expires <= now]:
+                del _cache[key]
+            if len(_cache) + len(entries) > MAX_CACHE_ENTRIES:
+                _cache.clear()
+        for key, value in entries.items():
+            _cache[key] = (expires_at, value)
+
+def batch_get(trip_stop_pairs, deadline=DEADLINE):
+    """(trip_id, stop_sequence) のリストから {key: (congestion_sum, count)} を返す（記録がないキーは含まない）"""
+    now = time.monotonic()
+    result = {}
+    missing = []
+    hits = 0
+
+    with _cache_lock:
+        # stop_sequence が文字列で来ても同じキーとしてまとめる
+        for key in dict.fromkeys((trip_id, int(stop_sequence)) for trip_id, stop_sequence in trip_stop_pairs):
+            entry = _cache.get(key)
+            if entry is not None and entry[0] > now:
+                hits += 1
+                if entry[1] is not None:
+                    result[key] = entry[1]
+            else:
+                missing.append(key)
+
+    metrics.cache_lookup('congestion', hits=hits, misses=len(missing))
+    if not missing:
+        return result
+
+    with metrics.stage('dynamodb_batch'):
+        items, unresolved = _fetch(missing, now + deadline)
+
+    # 記録がないキーもキャッシュする（取得できなかったキーは次回また問い合わせる）
+    entries = {key: items.get(key) for key in missing if key not in unresolved}
+    _store(entries, time.monotonic() + CACHE_TTL)
+
+    result.update(items)
+    return result
@@ -0,0 +1,47 @@
+import datetime
+import os
+
+# 取得した GTFS-RT フィードの保存（あとで bench/replay.py で再生する用）
+# 環境変数 GTFS_RT_CAPTURE_DIR を設定したときだけ有効
+#   <GTFS_RT_CAPTURE_DIR>/<operator>/<feed>/<YYYYMMDD>/<取得時刻(ミリ秒)>.pb
+
+CAPTURE_DIR = os.environ.get('GTFS_RT_CAPTURE_DIR', '')
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def is_enabled():
+    return bool(CAPTURE_DIR)
+
+def feed_path(name):
+    """フィード名（キャッシュのパス）を operator/feed に変換。例: yokohamaMunicipal/cache/gtfs_rt → yokohamaMunicipal/gtfs_rt"""
+    parts = os.path.relpath(os.path.abspath(name), SCRIPTS_DIR).split(os.sep)
+    return os.path.join(*[part for part in parts if part not in ('cache', '..')])
+
+def jst_date(fetched_at):
+    return (datetime.datetime.utcfromtimestamp(fetched_at) + datetime.timedelta(hours=9)).strftime('%Y%m%d')
+
+def capture(name, content, fetched_at):
+    if not CAPTURE_DIR:
+        return
+
+    directory = os.path.join(CAPTURE_DIR, feed_path(name), jst_date(fetched_at))
+    os.makedirs(directory, exist_ok=True)
+
+    file_path = os.path.join(directory, '%d.pb' % int(fetched_at * 1000))
+    tmp_path = file_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, file_path)
+
+def list_captures(capture_dir, feed, date):
+    """(取得時刻, ファイルパス) を時刻順で返す"""
+    directory = os.path.join(capture_dir, feed, date)
+    if not os.path.isdir(directory):
+        return []
+
+    captures = []
+    for file_name in os.listdir(directory):
+        if file_name.endswith('.pb'):
+            captures.append((int(file_name[:-3]) / 1000, os.path.join(directory, file_name)))
+    captures.sort()
+    return captures
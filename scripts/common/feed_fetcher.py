@@ -0,0 +1,232 @@
+import asyncio
+import concurrent.futures
+import contextvars
+import hashlib
+import threading
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from google.protobuf.message import DecodeError
+from google.transit import gtfs_realtime_pb2
+from common import feed_capture
+from common import poller_telemetry
+
+# ODPT フィードの取得
+# スレッドごとにキープアライブのセッションを使い回し、ETag / Last-Modified で条件付きGETする
+# ETag / Last-Modified は呼び出し側が処理し終えて mark_processed したときに覚える（処理に失敗したら次も取り直す）
+# フィードのヘッダーの timestamp が前回処理時と同じなら、呼び出し側で処理を丸ごと飛ばせる
+# 非同期版は1つのイベントループ上で httpx の AsyncClient を共有し、デコードなどは小さなワーカープールへ回す
+
+CONNECT_TIMEOUT = 3.05  # 秒
+READ_TIMEOUT = 10
+POOL_SIZE = 4
+
+# フィードごとの取得期限（超えたらリクエストをキャンセル）
+FEED_DEADLINE = 12  # 秒
+MAX_CONNECTIONS = 16
+WORKERS = 2
+
+_local = threading.local()
+_lock = threading.Lock()
+_validators = {}  # url → (etag, last_modified)
+_pending_validators = {}  # フィード名 → (url, (etag, last_modified))。処理し終えたら _validators へ
+_processed = {}  # フィード名 → 最後に処理したバージョン
+_running = {}  # ワーカーで実行中の関数 → concurrent.futures.Future
+
+_async_client = None
+_async_client_loop = None
+_worker_pool = None
+
+class FetchResult:
+    def __init__(self, content, status_code, fetched_at, url=None, validators=None):
+        self.content = content
+        self.status_code = status_code
+        self.fetched_at = fetched_at
+        self.url = url
+        self.validators = validators
+
+    @property
+    def not_modified(self):
+        return self.status_code == 304
+
+def get_session():
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return session
+
+def conditional_headers(url):
+    headers = {}
+    with _lock:
+        etag, last_modified = _validators.get(url, (None, None))
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def response_validators(response_headers):
+    etag = response_headers.get('ETag')
+    last_modified = response_headers.get('Last-Modified')
+    if etag or last_modified:
+        return etag, last_modified
+    return None
+
+def remember_validators(url, validators):
+    if validators is not None:
+        with _lock:
+            _validators[url] = validators
+
+def fetch(url, conditional=True):
+    headers = conditional_headers(url) if conditional else {}
+
+    fetched_at = time.time()
+    with poller_telemetry.phase('fetch'):
+        response = get_session().get(url, headers=headers, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+
+    if response.status_code == 304:
+        poller_telemetry.set_status('not_modified')
+        return FetchResult(None, 304, fetched_at)
+
+    response.raise_for_status()
+
+    validators = response_validators(response.headers) if conditional else None
+    return FetchResult(response.content, response.status_code, fetched_at, url, validators)
+
+# ==== 非同期版 ====
+def get_async_client():
+    # イベントループごとに1つ（コネクションプールを全フィードで共有）
+    global _async_client, _async_client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=MAX_CONNECTIONS, max_keepalive_connections=MAX_CONNECTIONS),
+        )
+        _async_client_loop = loop
+    return _async_client
+
+async def close_async_client():
+    global _async_client, _async_client_loop
+    if _async_client is not None:
+        await _async_client.aclose()
+    _async_client = None
+    _async_client_loop = None
+
+async def fetch_async(url, conditional=True, deadline=FEED_DEADLINE):
+    headers = conditional_headers(url) if conditional else {}
+
+    fetched_at = time.time()
+    # 期限を過ぎたら wait_for がリクエストごとキャンセルする
+    with poller_telemetry.phase('fetch'):
+        response = await asyncio.wait_for(get_async_client().get(url, headers=headers), deadline)
+
+    if response.status_code == 304:
+        poller_telemetry.set_status('not_modified')
+        return FetchResult(None, 304, fetched_at)
+
+    response.raise_for_status()
+
+    validators = response_validators(response.headers) if conditional else None
+    return FetchResult(response.content, response.status_code, fetched_at, url, validators)
+
+def get_worker_pool():
+    global _worker_pool
+    with _lock:
+        if _worker_pool is None:
+            _worker_pool = concurrent.futures.ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='feed')
+        return _worker_pool
+
+async def run_in_worker(func, *args):
+    """protobuf のデコードや DynamoDB への書き込みなどをイベントループの外で実行"""
+    # 期限切れで待つのをやめてもワーカーのスレッドは止まらないので、前回の実行が終わるまで同じ処理は投入しない
+    # （飛ばしたフィードは mark_processed されないので次のサイクルで取り直す）
+    pool = get_worker_pool()
+    with _lock:
+        previous = _running.get(func)
+        if previous is not None and not previous.done():
+            print(f"{func.__name__} の前回の実行がワーカーで続いているので飛ばします")
+            poller_telemetry.set_status('worker_busy')
+            return None
+        # 別スレッドの submit は contextvars を引き継がないので、実行中のサイクル（poller_telemetry）ごと渡す
+        context = contextvars.copy_context()
+        future = _running[func] = pool.submit(context.run, func, *args)
+    return await asyncio.wrap_future(future)
+
+def _read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+def read_header_timestamp(content):
+    """FeedMessage 全体をパースせず、先頭の header (field 1) だけ読んで timestamp を返す。なければ 0"""
+    try:
+        if not content or content[0] != 0x0A:  # field 1, wire type 2
+            return 0
+        length, pos = _read_varint(content, 1)
+        header = gtfs_realtime_pb2.FeedHeader()
+        header.ParseFromString(content[pos:pos + length])
+        return header.timestamp
+    except (IndexError, DecodeError):
+        return 0
+
+def feed_version(content):
+    # ヘッダーに timestamp がないフィード（JSONなど）は内容のハッシュで比較
+    timestamp = read_header_timestamp(content)
+    if timestamp:
+        return timestamp
+    return hashlib.sha1(content).hexdigest()
+
+def is_processed(name, version):
+    with _lock:
+        return _processed.get(name) == version
+
+def mark_processed(name, version):
+    with _lock:
+        _processed[name] = version
+        pending = _pending_validators.pop(name, None)
+    if pending is not None:
+        remember_validators(*pending)
+
+def new_feed(response, name):
+    if response.not_modified:
+        return None
+
+    version = feed_version(response.content)
+    poller_telemetry.feed_received(
+        response.content, version if isinstance(version, int) else None, response.fetched_at
+    )
+    if is_processed(name, version):
+        poller_telemetry.set_status('unchanged')
+        remember_validators(response.url, response.validators)
+        return None
+
+    with _lock:
+        _pending_validators[name] = (response.url, response.validators)
+
+    # GTFS_RT_CAPTURE_DIR が設定されていれば再生用に保存
+    if feed_capture.is_enabled():
+        try:
+            feed_capture.capture(name, response.content, response.fetched_at)
+        except OSError as e:
+            print('⚠️ failed to capture feed:', e)
+
+    return response.content, version
+
+def fetch_new_feed(url, name):
+    """フィードを取得して (content, version) を返す。前回処理したものと同じなら None"""
+    return new_feed(fetch(url), name)
+
+async def fetch_new_feed_async(url, name):
+    return new_feed(await fetch_async(url), name)
@@ -0,0 +1,64 @@
+import os
+import pickle
+import threading
+
+from common import metrics
+
+# ファイルから読み込んだデータをプロセス内に保持する
+# ファイルが差し替えられる（os.replace で inode / mtime が変わる）まではリクエストごとに読み直さない
+
+_cache = {}  # file_path → (signature, value)
+_lock = threading.Lock()
+_file_locks = {}
+
+def signature(file_path):
+    stat = os.stat(file_path)
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+def file_lock(file_path):
+    with _lock:
+        lock = _file_locks.get(file_path)
+        if lock is None:
+            lock = _file_locks[file_path] = threading.Lock()
+        return lock
+
+def load(file_path, loader, name=None):
+    """loader(file_path) の結果を返す。ファイルがなければ FileNotFoundError"""
+    name = name or os.path.basename(file_path)
+    current = signature(file_path)
+    entry = _cache.get(file_path)
+    if entry is not None and entry[0] == current:
+        metrics.cache_lookup(name, hits=1)
+        return entry[1]
+
+    # 同時に来たリクエストで同じファイルを何度も読まない
+    with file_lock(file_path):
+        current = signature(file_path)
+        entry = _cache.get(file_path)
+        if entry is not None and entry[0] == current:
+            metrics.cache_lookup(name, hits=1)
+            return entry[1]
+
+        metrics.cache_lookup(name, misses=1)
+        value = loader(file_path)
+        _cache[file_path] = (current, value)
+        return value
+
+def is_loaded(file_path):
+    """file_path を読み込み済みで、その後差し替えられていなければ True"""
+    entry = _cache.get(file_path)
+    try:
+        return entry is not None and entry[0] == signature(file_path)
+    except FileNotFoundError:
+        return False
+
+def read_pickle(file_path):
+    with open(file_path, 'rb') as f:
+        return pickle.load(f)
+
+def load_pickle(file_path, name=None):
+    return load(file_path, read_pickle, name)
+
+def clear():
+    with _lock:
+        _cache.clear()
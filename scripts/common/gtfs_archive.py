@@ -0,0 +1,119 @@
+import csv
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+
+from common import feed_fetcher
+
+# GTFS(zip) のダウンロードと展開
+# メモリに載せずに一時ファイルへストリーミングし、使うファイルだけを新しいディレクトリへ展開してから差し替える
+# gtfs_data は展開先ディレクトリへのシンボリックリンクにして、差し替えを1回の rename で済ませる
+
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_READ_TIMEOUT = 60  # 秒（チャンク間）
+MAX_ARCHIVE_BYTES = 1024 * 1024 * 1024
+
+# 検索インデックス・時刻表で使うファイル
+REQUIRED_MEMBERS = ('stops.txt', 'stop_times.txt', 'trips.txt', 'routes.txt', 'calendar.txt')
+OPTIONAL_MEMBERS = ('calendar_dates.txt', 'translations.txt')
+
+class ArchiveError(Exception):
+    pass
+
+def download(url, dest_dir):
+    """zip を dest_dir 内の一時ファイルへ保存してパスを返す。新しいデータがなければ (200以外) None"""
+    os.makedirs(dest_dir, exist_ok=True)
+    response = feed_fetcher.get_session().get(
+        url, stream=True, timeout=(feed_fetcher.CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+    )
+
+    with response:
+        if response.status_code != 200:
+            return None
+
+        expected_length = response.headers.get('Content-Length')
+        fd, archive_path = tempfile.mkstemp(suffix='.zip', dir=dest_dir)
+        try:
+            received = 0
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    received += len(chunk)
+                    if received > MAX_ARCHIVE_BYTES:
+                        raise ArchiveError('archive is too large')
+                    f.write(chunk)
+
+            if expected_length is not None and int(expected_length) != received:
+                raise ArchiveError(f'incomplete download: {received} / {expected_length} bytes')
+
+            verify(archive_path)
+        except BaseException:
+            os.remove(archive_path)
+            raise
+
+    return archive_path
+
+def verify(archive_path):
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            names = set(archive.namelist())
+            missing = [name for name in REQUIRED_MEMBERS if name not in names]
+            if missing:
+                raise ArchiveError('missing members: ' + ', '.join(missing))
+
+            # 使うファイルだけ CRC を確認
+            for name in REQUIRED_MEMBERS + OPTIONAL_MEMBERS:
+                if name in names:
+                    with archive.open(name) as member:
+                        while member.read(CHUNK_SIZE):
+                            pass
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f'broken archive: {e}')
+
+def members(archive):
+    names = set(archive.namelist())
+    return [name for name in REQUIRED_MEMBERS + OPTIONAL_MEMBERS if name in names]
+
+def iter_csv(archive, file_name):
+    """展開せずに zip 内の CSV を1行ずつ読む"""
+    with archive.open(file_name) as raw:
+        yield from csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+
+def extract(archive, target_dir):
+    """使うファイルだけを target_dir と同じ階層の新しいディレクトリへ展開し、そのパスを返す"""
+    parent = os.path.dirname(os.path.abspath(target_dir))
+    staging_dir = tempfile.mkdtemp(prefix=os.path.basename(target_dir) + '.' + time.strftime('%Y%m%d%H%M%S') + '.', dir=parent)
+
+    try:
+        for name in members(archive):
+            with archive.open(name) as src, open(os.path.join(staging_dir, name), 'wb') as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        os.chmod(staging_dir, 0o755)
+    except BaseException:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    return staging_dir
+
+def publish(staging_dir, target_dir):
+    """target_dir のシンボリックリンクを staging_dir へ付け替え、古い展開先を消す"""
+    target_dir = os.path.abspath(target_dir.rstrip('/'))
+    previous = os.path.realpath(target_dir) if os.path.islink(target_dir) else None
+
+    # 初回のみ: 以前の実ディレクトリを退避
+    if os.path.isdir(target_dir) and not os.path.islink(target_dir):
+        legacy_dir = target_dir + '.legacy'
+        shutil.rmtree(legacy_dir, ignore_errors=True)
+        os.rename(target_dir, legacy_dir)
+        previous = legacy_dir
+
+    tmp_link = target_dir + '.link'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(os.path.basename(staging_dir), tmp_link)
+    os.replace(tmp_link, target_dir)
+
+    if previous and previous != os.path.realpath(staging_dir):
+        shutil.rmtree(previous, ignore_errors=True)
@@ -0,0 +1,294 @@
+import argparse
+import array
+import bisect
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+# 検索用インデックスなどを1ファイルにまとめるバイナリ形式
+# 読む側は mmap して memoryview を切り出すだけで、pickle のようにオブジェクトを組み立て直さない
+#
+#   ヘッダ（40バイト）: magic, version, バイトオーダー, セクション数, CRC32（ヘッダより後ろ全部）, 予約, 種類
+#   セクション表（1件56バイト）: 名前, 型, ファイル先頭からの位置, バイト数
+#   各セクションの中身（8バイト境界に揃える）
+#
+# セクションの型
+#   i / q / d : int32 / int64 / float64 の配列
+#   s         : 文字列の表  [件数 q][先頭位置 q × (件数 + 1)][UTF-8 を \0 区切りで連結]
+#   c         : CSR         [行数 q][先頭位置 q × (行数 + 1)][値 i × 合計]
+#
+# 数値はビルドしたマシンのバイトオーダーのまま書き、違うマシンでは開かない（ビルドと API は同じホスト）
+#
+#   python -m common.index_format <file>                       # ヘッダとセクション一覧
+#   python -m common.index_format <file> -s stop_names -n 20   # セクションの中身
+
+MAGIC = b'BUSIDX\0\0'
+VERSION = 1
+
+HEADER = struct.Struct('<8sHHIII16s')
+SECTION = struct.Struct('<32sc7xQQ')
+COUNT = struct.Struct('<q')
+
+BYTE_ORDERS = {'little': 1, 'big': 2}
+
+ALIGNMENT = 8
+
+class FormatError(ValueError):
+    pass
+
+# ==== 書き込み ====
+def encode_array(typecode, values):
+    return array.array(typecode, values).tobytes()
+
+def encode_strings(values):
+    offsets = array.array('q', [0])
+    chunks = []
+    for value in values:
+        data = value.encode('utf-8') + b'\0'
+        chunks.append(data)
+        offsets.append(offsets[-1] + len(data))
+    return COUNT.pack(len(values)) + offsets.tobytes() + b''.join(chunks)
+
+def encode_csr(rows):
+    offsets = array.array('q', [0])
+    values = array.array('i')
+    for row in rows:
+        values.extend(row)
+        offsets.append(len(values))
+    return COUNT.pack(len(offsets) - 1) + offsets.tobytes() + values.tobytes()
+
+def encode(kind, arrays=None, strings=None, csrs=None):
+    """arrays は name → (型, 値のリスト)、strings は name → 文字列のリスト、csrs は name → int のリストのリスト"""
+    sections = []
+    for name, (typecode, values) in (arrays or {}).items():
+        sections.append((name, typecode, encode_array(typecode, values)))
+    for name, values in (strings or {}).items():
+        sections.append((name, 's', encode_strings(values)))
+    for name, rows in (csrs or {}).items():
+        sections.append((name, 'c', encode_csr(rows)))
+
+    position = HEADER.size + SECTION.size * len(sections)
+    table = []
+    payload = []
+    for name, typecode, data in sections:
+        padding = -position % ALIGNMENT
+        payload.append(b'\0' * padding)
+        position += padding
+        table.append(SECTION.pack(name.encode('utf-8'), typecode.encode('ascii'), position, len(data)))
+        payload.append(data)
+        position += len(data)
+
+    body = b''.join(table) + b''.join(payload)
+    header = HEADER.pack(
+        MAGIC, VERSION, BYTE_ORDERS[sys.byteorder], len(sections), zlib.crc32(body), 0, kind.encode('utf-8')
+    )
+    return header + body
+
+def write(file_path, kind, arrays=None, strings=None, csrs=None):
+    with open(file_path, 'wb') as f:
+        f.write(encode(kind, arrays, strings, csrs))
+
+# ==== 読み込み ====
+class StringTable:
+    """i 番目を取り出すときだけデコードする文字列の列"""
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1] - 1]).decode('utf-8')
+
+    def find_all(self, text):
+        """text を部分文字列に含む要素の番号（昇順）"""
+        if not text:
+            return list(range(len(self)))
+
+        needle = text.encode('utf-8')
+        found = []
+        position = self.blob.find(needle)
+        while position != -1:
+            i = bisect.bisect_right(self.offsets, position) - 1
+            found.append(i)
+            # 同じ要素の中の2つ目以降は飛ばす
+            position = self.blob.find(needle, self.offsets[i + 1])
+        return found
+
+    def raw(self, i):
+        return self.blob[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def bisect_left(self, key):
+        """昇順に並んだ表で、UTF-8 のバイト列 key を入れる位置"""
+        lo, hi = 0, len(self)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.raw(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def index(self, value):
+        """昇順に並んだ表から value の番号を探す（なければ -1）"""
+        key = value.encode('utf-8')
+        i = self.bisect_left(key)
+        if i < len(self) and self.raw(i) == key:
+            return i
+        return -1
+
+    def prefix_range(self, prefix):
+        """昇順に並んだ表で prefix から始まる要素の番号の範囲 [start, end)"""
+        key = prefix.encode('utf-8')
+        # UTF-8 に 0xff は出てこないので、prefix から始まる要素はすべて key + 0xff より前
+        return self.bisect_left(key), self.bisect_left(key + b'\xff')
+
+class CSR:
+    """行ごとに長さの違う int の列"""
+
+    def __init__(self, offsets, values):
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return self.values[self.offsets[i]:self.offsets[i + 1]]
+
+class Blob:
+    """mmap の一部。bytes と同じく find と比較ができる"""
+
+    def __init__(self, buffer, start, end):
+        self.buffer = buffer
+        self.start = start
+        self.end = end
+
+    def find(self, needle, start=0):
+        position = self.buffer.find(needle, self.start + start, self.end)
+        return -1 if position == -1 else position - self.start
+
+    def __getitem__(self, key):
+        return self.buffer[self.start + key.start:self.start + key.stop]
+
+class Container:
+    def __init__(self, file_path, verify=True):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            # 空のファイルは mmap できないので先に長さを見る
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise FormatError(f'{file_path}: too short')
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.buffer)
+
+        magic, version, byte_order, count, checksum, _, kind = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC:
+            raise FormatError(f'{file_path}: not an index file')
+        if version != VERSION:
+            raise FormatError(f'{file_path}: unsupported version {version}')
+        if byte_order != BYTE_ORDERS[sys.byteorder]:
+            raise FormatError(f'{file_path}: built on a machine with a different byte order')
+        if verify and zlib.crc32(self.view[HEADER.size:]) != checksum:
+            raise FormatError(f'{file_path}: checksum mismatch')
+
+        self.version = version
+        self.checksum = checksum
+        self.kind = kind.rstrip(b'\0').decode('utf-8')
+        # verify=False でも途中で切れたファイルを struct.error や範囲外の読み出しにしない
+        if HEADER.size + SECTION.size * count > len(self.buffer):
+            raise FormatError(f'{file_path}: truncated section table')
+        self.sections = {}
+        for i in range(count):
+            name, typecode, offset, size = SECTION.unpack_from(self.buffer, HEADER.size + SECTION.size * i)
+            name = name.rstrip(b'\0').decode('utf-8')
+            if offset + size > len(self.buffer):
+                raise FormatError(f'{file_path}: section {name} is truncated')
+            self.sections[name] = (typecode.decode('ascii'), offset, size)
+
+    def has(self, name):
+        return name in self.sections
+
+    def section(self, name, typecode):
+        actual, offset, size = self.sections[name]
+        if actual != typecode:
+            raise FormatError(f'{self.file_path}: section {name} is {actual}, not {typecode}')
+        return offset, size
+
+    def counted(self, offset):
+        """[件数][先頭位置 × (件数 + 1)] を読み、(先頭位置, その後ろの位置) を返す"""
+        count = COUNT.unpack_from(self.buffer, offset)[0]
+        start = offset + COUNT.size
+        end = start + 8 * (count + 1)
+        return self.view[start:end].cast('q'), end
+
+    def array(self, name, typecode):
+        offset, size = self.section(name, typecode)
+        return self.view[offset:offset + size].cast(typecode)
+
+    def strings(self, name):
+        offset, size = self.section(name, 's')
+        offsets, start = self.counted(offset)
+        return StringTable(Blob(self.buffer, start, offset + size), offsets)
+
+    def csr(self, name):
+        offset, size = self.section(name, 'c')
+        offsets, start = self.counted(offset)
+        return CSR(offsets, self.view[start:offset + size].cast('i'))
+
+    def read(self, name):
+        """セクションの中身を型にかかわらず列として返す（dump 用）"""
+        typecode = self.sections[name][0]
+        if typecode == 's':
+            return self.strings(name)
+        if typecode == 'c':
+            return self.csr(name)
+        return self.array(name, typecode)
+
+def open_file(file_path, verify=True):
+    return Container(file_path, verify)
+
+# ==== dump ====
+def format_item(item):
+    if isinstance(item, memoryview):
+        return str(item.tolist())
+    return str(item)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='インデックスファイルの中身を表示')
+    parser.add_argument('file')
+    parser.add_argument('-s', '--section', help='中身を表示するセクション')
+    parser.add_argument('-n', '--limit', type=int, default=20, help='表示する件数（0 で全部）')
+    args = parser.parse_args(argv)
+
+    try:
+        container = open_file(args.file)
+    except FormatError as e:
+        print('❌', e)
+        return 1
+
+    if args.section is None:
+        print(f'kind: {container.kind}  version: {container.version}  crc32: {container.checksum:08x}  size: {len(container.buffer)}')
+        print(f"{'section':<24} {'type':>4} {'items':>9} {'bytes':>10}")
+        for name, (typecode, _, size) in container.sections.items():
+            print(f'{name:<24} {typecode:>4} {len(container.read(name)):>9} {size:>10}')
+        return 0
+
+    if not container.has(args.section):
+        print('no such section:', args.section)
+        return 1
+
+    values = container.read(args.section)
+    count = len(values) if args.limit == 0 else min(args.limit, len(values))
+    for i in range(count):
+        print(f'{i}\t{format_item(values[i])}')
+    if count < len(values):
+        print(f'... {len(values) - count} more')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
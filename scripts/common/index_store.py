@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+from common import file_cache
+from common import index_format
+
+# 検索用インデックスなどの読み取り専用の生成物
+# <root>/gen-<時刻>-<pid>.idx（common/index_format の形式）を書き、<root>/current のシンボリックリンクを張り替えて切り替える
+# 読む側は mmap で開くだけなので、uvicorn のワーカーが何個あっても同じページキャッシュを共有する
+# 切り替え前の世代を開いているワーカーは、ファイルが消されてもマップしたまま読み続けられる
+
+CURRENT = 'current'
+
+# 残しておく世代数（切り替え直後に古い世代を開こうとしたワーカー用）
+KEEP_GENERATIONS = 2
+
+_publish_locks = {}  # root → threading.RLock
+_publish_locks_guard = threading.Lock()
+
+def publish_lock(root):
+    """root への書き出しを直列にするロック（同じプロセスの複数のスレッドから publish する場合）"""
+    root = os.path.abspath(root)
+    with _publish_locks_guard:
+        lock = _publish_locks.get(root)
+        if lock is None:
+            lock = _publish_locks[root] = threading.RLock()
+        return lock
+
+def publish(root, kind, arrays=None, strings=None, csrs=None):
+    """新しい世代を書き出して current を切り替え、そのファイルのパスを返す"""
+    os.makedirs(root, exist_ok=True)
+    # 一時ファイルの名前はスレッドごとに分ける（プロセスをまたいだ書き出しはリンクの置き換えで後勝ち）
+    writer = f'{os.getpid()}.{threading.get_ident()}'
+    generation = os.path.join(root, f'gen-{time.time_ns()}-{writer}.idx')
+    tmp_path = generation + '.tmp'
+
+    with publish_lock(root):
+        try:
+            index_format.write(tmp_path, kind, arrays, strings, csrs)
+            os.rename(tmp_path, generation)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # シンボリックリンクも一時的な名前で作ってから置き換える
+        link_tmp = os.path.join(root, f'{CURRENT}.{writer}.tmp')
+        if os.path.lexists(link_tmp):
+            os.remove(link_tmp)
+        os.symlink(os.path.basename(generation), link_tmp)
+        os.replace(link_tmp, os.path.join(root, CURRENT))
+
+        prune(root)
+    return generation
+
+def prune(root, keep=KEEP_GENERATIONS):
+    current = os.path.realpath(os.path.join(root, CURRENT))
+    generations = sorted(
+        (name for name in os.listdir(root) if name.startswith('gen-') and name.endswith('.idx')),
+        key=lambda name: int(name.split('-')[1]),
+    )
+    for name in generations[:-keep]:
+        generation = os.path.join(root, name)
+        if generation != current:
+            try:
+                os.remove(generation)
+            except FileNotFoundError:
+                pass
+
+def current_kind(root):
+    """current の世代の種類（なければ None）"""
+    try:
+        return index_format.open_file(os.path.join(root, CURRENT), verify=False).kind
+    except (FileNotFoundError, index_format.FormatError):
+        return None
+
+def is_loaded(root):
+    """current の世代をこのプロセスで開いてあれば True"""
+    return file_cache.is_loaded(os.path.join(root, CURRENT))
+
+def load(root, reader, name=None):
+    """current の世代を reader(index_format.Container) で開いた結果を返す。切り替わるまではプロセス内で使い回す"""
+    return file_cache.load(
+        os.path.join(root, CURRENT),
+        lambda link: reader(index_format.open_file(os.path.realpath(link))),
+        name,
+    )
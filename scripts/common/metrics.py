@@ -0,0 +1,171 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+# Prometheus のテキスト形式で出すためのメトリクス（外部ライブラリなし）
+# 値はプロセスごと。uvicorn をワーカー複数で動かす場合はワーカーごとに集計される
+
+# 秒
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# バイト
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+# リクエスト中の (route, operator)。ステージの計測に使う
+_request_labels = contextvars.ContextVar('request_labels', default=None)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+        with self.lock:
+            items = sorted(self.values.items())
+        for key, value in items:
+            lines.extend(self.render_value(key, value))
+        return lines
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(key)
+            if entry is None:
+                # [各バケットの件数..., 合計, 件数]
+                entry = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def render_value(self, key, value):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, value):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, [("le", "+Inf")])} {value[-1]}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(value[-2])}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {value[-1]}')
+        return lines
+
+def register(metric):
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+def counter(name, help, labelnames=()):
+    return register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+    return register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+    return register(Histogram(name, help, labelnames, buckets))
+
+def render():
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# ==== API ====
+REQUEST_DURATION = histogram(
+    'buscom_http_request_duration_seconds', 'Request latency by route.', ('route', 'operator', 'method', 'status')
+)
+RESPONSE_SIZE = histogram(
+    'buscom_http_response_size_bytes', 'Response body size by route.', ('route', 'operator'), SIZE_BUCKETS
+)
+STAGE_DURATION = histogram(
+    'buscom_stage_duration_seconds', 'Time spent in each stage of a request.', ('route', 'operator', 'stage')
+)
+CACHE_LOOKUPS = counter(
+    'buscom_cache_lookups_total', 'In-process cache lookups by result (hit / miss).', ('cache', 'result')
+)
+
+def set_request(route, operator):
+    return _request_labels.set((route, operator))
+
+def reset_request(token):
+    _request_labels.reset(token)
+
+@contextlib.contextmanager
+def stage(name):
+    """リクエスト内の処理時間をステージ名つきで記録（リクエスト外では何もしない）"""
+    labels = _request_labels.get()
+    if labels is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - started_at, route=labels[0], operator=labels[1], stage=name)
+
+def cache_lookup(cache, hits=0, misses=0):
+    if hits:
+        CACHE_LOOKUPS.inc(hits, cache=cache, result='hit')
+    if misses:
+        CACHE_LOOKUPS.inc(misses, cache=cache, result='miss')
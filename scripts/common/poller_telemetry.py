@@ -0,0 +1,215 @@
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+
+from common import metrics
+
+# invoker.py の各サイクルの計測
+# 実行中のサイクルは contextvar で持ち回るので、feed_fetcher や record_congestion からは phase() / add() を呼ぶだけでよい
+# サイクルが終わるたびに Prometheus の textfile（node_exporter の textfile collector 用）と直近の状況の JSON を書き出す
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+METRICS_TEXTFILE_PATH = os.environ.get('POLLER_METRICS_PATH', SCRIPTS_DIR + '/cache/poller.prom')
+STATUS_PATH = os.environ.get('POLLER_STATUS_PATH', SCRIPTS_DIR + '/cache/poller_status.json')
+
+# JSON に残す直近のサイクル数（タスクごと）
+WINDOW = 40
+
+# タイムアウトに対して p90 がこの割合を超えたら at_risk
+RISK_RATIO = 0.8
+
+PHASES = ('fetch', 'parse', 'write')
+
+CYCLE_DURATION = metrics.histogram(
+    'buscom_poller_cycle_duration_seconds', 'Wall time of a poller cycle.', ('task', 'status')
+)
+PHASE_DURATION = metrics.histogram(
+    'buscom_poller_phase_duration_seconds', 'Time spent fetching, parsing and writing in a cycle.', ('task', 'phase')
+)
+FEED_BYTES = metrics.histogram(
+    'buscom_poller_feed_bytes', 'Size of the fetched feed.', ('task',), metrics.SIZE_BUCKETS
+)
+CYCLES = metrics.counter('buscom_poller_cycles_total', 'Poller cycles by result.', ('task', 'status'))
+ENTITIES = metrics.counter('buscom_poller_entities_total', 'Feed entities processed.', ('task',))
+WRITES = metrics.counter('buscom_poller_writes_total', 'DynamoDB writes.', ('task',))
+THROTTLES = metrics.counter('buscom_poller_throttles_total', 'Throttled DynamoDB requests.', ('task',))
+FEED_LAG = metrics.gauge(
+    'buscom_poller_feed_lag_seconds', 'Fetch time minus the feed header timestamp.', ('task',)
+)
+BUDGET_RATIO = metrics.gauge(
+    'buscom_poller_budget_ratio', 'Wall time of the last cycle divided by its timeout.', ('task',)
+)
+LAST_SUCCESS = metrics.gauge(
+    'buscom_poller_last_success_timestamp_seconds', 'Unix time of the last successful cycle.', ('task',)
+)
+
+_current = contextvars.ContextVar('poller_cycle', default=None)
+_recent = {}  # task → deque of cycle dict
+_recent_lock = threading.Lock()  # サイクルはイベントループとワーカーのスレッドの両方から記録される
+_tasks = {}  # task → {'interval': ..., 'timeout': ...}
+
+class Cycle:
+    def __init__(self, task):
+        self.task = task
+        self.started_at = time.time()
+        self.status = 'ok'
+        self.wall = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.bytes = 0
+        self.entities = 0
+        self.writes = 0
+        self.throttles = 0
+        self.feed_timestamp = None
+        self.lag = None
+
+    def as_dict(self):
+        return {
+            'started_at': round(self.started_at, 3),
+            'status': self.status,
+            'wall': round(self.wall, 4),
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            'bytes': self.bytes,
+            'entities': self.entities,
+            'writes': self.writes,
+            'throttles': self.throttles,
+            'feed_timestamp': self.feed_timestamp,
+            'lag': None if self.lag is None else round(self.lag, 1),
+        }
+
+def register_task(task, interval=None, timeout=None):
+    _tasks[task] = {'interval': interval, 'timeout': timeout}
+
+def start(task):
+    cycle = Cycle(task)
+    return cycle, _current.set(cycle)
+
+def current():
+    return _current.get()
+
+@contextlib.contextmanager
+def phase(name):
+    """実行中のサイクルに name の処理時間を足す（サイクル外では何もしない）"""
+    cycle = _current.get()
+    if cycle is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        cycle.phases[name] = cycle.phases.get(name, 0.0) + time.perf_counter() - started_at
+
+def add(field, amount=1):
+    cycle = _current.get()
+    if cycle is not None:
+        setattr(cycle, field, getattr(cycle, field) + amount)
+
+def set_status(status):
+    cycle = _current.get()
+    if cycle is not None:
+        cycle.status = status
+
+def feed_received(content, feed_timestamp, fetched_at):
+    cycle = _current.get()
+    if cycle is None:
+        return
+    cycle.bytes += len(content)
+    if feed_timestamp:
+        cycle.feed_timestamp = feed_timestamp
+        cycle.lag = fetched_at - feed_timestamp
+
+def finish(cycle, token, status=None):
+    _current.reset(token)
+    cycle.wall = time.time() - cycle.started_at
+    if status is not None:
+        cycle.status = status
+    record(cycle)
+
+def record(cycle):
+    task = cycle.task
+    CYCLE_DURATION.observe(cycle.wall, task=task, status=cycle.status)
+    CYCLES.inc(task=task, status=cycle.status)
+    for name, seconds in cycle.phases.items():
+        if seconds:
+            PHASE_DURATION.observe(seconds, task=task, phase=name)
+    if cycle.bytes:
+        FEED_BYTES.observe(cycle.bytes, task=task)
+    ENTITIES.inc(cycle.entities, task=task)
+    WRITES.inc(cycle.writes, task=task)
+    THROTTLES.inc(cycle.throttles, task=task)
+    if cycle.lag is not None:
+        FEED_LAG.set(round(cycle.lag, 1), task=task)
+    timeout = _tasks.get(task, {}).get('timeout')
+    if timeout:
+        BUDGET_RATIO.set(round(cycle.wall / timeout, 3), task=task)
+    if cycle.status in ('ok', 'not_modified'):
+        LAST_SUCCESS.set(round(time.time()), task=task)
+
+    with _recent_lock:
+        _recent.setdefault(task, collections.deque(maxlen=WINDOW)).append(cycle.as_dict())
+
+    try:
+        write_files()
+    except OSError as e:
+        print('⚠️ failed to write poller telemetry:', e)
+
+def record_skip(task, status):
+    """前回が終わっていない・遅れて飛ばした回など、実行しなかった回の記録"""
+    CYCLES.inc(task=task, status=status)
+    with _recent_lock:
+        _recent.setdefault(task, collections.deque(maxlen=WINDOW)).append(
+            {'started_at': round(time.time(), 3), 'status': status}
+        )
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def summarize(task, cycles):
+    walls = [cycle['wall'] for cycle in cycles if 'wall' in cycle]
+    statuses = collections.Counter(cycle['status'] for cycle in cycles)
+    timeout = _tasks.get(task, {}).get('timeout')
+    p90 = percentile(walls, 90)
+    last = next((cycle for cycle in reversed(cycles) if 'wall' in cycle), None)
+    return {
+        'interval': _tasks.get(task, {}).get('interval'),
+        'timeout': timeout,
+        'cycles': len(cycles),
+        'statuses': dict(statuses),
+        'wall_p50': percentile(walls, 50),
+        'wall_p90': p90,
+        'wall_max': max(walls) if walls else None,
+        'budget_p90': round(p90 / timeout, 3) if timeout and p90 is not None else None,
+        # タイムアウト・重複スキップが出る前に気づけるように
+        'at_risk': bool(timeout and p90 is not None and p90 > timeout * RISK_RATIO),
+        'lag': last['lag'] if last else None,
+        'last': cycles[-1],
+    }
+
+def status():
+    with _recent_lock:
+        recent = {task: list(cycles) for task, cycles in _recent.items()}
+    return {
+        'updated_at': round(time.time(), 3),
+        'tasks': {task: summarize(task, cycles) for task, cycles in sorted(recent.items())},
+    }
+
+def write_atomic(file_path, text):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    # 書き出すスレッドが重なっても一時ファイルを取り合わないように
+    tmp_path = f'{file_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, file_path)
+
+def write_files():
+    write_atomic(METRICS_TEXTFILE_PATH, metrics.render())
+    write_atomic(STATUS_PATH, json.dumps(status(), ensure_ascii=False, indent=1))
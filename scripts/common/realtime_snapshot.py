@@ -0,0 +1,295 @@
+import datetime
+
+from common import index_format
+from common import index_store
+from common import stop_index
+from common import timetable
+
+# 走っている便の、これから通る停留所すべての予測出発時刻（ポーラーがフィードを受け取るたびに書き出す）
+# 時刻表（common/timetable）のパターンの時刻を平たい配列のまま取り出し、
+# 車両位置・TripUpdate の遅れを便ごとに後ろの停留所へ伸ばして予定の時刻に足す（便ごとのループを書かずに numpy でまとめて計算する）
+# API は書き出したものを読むだけで numpy を使わないので、import は書き出す関数の中でする
+#
+#   trip_ids[v]        : 便 v の trip_id（昇順）
+#   trip_stops[v]      : 便 v がこれから通る停留所（stop_ids の番号。今向かっている停留所から終点まで）
+#   trip_sequences[v]  : その stop_sequence
+#   trip_departures[v] : その予測出発時刻（運行日の0時からの秒。0時の UNIX 時刻は trip_base[v]）
+#   trip_delay[v]      : 今向かっている停留所での遅れ（秒）
+#   trip_occupancy[v]  : 車両位置の occupancy_status（わからなければ -1）
+#   trip_route[v] / trip_headsign[v] : routes / headsigns の番号
+#   stop_trips[s]      : 停留所 s に向かっている車両の [便, あと何停留所, 便, あと何停留所, ...]（予測出発の早い順）
+#                        車両位置のある便だけ（TripUpdate だけの便はまだ出ていないかもしれないので入れない）
+
+SNAPSHOT_KIND = 'realtime/2'
+
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+# 停留所に向かっている車両を何台返すか（省略したとき / 上限）
+LIVE_LIMIT = 10
+MAX_LIVE_LIMIT = 50
+
+# generated_at（フィードの時刻）からこれより経った予測時刻は返さない（ポーラーが止まった・フィードが更新されない）
+# 車両位置・TripUpdate の取得間隔（15〜30秒）の数回分と、フィード自体の遅れを見込む
+STALE_SECONDS = 120
+
+# 便ごとに時刻をずらして、まとめて累積最大を取るときの幅（24時以降の便も入る）
+TRIP_STRIDE = 1 << 20
+
+def service_day_bases(start_dates, now):
+    """start_date（YYYYMMDD、なければ空）→ その運行日の0時の UNIX 時刻。空のものは今日と前日を返す"""
+    import numpy as np
+    today = datetime.datetime.fromtimestamp(now, JST).date()
+    midnight = int(datetime.datetime(today.year, today.month, today.day, tzinfo=JST).timestamp())
+    bases = []
+    for start_date in start_dates:
+        if start_date:
+            day = datetime.datetime.strptime(start_date, '%Y%m%d')
+            base = int(day.replace(tzinfo=JST).timestamp())
+            bases.append((base, base))
+        else:
+            bases.append((midnight, midnight - timetable.DAY_SECONDS))
+    return np.array(bases, dtype=np.int64).reshape(-1, 2)
+
+def collect(feeds):
+    """FeedMessage の列 → trip_id ごとの車両位置と TripUpdate"""
+    vehicles = {}
+    updates = {}
+    for feed in feeds:
+        for entity in feed.entity:
+            if entity.HasField('vehicle') and entity.vehicle.trip.trip_id:
+                vehicles[entity.vehicle.trip.trip_id] = entity.vehicle
+            if entity.HasField('trip_update') and entity.trip_update.trip.trip_id:
+                updates[entity.trip_update.trip.trip_id] = entity.trip_update
+    return vehicles, updates
+
+def event_delay(update, scheduled):
+    """StopTimeUpdate → 遅れ（秒）。scheduled はその停留所の予定出発の UNIX 時刻。わからなければ None"""
+    for event in (update.departure, update.arrival):
+        if event.HasField('delay'):
+            return event.delay
+        if event.HasField('time') and event.time:
+            return event.time - scheduled
+    return None
+
+def publish_snapshot(root, table, feeds, now=None):
+    """時刻表 table とフィード feeds（車両位置・TripUpdate）から予測時刻を求めて書き出す"""
+    import numpy as np
+    vehicles, updates = collect(feeds)
+    if now is None:
+        now = max([feed.header.timestamp for feed in feeds] + [0]) or int(datetime.datetime.now().timestamp())
+
+    # 時刻表にある便だけ（パターンと、その中の何番目の便か）
+    trip_ids = []
+    trips = []
+    for trip_id in sorted(set(vehicles) | set(updates)):
+        trip = table.trip_ids.index(trip_id)
+        if trip >= 0 and table.trip_pattern[trip] >= 0:
+            trip_ids.append(trip_id)
+            trips.append(trip)
+
+    trip_pattern = np.asarray(table.trip_pattern)
+    trip_row = np.asarray(table.trip_row)
+    stop_offsets = np.asarray(table.pattern_stops.offsets)
+    time_offsets = np.asarray(table.pattern_departures.offsets)
+    pattern_stops = np.asarray(table.pattern_stops.values)
+    pattern_sequences = np.asarray(table.pattern_sequences.values)
+    departures = np.asarray(table.pattern_departures.values)
+    arrivals = np.asarray(table.pattern_arrivals.values)
+
+    trips = np.array(trips, dtype=np.int64)
+    patterns = trip_pattern[trips]
+    widths = stop_offsets[patterns + 1] - stop_offsets[patterns]
+    # パターンの停留所の先頭と、便の時刻の先頭（便 i は i * 停留所数 だけ後ろ）
+    stop_starts = stop_offsets[patterns]
+    time_starts = time_offsets[patterns] + trip_row[trips] * widths
+
+    # 今向かっている停留所（車両位置 → TripUpdate の最初の停留所 → 始発）
+    positions = np.zeros(len(trips), dtype=np.int64)
+    occupancy = np.full(len(trips), -1, dtype=np.int64)
+    located = np.zeros(len(trips), dtype=bool)
+    for v, trip_id in enumerate(trip_ids):
+        trip_sequences = pattern_sequences[stop_starts[v]:stop_starts[v] + widths[v]]
+        vehicle = vehicles.get(trip_id)
+        if vehicle is not None and vehicle.current_stop_sequence:
+            positions[v] = np.searchsorted(trip_sequences, vehicle.current_stop_sequence)
+            located[v] = True
+        elif trip_id in updates and updates[trip_id].stop_time_update:
+            first = updates[trip_id].stop_time_update[0]
+            if first.HasField('stop_sequence'):
+                positions[v] = np.searchsorted(trip_sequences, first.stop_sequence)
+        if vehicle is not None and vehicle.HasField('occupancy_status'):
+            occupancy[v] = vehicle.occupancy_status
+    positions = np.minimum(positions, widths - 1)
+
+    # 便ごとの残りの停留所を1列に並べる（owner は何番目の便か、flat は時刻表の配列の位置）
+    lengths = widths - positions
+    total = int(lengths.sum())
+    heads = np.cumsum(lengths) - lengths
+    owner = np.repeat(np.arange(len(trips)), lengths)
+    step = np.arange(total) - np.repeat(heads, lengths) + np.repeat(positions, lengths)
+    flat = time_starts[owner] + step
+    stops = pattern_stops[stop_starts[owner] + step]
+    sequences = pattern_sequences[stop_starts[owner] + step]
+    scheduled = departures[flat].astype(np.int64)
+
+    # 運行日: start_date があればその日、なければ今日と前日のうち今向かっている停留所の予定が今に近い方
+    candidates = service_day_bases(
+        [updates[trip_id].trip.start_date if trip_id in updates else vehicles[trip_id].trip.start_date for trip_id in trip_ids],
+        now,
+    )
+    gaps = np.abs(candidates + scheduled[heads][:, None] - now)
+    bases = candidates[np.arange(len(trips)), np.argmin(gaps, axis=1)]
+    elapsed = now - bases
+
+    # 遅れの分かっている行: 各便の先頭（車両位置の時刻と予定の到着の差、TripUpdate 全体の delay）と StopTimeUpdate のある停留所
+    delays = np.zeros(total, dtype=np.int64)
+    known = np.zeros(total, dtype=bool)
+    known[heads] = True
+    for v, trip_id in enumerate(trip_ids):
+        vehicle = vehicles.get(trip_id)
+        if vehicle is not None and vehicle.current_stop_sequence:
+            observed = (vehicle.timestamp or now) - bases[v]
+            delays[heads[v]] = max(0, observed - int(arrivals[flat[heads[v]]]))
+        elif trip_id in updates and updates[trip_id].HasField('delay'):
+            delays[heads[v]] = updates[trip_id].delay
+
+    keys = owner * TRIP_STRIDE + sequences
+    for v, trip_id in enumerate(trip_ids):
+        if trip_id not in updates:
+            continue
+        for update in updates[trip_id].stop_time_update:
+            if update.HasField('stop_sequence'):
+                sequence = update.stop_sequence
+            else:
+                matched = np.flatnonzero(stops[heads[v]:heads[v] + lengths[v]] == table.stop_ids.index(update.stop_id))
+                if not len(matched):
+                    continue
+                sequence = sequences[heads[v] + matched[0]]
+            row = np.searchsorted(keys, v * TRIP_STRIDE + sequence)
+            if row >= total or keys[row] != v * TRIP_STRIDE + sequence:
+                continue
+            delay = event_delay(update, int(bases[v] + scheduled[row]))
+            if delay is not None:
+                delays[row] = delay
+                known[row] = True
+
+    # 遅れのわからない停留所には、同じ便の手前で最後にわかった遅れをそのまま使う（各便の先頭は必ずわかっている）
+    latest = np.maximum.accumulate(np.where(known, np.arange(total), 0))
+    predicted = scheduled + delays[latest]
+    # 今より前には出ず、後ろの停留所ほど遅い（便ごとにずらして累積最大を取る）
+    predicted = np.maximum(predicted, elapsed[owner])
+    predicted = np.maximum.accumulate(predicted + owner * TRIP_STRIDE) - owner * TRIP_STRIDE
+
+    # 出てくる停留所だけの表（時刻表の stop_ids は昇順なので、番号の順に並べれば stop_id も昇順）
+    stop_numbers, local_stops = np.unique(stops, return_inverse=True)
+    bounds = np.concatenate([heads, [total]]).astype(np.int64)
+
+    # 停留所 → 向かっている車両（停留所ごと・予測出発の早い順に並べて区切る）
+    approaching = np.flatnonzero(located[owner])
+    order = approaching[np.lexsort((predicted[approaching], local_stops[approaching]))]
+    pairs = np.stack([owner[order], (np.arange(total) - heads[owner])[order]], axis=1).ravel()
+    stop_bounds = 2 * np.concatenate([[0], np.cumsum(np.bincount(local_stops[order], minlength=len(stop_numbers)))])
+
+    routes = stop_index.numbering(table.routes[table.trip_route[trip]] for trip in trips.tolist())
+    headsigns = stop_index.numbering(table.headsigns[table.trip_headsign[trip]] for trip in trips.tolist())
+
+    arrays = {
+        'generated_at': ('q', [int(now)]),
+        'trip_base': ('q', bases.tolist()),
+        'trip_delay': ('i', (predicted[heads] - scheduled[heads]).tolist()),
+        'trip_occupancy': ('i', occupancy.tolist()),
+        'trip_route': ('i', [routes[table.routes[table.trip_route[trip]]] for trip in trips.tolist()]),
+        'trip_headsign': ('i', [headsigns[table.headsigns[table.trip_headsign[trip]]] for trip in trips.tolist()]),
+    }
+    strings = {
+        'trip_ids': trip_ids,
+        'stop_ids': [table.stop_ids[stop] for stop in stop_numbers.tolist()],
+        'routes': list(routes),
+        'headsigns': list(headsigns),
+    }
+    csrs = {
+        name: [values[bounds[v]:bounds[v + 1]].tolist() for v in range(len(trips))]
+        for name, values in (('trip_stops', local_stops), ('trip_sequences', sequences), ('trip_departures', predicted))
+    }
+    csrs['stop_trips'] = [pairs[stop_bounds[s]:stop_bounds[s + 1]].tolist() for s in range(len(stop_numbers))]
+
+    return index_store.publish(root, SNAPSHOT_KIND, arrays, strings, csrs)
+
+# ==== 読み込み ====
+class RealtimeSnapshot:
+    def __init__(self, container):
+        if container.kind != SNAPSHOT_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {SNAPSHOT_KIND}')
+
+        self.generated_at = container.array('generated_at', 'q')[0]
+        self.trip_ids = container.strings('trip_ids')
+        self.stop_ids = container.strings('stop_ids')
+        self.routes = container.strings('routes')
+        self.headsigns = container.strings('headsigns')
+        self.trip_base = container.array('trip_base', 'q')
+        self.trip_delay = container.array('trip_delay', 'i')
+        self.trip_occupancy = container.array('trip_occupancy', 'i')
+        self.trip_route = container.array('trip_route', 'i')
+        self.trip_headsign = container.array('trip_headsign', 'i')
+        self.trip_stops = container.csr('trip_stops')
+        self.trip_sequences = container.csr('trip_sequences')
+        self.trip_departures = container.csr('trip_departures')
+        self.stop_trips = container.csr('stop_trips')
+
+    def is_stale(self, now=None):
+        """generated_at から STALE_SECONDS より経っていれば True"""
+        now = now or int(datetime.datetime.now().timestamp())
+        return now - self.generated_at > STALE_SECONDS
+
+    def departure(self, trip_id, stop_id, now=None):
+        """trip_id の便が stop_id を出る予測時刻（UNIX 時刻、もう通り過ぎたかわからない・予測が古ければ None）"""
+        if self.is_stale(now):
+            return None
+        trip = self.trip_ids.index(trip_id)
+        stop = self.stop_ids.index(stop_id)
+        if trip < 0 or stop < 0:
+            return None
+        stops = self.trip_stops[trip].tolist()
+        if stop not in stops:
+            return None
+        return self.trip_base[trip] + self.trip_departures[trip][stops.index(stop)]
+
+    def approaching(self, stop_id, limit=LIVE_LIMIT, now=None):
+        """stop_id に向かっている車両（予測出発の早い順に limit 台。予測が古ければ空）"""
+        if self.is_stale(now):
+            return []
+        stop = self.stop_ids.index(stop_id)
+        if stop < 0:
+            return []
+        limit = max(1, min(int(limit), MAX_LIVE_LIMIT))
+
+        results = []
+        seen = set()
+        row = self.stop_trips[stop].tolist()
+        for i in range(0, len(row), 2):
+            trip, distance = row[i], row[i + 1]
+            # 循環する系統で同じ停留所を2回通るときは、先に着く方だけ
+            if trip in seen:
+                continue
+            seen.add(trip)
+            occupancy = self.trip_occupancy[trip]
+            results.append({
+                'trip_id': self.trip_ids[trip],
+                'route_name': self.routes[self.trip_route[trip]],
+                'headsign': self.headsigns[self.trip_headsign[trip]],
+                'stops_away': distance,
+                'position': self.stop_ids[self.trip_stops[trip][0]],
+                'congestion': occupancy if occupancy >= 0 else None,
+                'departure': format_departure(self.trip_base[trip] + self.trip_departures[trip][distance]),
+                'delay_minutes': self.trip_delay[trip] // 60,
+            })
+            if len(results) >= limit:
+                break
+        return results
+
+def format_departure(timestamp):
+    """UNIX 時刻 → 日本時間の HH:MM"""
+    return datetime.datetime.fromtimestamp(timestamp, JST).strftime('%H:%M')
+
+def load_snapshot(root, name=None):
+    return index_store.load(root, RealtimeSnapshot, name)
@@ -0,0 +1,580 @@
+import collections
+import heapq
+import math
+import threading
+
+import jaconv
+
+from common import index_format
+from common import index_store
+from common import metrics
+
+# 停留所検索・入力補完とリアルタイム情報の現在位置表示に使うインデックス（3事業者共通）
+# prepare_gtfs_data で作った dict / set を番号付きの配列にして index_store で世代として書き出し、API からは mmap で読む
+# 形式は common/index_format（python -m common.index_format <root>/current で中身を見られる）
+# 停留所・便には書き出すときに番号を振り直す（停留所は stop_id の昇順、便は trip_id の昇順）
+
+def numbering(values):
+    """値 → 番号（出てきた順）"""
+    numbers = {}
+    for value in values:
+        numbers.setdefault(value, len(numbers))
+    return numbers
+
+# ==== 停留所検索 ====
+# 検索結果の並び（小さいほど先）: 停留所名が完全一致 → 前方一致 → 部分一致 → かなだけで一致
+MATCH_EXACT = 0
+MATCH_PREFIX = 1
+MATCH_SUBSTRING = 2
+MATCH_KANA = 3
+
+# あいまい検索では、上の一致のあとに編集距離の小さい順で並べる
+MATCH_FUZZY = 4  # + 編集距離
+
+# 検索結果の件数（limit を省略したとき / 指定できる上限）
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+
+# あいまい検索: 入力の長さ → 許す編集距離（これより短い入力ではあいまい検索しない）
+FUZZY_DISTANCES = ((6, 2), (3, 1))
+# 1回の検索で編集距離を計算する候補の上限
+MAX_FUZZY_CANDIDATES = 2000
+# バイグラムを作るときに前後につける文字（1文字目・最後の文字も数えるため）
+GRAM_START = '^'
+GRAM_END = '$'
+
+# 運行日の種類（congestion_profile と同じ番号）
+WEEKDAY = 0
+SATURDAY = 1
+HOLIDAY = 2
+DAY_TYPE_NAMES = ('weekday', 'saturday', 'holiday')
+ALL_DAY_TYPES = (WEEKDAY, SATURDAY, HOLIDAY)
+
+# 停留所ごとの (系統, 行先) の行: 平日・土曜・休日 + すべて
+ROUTE_ROWS = len(DAY_TYPE_NAMES) + 1
+
+# 中身が変わったら上げる（古い世代は読まずに作り直す）
+SEARCH_KIND = 'search/4'
+
+def service_day_types(calendar):
+    """calendar.txt の行 → service_id → その service が走る運行日の種類"""
+    day_types = {}
+    for row in calendar:
+        types = day_types.setdefault(row['service_id'], set())
+        if any(row.get(day) == '1' for day in ('monday', 'tuesday', 'wednesday', 'thursday', 'friday')):
+            types.add(WEEKDAY)
+        if row.get('saturday') == '1':
+            types.add(SATURDAY)
+        if row.get('sunday') == '1':
+            types.add(HOLIDAY)
+    return day_types
+
+def bigrams(text):
+    padded = GRAM_START + text + GRAM_END
+    return {padded[i:i + 2] for i in range(len(padded) - 1)}
+
+def fuzzy_distance(text):
+    """text に対して許す編集距離"""
+    for length, distance in FUZZY_DISTANCES:
+        if len(text) >= length:
+            return distance
+    return 0
+
+def fuzzy_forms(text):
+    """normalize 済みの入力 → あいまい検索で比べる形（かなはひらがなにそろえ、ローマ字にしたものも）"""
+    key = suggest_key(text)
+    return {key, jaconv.kana2alphabet(key)}
+
+def bounded_levenshtein(a, b, limit):
+    """a と b の編集距離（limit を超えるとわかった時点で None）"""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+def summarize_routes(stop_id_to_trips, trip_id_to_info, route_id_to_name, day_types):
+    """stop_id → 運行日の種類ごとの {(系統, 行先)}、stop_id → 便数"""
+    stop_id_to_route_headsigns = {}
+    stop_id_to_services = {}
+    for stop_id, trips in stop_id_to_trips.items():
+        by_day = [set() for _ in DAY_TYPE_NAMES]
+        for trip_id in trips:
+            route_id, headsign, service_id = trip_id_to_info.get(trip_id, ('', '', ''))
+            pair = (route_id_to_name.get(route_id, route_id), headsign)
+            # calendar.txt にない service（calendar_dates だけ）はどの日にも出す
+            for day_type in day_types.get(service_id) or ALL_DAY_TYPES:
+                by_day[day_type].add(pair)
+        stop_id_to_route_headsigns[stop_id] = by_day
+        stop_id_to_services[stop_id] = len(trips)
+    return stop_id_to_route_headsigns, stop_id_to_services
+
+def publish_search_index(root, index_data):
+    """build_search_index の結果を書き出す"""
+    stop_name_map, stop_name_kana_map, stop_id_to_name, stop_id_to_route_headsigns, stop_id_to_services, stop_id_to_location = index_data
+
+    stop_ids = sorted(stop_id_to_name)
+    stop_numbers = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+
+    # (系統, 行先) は停留所をまたいで重複が多いので1回だけ持つ
+    pairs = sorted({pair for by_day in stop_id_to_route_headsigns.values() for day in by_day for pair in day})
+    pair_numbers = {pair: i for i, pair in enumerate(pairs)}
+    route_numbers = numbering(route for route, _ in pairs)
+    headsign_numbers = numbering(headsign for _, headsign in pairs)
+
+    stop_routes = []
+    for stop_id in stop_ids:
+        by_day = stop_id_to_route_headsigns.get(stop_id) or [set() for _ in DAY_TYPE_NAMES]
+        for day in by_day:
+            stop_routes.append(sorted(pair_numbers[pair] for pair in day))
+        stop_routes.append(sorted({pair_numbers[pair] for day in by_day for pair in day}))
+
+    names = sorted(stop_name_map)
+    kana_names = sorted(stop_name_kana_map)
+
+    # あいまい検索: 停留所名・読み・読みのローマ字 → 停留所、バイグラム → それを含む形
+    form_stops = {}
+    for name, name_stop_ids in stop_name_map.items():
+        form_stops.setdefault(suggest_key(name), set()).update(name_stop_ids)
+    for kana, kana_stop_ids in stop_name_kana_map.items():
+        reading = suggest_key(kana)
+        for form in (reading, jaconv.kana2alphabet(reading)):
+            form_stops.setdefault(form, set()).update(kana_stop_ids)
+    forms = sorted(form for form in form_stops if form)
+
+    gram_forms = {}
+    for i, form in enumerate(forms):
+        for gram in bigrams(form):
+            gram_forms.setdefault(gram, []).append(i)
+    grams = sorted(gram_forms)
+
+    strings = {
+        'stop_ids': stop_ids,
+        'stop_names': [stop_id_to_name[stop_id] for stop_id in stop_ids],
+        'names': names,
+        'kana_names': kana_names,
+        'routes': list(route_numbers),
+        'headsigns': list(headsign_numbers),
+        'fuzzy_forms': forms,
+        'grams': grams,
+        'stop_lat': [stop_id_to_location[stop_id]['lat'] for stop_id in stop_ids],
+        'stop_lon': [stop_id_to_location[stop_id]['lon'] for stop_id in stop_ids],
+    }
+
+    arrays = {
+        'stop_services': ('i', [stop_id_to_services.get(stop_id, 0) for stop_id in stop_ids]),
+        'pair_route': ('i', [route_numbers[route] for route, _ in pairs]),
+        'pair_headsign': ('i', [headsign_numbers[headsign] for _, headsign in pairs]),
+    }
+
+    csrs = {
+        'name_stops': [sorted(stop_numbers[stop_id] for stop_id in stop_name_map[name]) for name in names],
+        'kana_stops': [sorted(stop_numbers[stop_id] for stop_id in stop_name_kana_map[name]) for name in kana_names],
+        # 停留所 i の行は i * ROUTE_ROWS から（平日・土曜・休日・すべて）
+        'stop_routes': stop_routes,
+        'form_stops': [sorted(stop_numbers[stop_id] for stop_id in form_stops[form]) for form in forms],
+        'gram_forms': [gram_forms[gram] for gram in grams],
+    }
+
+    return index_store.publish(root, SEARCH_KIND, arrays, strings, csrs)
+
+class SearchIndex:
+    def __init__(self, container):
+        if container.kind != SEARCH_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {SEARCH_KIND}')
+
+        self.stop_ids = container.strings('stop_ids')
+        self.stop_names = container.strings('stop_names')
+        self.names = container.strings('names')
+        self.kana_names = container.strings('kana_names')
+        self.routes = container.strings('routes')
+        self.headsigns = container.strings('headsigns')
+        self.stop_services = container.array('stop_services', 'i')
+        self.pair_route = container.array('pair_route', 'i')
+        self.pair_headsign = container.array('pair_headsign', 'i')
+        self.name_stops = container.csr('name_stops')
+        self.kana_stops = container.csr('kana_stops')
+        self.stop_routes = container.csr('stop_routes')
+        self.fuzzy_forms = container.strings('fuzzy_forms')
+        self.grams = container.strings('grams')
+        self.form_stops = container.csr('form_stops')
+        self.gram_forms = container.csr('gram_forms')
+        self.stop_lat = container.strings('stop_lat')
+        self.stop_lon = container.strings('stop_lon')
+
+    def match(self, name, kana):
+        """停留所名に name、かなに kana を含む停留所の番号 → 一致の種類"""
+        matched = {}
+        for i in self.names.find_all(name):
+            stop_name = self.names[i]
+            if stop_name == name:
+                kind = MATCH_EXACT
+            elif stop_name.startswith(name):
+                kind = MATCH_PREFIX
+            else:
+                kind = MATCH_SUBSTRING
+            for stop in self.name_stops[i].tolist():
+                if kind < matched.get(stop, MATCH_KANA + 1):
+                    matched[stop] = kind
+        for i in self.kana_names.find_all(kana):
+            for stop in self.kana_stops[i].tolist():
+                matched.setdefault(stop, MATCH_KANA)
+        return matched
+
+    def fuzzy_match(self, name):
+        """normalize 済みの name と編集距離の近い停留所の番号 → 編集距離"""
+        # 1回の編集で変わるバイグラムは2つまでなので、距離 limit 以内の形は入力のバイグラムを (数 - 2 × limit) 個以上含む
+        # どれかは必ず含まれるよう、持っている形の少ないバイグラムから (数 - 必要な数 + 1) 個の転置リストだけを見る
+        matched = {}
+        for form in fuzzy_forms(name):
+            limit = fuzzy_distance(form)
+            grams = bigrams(form)
+            required = len(grams) - 2 * limit
+            if limit == 0 or required <= 0:
+                continue
+
+            postings = []
+            for gram in grams:
+                i = self.grams.index(gram)
+                postings.append(self.gram_forms[i] if i >= 0 else ())
+            postings.sort(key=len)
+            head = len(grams) - required + 1
+
+            # 候補ごとに入力と共有するバイグラムを数え、required に届かないものは捨てて多い順に MAX_FUZZY_CANDIDATES 個だけ比べる
+            overlap = collections.Counter()
+            for posting in postings[:head]:
+                overlap.update(posting.tolist() if posting else ())
+            for posting in postings[head:]:
+                for candidate in (posting.tolist() if posting else ()):
+                    if candidate in overlap:
+                        overlap[candidate] += 1
+            candidates = [candidate for candidate, count in overlap.items() if count >= required]
+
+            for candidate in heapq.nlargest(MAX_FUZZY_CANDIDATES, candidates, key=lambda candidate: (overlap[candidate], -candidate)):
+                distance = bounded_levenshtein(form, self.fuzzy_forms[candidate], limit)
+                if distance is None:
+                    continue
+                for stop in self.form_stops[candidate].tolist():
+                    if distance < matched.get(stop, limit + 1):
+                        matched[stop] = distance
+        return matched
+
+    def services(self, stop):
+        """停留所を出発する便の数（終着の便は除く）"""
+        return self.stop_services[stop]
+
+    def scored(self, name, kana, limit, fuzzy=False):
+        """一致の種類 → 便の多い順 → stop_id 順で上位 limit 件の (一致の種類, -便数, 停留所の番号)（便のない停留所は除く）"""
+        matched = self.match(name, kana)
+        if fuzzy:
+            for stop, distance in self.fuzzy_match(name).items():
+                matched.setdefault(stop, MATCH_FUZZY + distance)
+
+        candidates = (
+            (kind, -services, stop)
+            for stop, kind in matched.items()
+            for services in (self.services(stop),)
+            if services > 0
+        )
+        # 全件は並べ替えず、limit 件のヒープで上位だけ残す
+        return heapq.nsmallest(limit, candidates)
+
+    def ranked(self, name, kana, limit, fuzzy=False):
+        """scored の停留所の番号だけ"""
+        return [stop for _, _, stop in self.scored(name, kana, limit, fuzzy)]
+
+    def route_headsigns(self, stop, day_type=None):
+        """停留所を通る便の (系統, 行先)。day_type を省略するとすべての運行日"""
+        row = stop * ROUTE_ROWS + (ROUTE_ROWS - 1 if day_type is None else day_type)
+        return [(self.routes[self.pair_route[pair]], self.headsigns[self.pair_headsign[pair]]) for pair in self.stop_routes[row]]
+
+    def route_headsigns_by_day(self, stop):
+        return {name: self.route_headsigns(stop, day_type) for day_type, name in enumerate(DAY_TYPE_NAMES)}
+
+    def location(self, stop):
+        return {'lat': self.stop_lat[stop], 'lon': self.stop_lon[stop]}
+
+def load_search_index(root, name=None):
+    return index_store.load(root, SearchIndex, name)
+
+# ==== 入力補完 ====
+# 停留所名（漢字）・読み（かな）・読みのローマ字をキーにした昇順の表で、前方一致する停留所名を便の多い順に返す
+# 停留所名には便の多い順に番号を振るので、番号の小さいものから取ればよい
+# 1〜2文字の前方一致は候補が多いので、上位だけ書き出すときに求めておく
+
+SUGGEST_KIND = 'suggest/1'
+
+SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 20
+
+# この文字数までの前方一致は上位 MAX_SUGGEST_LIMIT 件をインデックスに持つ
+HOT_PREFIX_LENGTH = 2
+
+# ワーカーごとに覚えておく入力の数
+SUGGEST_CACHE_SIZE = 4096
+
+def suggest_key(text):
+    """normalize 済みの文字列 → 入力補完のキー（カタカナはひらがなにそろえる）"""
+    return jaconv.kata2hira(text)
+
+def publish_suggest_index(root, index_data):
+    stop_name_map, stop_name_kana_map, stop_id_to_name, _, stop_id_to_services = index_data[:5]
+
+    # 同じ名前の停留所（のりば違い）はまとめる
+    name_services = {}
+    for stop_id, name in stop_id_to_name.items():
+        name_services[name] = name_services.get(name, 0) + stop_id_to_services.get(stop_id, 0)
+    names = sorted((name for name, services in name_services.items() if services > 0), key=lambda name: (-name_services[name], name))
+    name_numbers = {name: i for i, name in enumerate(names)}
+
+    key_names = {}
+    def add(key, stop_ids):
+        if not key:
+            return
+        numbers = key_names.setdefault(key, set())
+        for stop_id in stop_ids:
+            number = name_numbers.get(stop_id_to_name[stop_id])
+            if number is not None:
+                numbers.add(number)
+
+    for name, stop_ids in stop_name_map.items():
+        add(suggest_key(name), stop_ids)
+    for kana, stop_ids in stop_name_kana_map.items():
+        reading = suggest_key(kana)
+        add(reading, stop_ids)
+        add(jaconv.kana2alphabet(reading), stop_ids)
+
+    keys = sorted(key for key, numbers in key_names.items() if numbers)
+
+    hot = {}
+    for key in keys:
+        for length in range(1, min(len(key), HOT_PREFIX_LENGTH) + 1):
+            hot.setdefault(key[:length], set()).update(key_names[key])
+    hot_prefixes = sorted(hot)
+
+    strings = {
+        'keys': keys,
+        'names': names,
+        'hot_prefixes': hot_prefixes,
+    }
+    arrays = {
+        'name_services': ('i', [name_services[name] for name in names]),
+    }
+    csrs = {
+        'key_names': [sorted(key_names[key]) for key in keys],
+        'hot_names': [heapq.nsmallest(MAX_SUGGEST_LIMIT, hot[prefix]) for prefix in hot_prefixes],
+    }
+
+    return index_store.publish(root, SUGGEST_KIND, arrays, strings, csrs)
+
+class SuggestIndex:
+    def __init__(self, container):
+        if container.kind != SUGGEST_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {SUGGEST_KIND}')
+
+        self.keys = container.strings('keys')
+        self.names = container.strings('names')
+        self.hot_prefixes = container.strings('hot_prefixes')
+        self.name_services = container.array('name_services', 'i')
+        self.key_names = container.csr('key_names')
+        self.hot_names = container.csr('hot_names')
+
+        # 同じ入力は何度も来るので結果を覚えておく（世代が切り替わればこのオブジェクトごと捨てられる）
+        self.cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def lookup(self, prefix, limit):
+        if not prefix:
+            return []
+
+        hot = self.hot_prefixes.index(prefix)
+        if hot >= 0:
+            numbers = self.hot_names[hot].tolist()[:limit]
+        else:
+            start, end = self.keys.prefix_range(prefix)
+            candidates = set()
+            for key in range(start, end):
+                candidates.update(self.key_names[key].tolist())
+            numbers = heapq.nsmallest(limit, candidates)
+        return [self.names[number] for number in numbers]
+
+    def suggest(self, prefix, limit=SUGGEST_LIMIT):
+        """prefix（suggest_key 済み）から始まる停留所名を便の多い順に limit 件"""
+        cache_key = (prefix, limit)
+        with self.lock:
+            names = self.cache.get(cache_key)
+            if names is not None:
+                self.cache.move_to_end(cache_key)
+        if names is not None:
+            metrics.cache_lookup('suggest', hits=1)
+            return names
+
+        metrics.cache_lookup('suggest', misses=1)
+        names = self.lookup(prefix, limit)
+        with self.lock:
+            self.cache[cache_key] = names
+            if len(self.cache) > SUGGEST_CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return names
+
+def load_suggest_index(root, name=None):
+    return index_store.load(root, SuggestIndex, name)
+
+# ==== 事業者をまたいだ停留所のまとまり ====
+# 同じ名前で近くにある別の事業者の停留所（例: 市営バスと臨港バスの「横浜駅前」）を、全事業者の検索インデックスができたあとに求めておく
+# 事業者ごとの検索インデックスは別々に作り直されるので、停留所の番号ではなく (事業者, stop_id) で持つ
+
+STOP_GROUPS_KIND = 'stop_groups/1'
+
+# 同じ名前の停留所をまとめる距離（m）
+GROUP_DISTANCE = 300
+
+# 緯度1度あたりの距離（m）
+METERS_PER_DEGREE = 111320
+
+def distance_meters(lat1, lon1, lat2, lon2):
+    """2点間のおおよその距離（m）。数百 m なので平面で近似する"""
+    x = (lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    return math.hypot(x, lat2 - lat1) * METERS_PER_DEGREE
+
+def nearby_pairs(points, distance):
+    """points: [(キー, 緯度, 経度)] → キーが同じで distance（m）以内の (i, j, 距離)（i < j）"""
+    if not points:
+        return
+
+    # distance 四方以上のマス目に分け、隣り合うマスにある点だけを比べる
+    cell_lat = distance / METERS_PER_DEGREE
+    cell_lon = cell_lat / max(math.cos(math.radians(max(abs(point[1]) for point in points))), 0.01)
+    cells = {}
+    for i, (key, lat, lon) in enumerate(points):
+        cells.setdefault((key, math.floor(lat / cell_lat), math.floor(lon / cell_lon)), []).append(i)
+
+    for (key, y, x), members in cells.items():
+        for dy in (-1, 0, 1):
+            for dx in (-1, 0, 1):
+                for j in cells.get((key, y + dy, x + dx), ()):
+                    for i in members:
+                        if i < j:
+                            meters = distance_meters(*points[i][1:], *points[j][1:])
+                            if meters <= distance:
+                                yield i, j, meters
+
+def group_stops(stops, distance=GROUP_DISTANCE):
+    """stops: [(事業者, stop_id, 名前のキー, 緯度, 経度)] → まとまりごとの stops の番号（2事業者以上のものだけ）"""
+    parent = list(range(len(stops)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    # 同じ名前の停留所だけを比べる
+    for i, j, _ in nearby_pairs([stop[2:] for stop in stops], distance):
+        parent[find(i)] = find(j)
+
+    groups = {}
+    for i in range(len(stops)):
+        groups.setdefault(find(i), []).append(i)
+    return [members for members in groups.values() if len({stops[i][0] for i in members}) > 1]
+
+def member_key(operator, stop_id):
+    return f'{operator}\t{stop_id}'
+
+def publish_stop_groups(root, stops):
+    groups = sorted(sorted(member_key(*stops[i][:2]) for i in members) for members in group_stops(stops))
+    keys = sorted(key for members in groups for key in members)
+    key_numbers = {key: i for i, key in enumerate(keys)}
+    key_group = [0] * len(keys)
+    for group, members in enumerate(groups):
+        for key in members:
+            key_group[key_numbers[key]] = group
+
+    strings = {'keys': keys}
+    arrays = {'key_group': ('i', key_group)}
+    csrs = {'group_keys': [[key_numbers[key] for key in members] for members in groups]}
+    return index_store.publish(root, STOP_GROUPS_KIND, arrays, strings, csrs)
+
+class StopGroups:
+    def __init__(self, container):
+        if container.kind != STOP_GROUPS_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {STOP_GROUPS_KIND}')
+
+        self.keys = container.strings('keys')
+        self.key_group = container.array('key_group', 'i')
+        self.group_keys = container.csr('group_keys')
+
+    def group_of(self, operator, stop_id):
+        """停留所のまとまりの番号（どこにも入っていなければ -1）"""
+        i = self.keys.index(member_key(operator, stop_id))
+        return -1 if i < 0 else self.key_group[i]
+
+    def members(self, group):
+        """まとまりに入っている [(事業者, stop_id)]"""
+        return [tuple(self.keys[i].split('\t', 1)) for i in self.group_keys[group].tolist()]
+
+def load_stop_groups(root, name=None):
+    return index_store.load(root, StopGroups, name)
+
+# ==== trip_id → stop_sequence → 停留所名 ====
+def publish_stop_sequence(root, stop_sequence):
+    trip_ids = sorted(stop_sequence)
+    stop_names = numbering(name for trip_id in trip_ids for name in stop_sequence[trip_id].values())
+
+    strings = {
+        'trip_ids': trip_ids,
+        'stop_names': list(stop_names),
+    }
+    csrs = {
+        'sequences': [list(stop_sequence[trip_id]) for trip_id in trip_ids],
+        'stops': [[stop_names[name] for name in stop_sequence[trip_id].values()] for trip_id in trip_ids],
+    }
+
+    return index_store.publish(root, 'stop_sequence', strings=strings, csrs=csrs)
+
+class StopSequence:
+    """stop_sequence[trip_id][seq] で停留所名を引く（dict と同じく、ない trip_id は KeyError）"""
+
+    def __init__(self, container):
+        self.trip_ids = container.strings('trip_ids')
+        self.stop_names = container.strings('stop_names')
+        self.sequences = container.csr('sequences')
+        self.stops = container.csr('stops')
+
+    def __contains__(self, trip_id):
+        return self.trip_ids.index(trip_id) >= 0
+
+    def __getitem__(self, trip_id):
+        i = self.trip_ids.index(trip_id)
+        if i < 0:
+            raise KeyError(trip_id)
+        return dict(zip(self.sequences[i].tolist(), (self.stop_names[name] for name in self.stops[i].tolist())))
+
+def load_stop_sequence(root, name=None):
+    return index_store.load(root, StopSequence, name)
+
+# ==== 便ごとの情報（運行中かどうかの判定用） ====
+def publish_trip_info(root, trip_end_times):
+    trip_ids = sorted(trip_end_times)
+    strings = {'trip_ids': trip_ids}
+    arrays = {'end_times': ('i', [trip_end_times[trip_id] for trip_id in trip_ids])}
+    return index_store.publish(root, 'trip_info', arrays, strings)
+
+class TripInfo:
+    """trip_end_times.get(trip_id, default) と同じ形で終着時刻（0時からの秒）を引く"""
+
+    def __init__(self, container):
+        self.trip_ids = container.strings('trip_ids')
+        self.end_times = container.array('end_times', 'i')
+
+    def get(self, trip_id, default=None):
+        i = self.trip_ids.index(trip_id)
+        return default if i < 0 else self.end_times[i]
+
+def load_trip_info(root, name=None):
+    return index_store.load(root, TripInfo, name)
@@ -0,0 +1,605 @@
+import bisect
+import collections
+import datetime
+import math
+import threading
+
+from common import index_format
+from common import index_store
+from common import metrics
+from common import stop_index
+
+# 経路検索・到達圏用の時刻表（3事業者共通）
+# stop_times.txt の便を「同じ停留所を同じ順に通り、追い越しのない便」のまとまり（パターン）に分け、
+# パターンごとの停留所・便・時刻を平たい配列にして index_store で書き出す
+# 検索は RAPTOR（ラウンド k で k 回目の乗車までの最早到着時刻を求める）で、乗換え回数と到着時刻のパレート最適な経路を返す
+#
+#   pattern_stops[p]      : パターン p の停留所の番号（順番どおり）
+#   pattern_trips[p]      : パターン p の便の番号（どの停留所でも出発の早い順）
+#   pattern_departures[p] : 便 × 停留所の出発時刻（便 i・停留所 j は i * 停留所数 + j）。pattern_arrivals も同じ
+#   pattern_sequences[p]  : パターン p の各停留所の stop_sequence（GTFS-RT の stop_sequence との突き合わせ用）
+#   trip_pattern[t]       : 便 t のパターンと、その中で何番目の便か（trip_row）。パターンに入らない便は -1
+#   stop_patterns[s]      : 停留所 s を通る [パターン, 何番目, パターン, 何番目, ...]
+#   footpaths[s]          : 停留所 s から歩ける [停留所, 秒, 停留所, 秒, ...]
+#
+# 到達圏（ある停留所から N 分以内に行ける停留所）は、出発時刻を ISOCHRONE_BUCKET ごとに区切り、
+# 区切りの中で便が出る時刻ごとに遅い方から RAPTOR を回して（rRAPTOR）、停留所ごとの (出発, 到着) の組を求めておく
+# 同じ区切りなら出発時刻・分数を変えても組から引くだけなので、地図で時刻を動かしても検索し直さない
+
+TIMETABLE_KIND = 'timetable/3'
+
+# 乗り換えで歩く距離の上限（m）と歩く速さ（m/秒、信号待ちや回り道を見込んで遅め）
+FOOTPATH_DISTANCE = 400
+WALK_SPEED = 1.0
+# 同じ場所にあるのりばでも、歩いて移るのにかかる時間（秒）
+MIN_FOOTPATH_SECONDS = 60
+
+# pattern_flags の値（GTFS の pickup_type / drop_off_type が 1 のもの）
+NO_PICKUP = 1
+NO_DROP_OFF = 2
+
+# 乗換えの回数の上限
+MAX_TRANSFERS = 4
+# 出発からこれより後に着く経路は探さない（秒）
+MAX_JOURNEY_SECONDS = 4 * 3600
+# この時刻より前の出発は前日のダイヤ（24時以降の便）で探す
+SERVICE_DAY_START = 3 * 3600
+
+DAY_SECONDS = 24 * 3600
+UNREACHED = 1 << 30
+
+# 運行日ごとの service の判定をいくつ覚えておくか
+SERVICE_CACHE_SIZE = 8
+
+# 到達圏: 出発時刻の区切り（秒）、分数（省略したとき / 上限）、ワーカーごとに覚えておく (停留所, 日, 区切り) の数
+ISOCHRONE_BUCKET = 10 * 60
+DEFAULT_ISOCHRONE_MINUTES = 30
+MAX_ISOCHRONE_MINUTES = 90
+ISOCHRONE_CACHE_SIZE = 256
+
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+def parse_time(text):
+    """HH:MM:SS（24時以降も可）→ 0時からの秒"""
+    h, m, s = map(int, text.split(':'))
+    return h * 3600 + m * 60 + s
+
+def format_time(seconds):
+    return '%02d:%02d' % (seconds // 3600, seconds % 3600 // 60)
+
+def date_number(day):
+    return day.year * 10000 + day.month * 100 + day.day
+
+# ==== 書き出し ====
+def split_fifo(trips):
+    """trips: [(便の番号, 到着時刻の列, 出発時刻の列)] → 追い越しのない便の列のリスト（それぞれ出発の早い順）"""
+    chains = []
+    for trip in sorted(trips, key=lambda trip: (trip[2], trip[1], trip[0])):
+        for chain in chains:
+            last = chain[-1]
+            if all(a <= b for a, b in zip(last[1], trip[1])) and all(a <= b for a, b in zip(last[2], trip[2])):
+                chain.append(trip)
+                break
+        else:
+            chains.append([trip])
+    return chains
+
+def build_footpaths(stops, distance=FOOTPATH_DISTANCE):
+    """stops: [(緯度, 経度)] → 停留所ごとの [停留所, 秒, ...]"""
+    footpaths = [[] for _ in stops]
+    for i, j, meters in stop_index.nearby_pairs([(None, lat, lon) for lat, lon in stops], distance):
+        seconds = max(MIN_FOOTPATH_SECONDS, round(meters / WALK_SPEED))
+        footpaths[i].extend((j, seconds))
+        footpaths[j].extend((i, seconds))
+    return footpaths
+
+def publish_timetable(root, stops, trips, stop_times, calendar, calendar_dates, route_id_to_name):
+    """GTFS の各ファイルの行から時刻表を作って書き出す（stop_times は1行ずつ読めるものでよい）"""
+    stop_ids = sorted(stop['stop_id'] for stop in stops)
+    stop_numbers = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+    stop_rows = {stop['stop_id']: stop for stop in stops}
+    locations = []
+    for stop_id in stop_ids:
+        try:
+            locations.append((float(stop_rows[stop_id]['stop_lat']), float(stop_rows[stop_id]['stop_lon'])))
+        except (KeyError, ValueError):
+            locations.append(None)
+
+    services = stop_index.numbering(row['service_id'] for row in list(calendar) + list(calendar_dates))
+    for trip in trips:
+        services.setdefault(trip['service_id'], len(services))
+
+    trip_rows = {}
+    for row in stop_times:
+        stop = stop_numbers.get(row['stop_id'])
+        if stop is None:
+            continue
+        arrival = row.get('arrival_time') or row['departure_time']
+        departure = row.get('departure_time') or arrival
+        flags = (NO_PICKUP if row.get('pickup_type', '').strip() == '1' else 0) | (NO_DROP_OFF if row.get('drop_off_type', '').strip() == '1' else 0)
+        trip_rows.setdefault(row['trip_id'], []).append(
+            (int(row['stop_sequence']), stop, parse_time(arrival), parse_time(departure), flags)
+        )
+
+    trip_info = {trip['trip_id']: trip for trip in trips}
+    trip_ids = sorted(trip_id for trip_id in trip_rows if trip_id in trip_info)
+    trip_numbers = {trip_id: i for i, trip_id in enumerate(trip_ids)}
+
+    # 停留所の並び・乗降の可否・stop_sequence が同じ便をまとめてから、追い越しのあるものを分ける
+    by_stops = {}
+    for trip_id in trip_ids:
+        rows = sorted(trip_rows[trip_id])
+        if len(rows) < 2:
+            continue
+        key = (tuple(row[1] for row in rows), tuple(row[4] for row in rows), tuple(row[0] for row in rows))
+        by_stops.setdefault(key, []).append(
+            (trip_numbers[trip_id], tuple(row[2] for row in rows), tuple(row[3] for row in rows))
+        )
+
+    pattern_stops = []
+    pattern_flags = []
+    pattern_sequences = []
+    pattern_trips = []
+    pattern_arrivals = []
+    pattern_departures = []
+    stop_patterns = [[] for _ in stop_ids]
+    trip_pattern = [-1] * len(trip_ids)
+    trip_row = [-1] * len(trip_ids)
+    for (pattern, flags, sequences), grouped in sorted(by_stops.items()):
+        for chain in split_fifo(grouped):
+            p = len(pattern_stops)
+            pattern_stops.append(pattern)
+            pattern_flags.append(flags)
+            pattern_sequences.append(sequences)
+            pattern_trips.append([trip for trip, _, _ in chain])
+            for row, (trip, _, _) in enumerate(chain):
+                trip_pattern[trip] = p
+                trip_row[trip] = row
+            pattern_arrivals.append([time for _, arrivals, _ in chain for time in arrivals])
+            pattern_departures.append([time for _, _, departures in chain for time in departures])
+            for position, stop in enumerate(pattern):
+                stop_patterns[stop].extend((p, position))
+
+    # 位置のわからない停留所からは歩かない
+    located = [i for i, location in enumerate(locations) if location is not None]
+    footpaths = [[] for _ in stop_ids]
+    for i, path in enumerate(build_footpaths([locations[i] for i in located])):
+        footpaths[located[i]] = [located[value] if k % 2 == 0 else value for k, value in enumerate(path)]
+
+    route_numbers = stop_index.numbering(route_id_to_name.get(trip_info[trip_id]['route_id'], trip_info[trip_id]['route_id']) for trip_id in trip_ids)
+    headsign_numbers = stop_index.numbering(trip_info[trip_id].get('trip_headsign', '') for trip_id in trip_ids)
+
+    service_ids = list(services)
+    starts = {}
+    ends = {}
+    weekdays = {}
+    for row in calendar:
+        starts[row['service_id']] = int(row['start_date'])
+        ends[row['service_id']] = int(row['end_date'])
+        weekdays[row['service_id']] = sum(1 << i for i, column in enumerate(WEEKDAY_COLUMNS) if row.get(column) == '1')
+    added = {service_id: [] for service_id in service_ids}
+    removed = {service_id: [] for service_id in service_ids}
+    for row in calendar_dates:
+        (added if row['exception_type'] == '1' else removed)[row['service_id']].append(int(row['date']))
+
+    strings = {
+        'stop_ids': stop_ids,
+        'stop_names': [stop_rows[stop_id]['stop_name'] for stop_id in stop_ids],
+        'trip_ids': trip_ids,
+        'routes': list(route_numbers),
+        'headsigns': list(headsign_numbers),
+        'services': service_ids,
+    }
+    arrays = {
+        'trip_route': ('i', [route_numbers[route_id_to_name.get(trip_info[trip_id]['route_id'], trip_info[trip_id]['route_id'])] for trip_id in trip_ids]),
+        'trip_headsign': ('i', [headsign_numbers[trip_info[trip_id].get('trip_headsign', '')] for trip_id in trip_ids]),
+        'trip_service': ('i', [services[trip_info[trip_id]['service_id']] for trip_id in trip_ids]),
+        'trip_pattern': ('i', trip_pattern),
+        'trip_row': ('i', trip_row),
+        'service_start': ('i', [starts.get(service_id, 0) for service_id in service_ids]),
+        'service_end': ('i', [ends.get(service_id, 0) for service_id in service_ids]),
+        'service_weekdays': ('i', [weekdays.get(service_id, 0) for service_id in service_ids]),
+        'stop_lat': ('d', [location[0] if location else math.nan for location in locations]),
+        'stop_lon': ('d', [location[1] if location else math.nan for location in locations]),
+    }
+    csrs = {
+        'pattern_stops': pattern_stops,
+        'pattern_flags': pattern_flags,
+        'pattern_sequences': pattern_sequences,
+        'pattern_trips': pattern_trips,
+        'pattern_arrivals': pattern_arrivals,
+        'pattern_departures': pattern_departures,
+        'stop_patterns': stop_patterns,
+        'footpaths': footpaths,
+        'service_added': [sorted(added[service_id]) for service_id in service_ids],
+        'service_removed': [sorted(removed[service_id]) for service_id in service_ids],
+    }
+
+    return index_store.publish(root, TIMETABLE_KIND, arrays, strings, csrs)
+
+# ==== 検索 ====
+class Timetable:
+    def __init__(self, container):
+        if container.kind != TIMETABLE_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {TIMETABLE_KIND}')
+
+        self.stop_ids = container.strings('stop_ids')
+        self.stop_names = container.strings('stop_names')
+        self.trip_ids = container.strings('trip_ids')
+        self.routes = container.strings('routes')
+        self.headsigns = container.strings('headsigns')
+        self.services = container.strings('services')
+        self.trip_route = container.array('trip_route', 'i')
+        self.trip_headsign = container.array('trip_headsign', 'i')
+        self.trip_service = container.array('trip_service', 'i')
+        self.trip_pattern = container.array('trip_pattern', 'i')
+        self.trip_row = container.array('trip_row', 'i')
+        self.service_start = container.array('service_start', 'i')
+        self.service_end = container.array('service_end', 'i')
+        self.service_weekdays = container.array('service_weekdays', 'i')
+        self.stop_lat = container.array('stop_lat', 'd')
+        self.stop_lon = container.array('stop_lon', 'd')
+        self.pattern_stops = container.csr('pattern_stops')
+        self.pattern_flags = container.csr('pattern_flags')
+        self.pattern_sequences = container.csr('pattern_sequences')
+        self.pattern_trips = container.csr('pattern_trips')
+        self.pattern_arrivals = container.csr('pattern_arrivals')
+        self.pattern_departures = container.csr('pattern_departures')
+        self.stop_patterns = container.csr('stop_patterns')
+        self.footpaths = container.csr('footpaths')
+        self.service_added = container.csr('service_added')
+        self.service_removed = container.csr('service_removed')
+
+        # 検索で毎回切り出さないよう、パターンごとの行をまとめておく（停留所・乗降の可否・到着・出発・便）
+        self.patterns = [
+            (
+                self.pattern_stops[p].tolist(),
+                self.pattern_flags[p].tolist(),
+                self.pattern_arrivals[p],
+                self.pattern_departures[p],
+                self.pattern_trips[p],
+            )
+            for p in range(len(self.pattern_stops))
+        ]
+
+        # 停留所名 → 停留所の番号（のりば違いをまとめて出発地・目的地にする）
+        self.name_stops = {}
+        for stop in range(len(self.stop_ids)):
+            self.name_stops.setdefault(self.stop_names[stop], []).append(stop)
+
+        self.service_cache = {}
+        self.profile_cache = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def find_stops(self, key):
+        """stop_id か停留所名 → 停留所の番号のリスト"""
+        stop = self.stop_ids.index(key)
+        if stop >= 0:
+            return [stop]
+        return self.name_stops.get(key, [])
+
+    def active_services(self, day):
+        """day に走る service の番号 → 1/0"""
+        number = date_number(day)
+        with self.lock:
+            active = self.service_cache.get(number)
+        if active is not None:
+            return active
+
+        weekday = 1 << day.weekday()
+        active = bytearray(len(self.services))
+        for service in range(len(self.services)):
+            running = self.service_start[service] <= number <= self.service_end[service] and bool(self.service_weekdays[service] & weekday)
+            if number in self.service_added[service].tolist():
+                running = True
+            elif number in self.service_removed[service].tolist():
+                running = False
+            active[service] = running
+
+        with self.lock:
+            if len(self.service_cache) >= SERVICE_CACHE_SIZE:
+                self.service_cache.pop(next(iter(self.service_cache)))
+            self.service_cache[number] = active
+        return active
+
+    def earliest_trip(self, departures, trips, width, position, time, active, end):
+        """パターンの position 番目を time 以降に出る、走っている便のうち最初のもの（trips の何番目か、なければ -1）
+
+        departures・trips はパターンの pattern_departures・pattern_trips の行で、end 番目より前の便だけを見る
+        """
+        i = bisect.bisect_left(departures[position::width], time, 0, end)
+        trip_service = self.trip_service
+        while i < end:
+            if active[trip_service[trips[i]]]:
+                return i
+            i += 1
+        return -1
+
+    def raptor(self, sources, active, max_rounds, cutoff, targets=(), best=None):
+        """sources: 停留所 → 出発時刻。ラウンドごとの到着時刻と、そこへ着いた方法のリストを返す
+
+        labels[k][s] は ('bus', パターン, 便, 乗った位置, 降りた位置) か ('walk', 歩き始めた停留所, 秒)。
+        None ならラウンド k - 1 と同じ。
+        best（停留所ごとのこれまでの最早到着時刻）を渡すと、それより早く着くところだけを更新する
+        """
+        count = len(self.stop_ids)
+        arrivals = [[UNREACHED] * count]
+        labels = [[None] * count]
+        if best is None:
+            best = [UNREACHED] * count
+        target_best = UNREACHED
+
+        marked = set()
+        for stop, time in sources.items():
+            arrivals[0][stop] = best[stop] = time
+            marked.add(stop)
+        # 出発地から歩いて行ける停留所（出発地そのものより遅くなるところは除く）
+        for stop in list(marked):
+            self.walk(stop, arrivals[0], labels[0], best, marked, cutoff)
+        for target in targets:
+            target_best = min(target_best, best[target])
+
+        for k in range(1, max_rounds + 1):
+            if not marked:
+                break
+            previous = arrivals[k - 1]
+            current = list(previous)
+            label = [None] * count
+            arrivals.append(current)
+            labels.append(label)
+
+            # 印のついた停留所を通るパターンを、一番手前の位置から見る
+            queue = {}
+            for stop in marked:
+                row = self.stop_patterns[stop].tolist()
+                for i in range(0, len(row), 2):
+                    p, position = row[i], row[i + 1]
+                    if position < queue.get(p, UNREACHED):
+                        queue[p] = position
+            boarding = marked
+            marked = set()
+
+            for p, start in queue.items():
+                stops, flags, arrival_times, departure_times, trips = self.patterns[p]
+                width = len(stops)
+                trip = -1
+                end = len(trips)
+                board = 0
+                for position in range(start, width):
+                    stop = stops[position]
+                    if trip >= 0 and not flags[position] & NO_DROP_OFF:
+                        time = arrival_times[trip * width + position]
+                        if time < best[stop] and time < target_best and time <= cutoff:
+                            current[stop] = best[stop] = time
+                            label[stop] = ('bus', p, trip, board, position)
+                            marked.add(stop)
+                            if stop in targets:
+                                target_best = time
+
+                    # 前のラウンドでここに着いていれば、今の便より早い便に乗れるか
+                    # （便は出発の早い順なので、1本前の便に間に合わなければそれより前も調べなくてよい）
+                    ready = previous[stop]
+                    if ready >= UNREACHED or flags[position] & NO_PICKUP:
+                        continue
+                    if trip == 0 or (trip > 0 and ready > departure_times[(trip - 1) * width + position]):
+                        continue
+                    # 前のラウンドで早くならなかった停留所から乗れる便は、それより前のラウンドで調べてある
+                    if stop not in boarding:
+                        continue
+                    earlier = self.earliest_trip(departure_times, trips, width, position, ready, active, trip if trip >= 0 else end)
+                    if earlier >= 0:
+                        trip = earlier
+                        board = position
+
+            for stop in list(marked):
+                self.walk(stop, current, label, best, marked, min(cutoff, target_best - 1))
+            for target in targets:
+                target_best = min(target_best, best[target])
+
+        return arrivals, labels
+
+    def walk(self, stop, arrivals, label, best, marked, cutoff):
+        row = self.footpaths[stop].tolist()
+        for i in range(0, len(row), 2):
+            neighbor, seconds = row[i], row[i + 1]
+            time = arrivals[stop] + seconds
+            if time < best[neighbor] and time <= cutoff:
+                arrivals[neighbor] = best[neighbor] = time
+                label[neighbor] = ('walk', stop, seconds)
+                marked.add(neighbor)
+
+    def legs(self, labels, k, stop):
+        """ラウンド k の stop までの経路（出発地から順に）"""
+        legs = []
+        while True:
+            while k > 0 and labels[k][stop] is None:
+                k -= 1
+            label = labels[k][stop]
+            if label is None:
+                break
+
+            if label[0] == 'walk':
+                _, origin, seconds = label
+                legs.append({
+                    'type': 'walk',
+                    'from_stop_id': self.stop_ids[origin],
+                    'from_stop': self.stop_names[origin],
+                    'to_stop_id': self.stop_ids[stop],
+                    'to_stop': self.stop_names[stop],
+                    'minutes': -(-seconds // 60),
+                })
+                stop = origin
+                continue
+
+            _, p, trip, board, alight = label
+            stops = self.pattern_stops[p]
+            width = len(stops)
+            number = self.pattern_trips[p][trip]
+            origin = stops[board]
+            legs.append({
+                'type': 'bus',
+                'trip_id': self.trip_ids[number],
+                'route_name': self.routes[self.trip_route[number]],
+                'headsign': self.headsigns[self.trip_headsign[number]],
+                'from_stop_id': self.stop_ids[origin],
+                'from_stop': self.stop_names[origin],
+                'departure_time': format_time(self.pattern_departures[p][trip * width + board]),
+                'to_stop_id': self.stop_ids[stop],
+                'to_stop': self.stop_names[stop],
+                'arrival_time': format_time(self.pattern_arrivals[p][trip * width + alight]),
+                'stops': alight - board,
+            })
+            stop = origin
+            k -= 1
+
+        legs.reverse()
+        return legs
+
+    def plan(self, origin, destination, day, seconds, max_transfers=MAX_TRANSFERS):
+        """origin から destination へ day の seconds 以降に出る経路のうち、乗換え回数と到着時刻がパレート最適なもの"""
+        sources = self.find_stops(origin)
+        targets = set(self.find_stops(destination))
+        if not sources or not targets:
+            return []
+
+        # 深夜は前日のダイヤの24時以降の便で探す
+        if seconds < SERVICE_DAY_START:
+            day -= datetime.timedelta(days=1)
+            seconds += DAY_SECONDS
+
+        active = self.active_services(day)
+        arrivals, labels = self.raptor(
+            dict.fromkeys(sources, seconds), active, max_transfers + 1, seconds + MAX_JOURNEY_SECONDS, targets
+        )
+
+        # 乗換えを増やしても着く時刻（分）が早くならないものは出さない
+        journeys = []
+        best = UNREACHED
+        for k, round_arrivals in enumerate(arrivals):
+            stop = min(targets, key=lambda target: round_arrivals[target])
+            if round_arrivals[stop] >= UNREACHED or round_arrivals[stop] // 60 >= best // 60:
+                continue
+            best = round_arrivals[stop]
+            legs = self.legs(labels, k, stop)
+            rides = sum(1 for leg in legs if leg['type'] == 'bus')
+            journeys.append({
+                'departure_time': legs[0]['departure_time'] if legs and legs[0]['type'] == 'bus' else format_time(seconds),
+                'arrival_time': format_time(best),
+                'minutes': -(-(best - seconds) // 60),
+                'transfers': max(0, rides - 1),
+                'legs': legs,
+            })
+        return journeys
+
+    def departures_from(self, stop, start, end, active):
+        """stop を [start, end) に出る、走っている便の出発時刻"""
+        times = []
+        row = self.stop_patterns[stop].tolist()
+        for i in range(0, len(row), 2):
+            p, position = row[i], row[i + 1]
+            stops, flags, _, departures, trips = self.patterns[p]
+            if position == len(stops) - 1 or flags[position] & NO_PICKUP:
+                continue
+            column = departures[position::len(stops)]
+            for j in range(bisect.bisect_left(column, start), bisect.bisect_left(column, end)):
+                if active[self.trip_service[trips[j]]]:
+                    times.append(column[j])
+        return times
+
+    def profile(self, sources, day, bucket):
+        """sources から bucket〜bucket + ISOCHRONE_BUCKET に出たときの、停留所 → [(出発, 到着)]（出発の遅い順）"""
+        start = bucket
+        end = bucket + ISOCHRONE_BUCKET
+        active = self.active_services(day)
+
+        # 区切りの終わりに出た場合（それより後の出発すべての代わり）と、区切りの中で出発地・歩いて行ける停留所から便が出る時刻
+        times = {end}
+        for source in sources:
+            times.update(self.departures_from(source, start, end, active))
+            row = self.footpaths[source].tolist()
+            for i in range(0, len(row), 2):
+                neighbor, seconds = row[i], row[i + 1]
+                times.update(time - seconds for time in self.departures_from(neighbor, start + seconds, end + seconds, active))
+
+        # 遅い出発から順に回し、それまでより早く着くようになった停留所だけを記録する
+        count = len(self.stop_ids)
+        best = [UNREACHED] * count
+        pairs = {}
+        cutoff = end + MAX_ISOCHRONE_MINUTES * 60
+        for departure in sorted(times, reverse=True):
+            before = list(best)
+            self.raptor(dict.fromkeys(sources, departure), active, MAX_TRANSFERS + 1, cutoff, best=best)
+            for stop in range(count):
+                if best[stop] < before[stop]:
+                    pairs.setdefault(stop, []).append((departure, best[stop]))
+        return pairs
+
+    def cached_profile(self, sources, day, bucket):
+        key = (tuple(sources), date_number(day), bucket)
+        with self.lock:
+            pairs = self.profile_cache.get(key)
+            if pairs is not None:
+                self.profile_cache.move_to_end(key)
+        if pairs is not None:
+            metrics.cache_lookup('isochrone', hits=1)
+            return pairs
+
+        metrics.cache_lookup('isochrone', misses=1)
+        pairs = self.profile(sources, day, bucket)
+        with self.lock:
+            self.profile_cache[key] = pairs
+            if len(self.profile_cache) > ISOCHRONE_CACHE_SIZE:
+                self.profile_cache.popitem(last=False)
+        return pairs
+
+    def location(self, stop):
+        lat, lon = self.stop_lat[stop], self.stop_lon[stop]
+        if math.isnan(lat):
+            return None, None
+        return lat, lon
+
+    def reachable(self, origin, day, seconds, minutes=DEFAULT_ISOCHRONE_MINUTES):
+        """origin から day の seconds に出て minutes 分以内に着ける停留所（早く着く順）"""
+        sources = self.find_stops(origin)
+        if not sources:
+            return []
+        if seconds < SERVICE_DAY_START:
+            day -= datetime.timedelta(days=1)
+            seconds += DAY_SECONDS
+        limit = seconds + max(1, min(int(minutes), MAX_ISOCHRONE_MINUTES)) * 60
+
+        # 出発地と、そこから歩いて行ける停留所（便の時刻によらない）
+        arrivals = {}
+        for source in sources:
+            arrivals[source] = seconds
+            row = self.footpaths[source].tolist()
+            for i in range(0, len(row), 2):
+                neighbor, walk_seconds = row[i], row[i + 1]
+                arrivals[neighbor] = min(arrivals.get(neighbor, UNREACHED), seconds + walk_seconds)
+
+        pairs = self.cached_profile(sources, day, seconds - seconds % ISOCHRONE_BUCKET)
+        for stop, stop_pairs in pairs.items():
+            # 出発の遅い順で、到着も遅い順に並んでいるので、seconds 以降に出るもののうち最後が一番早い
+            for departure, arrival in stop_pairs:
+                if departure < seconds:
+                    break
+                if arrival < arrivals.get(stop, UNREACHED):
+                    arrivals[stop] = arrival
+
+        results = []
+        for stop, arrival in sorted(arrivals.items(), key=lambda item: (item[1], item[0])):
+            if arrival > limit:
+                continue
+            lat, lon = self.location(stop)
+            results.append({
+                'stop_id': self.stop_ids[stop],
+                'stop_name': self.stop_names[stop],
+                'lat': lat,
+                'lon': lon,
+                'arrival_time': format_time(arrival),
+                'minutes': (arrival - seconds) // 60,
+            })
+        return results
+
+def load_timetable(root, name=None):
+    return index_store.load(root, Timetable, name)
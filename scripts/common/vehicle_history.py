@@ -0,0 +1,246 @@
+import datetime
+
+from common import index_format
+from common import index_store
+
+# 車両ごとの直近の位置（時刻, 緯度, 経度, 停留所, 混雑）
+# ポーラーが車両ごとに HISTORY_SIZE 件のリングバッファをメモリに持って追記し、受け取るたびに index_store の世代として書き出す
+# API は書き出したものを mmap して、軌跡と、任意の時刻の位置（前後の点の間を補間）を返す
+# numpy は app の起動を重くしないよう、使うメソッドの中で import する
+#
+#   vehicle_ids[v]                 : 車両（昇順）
+#   offsets[v]〜offsets[v + 1]     : 車両 v の点（古い順）の範囲
+#   times / lats / lons            : 点の UNIX 時刻・緯度・経度
+#   stops / occupancies            : 点の停留所・混雑（stop_ids / statuses の番号、わからなければ -1）
+#   vehicle_route[v]               : 最後に見えたときの系統（routes の番号）
+
+HISTORY_KIND = 'vehicle_trail/1'
+
+# 車両ごとに残す点の数（30秒ごとで約30分）
+HISTORY_SIZE = 64
+# これより長く見えない車両は消す（秒）
+EXPIRE_SECONDS = 30 * 60
+# 前後の点がこれより離れていたら間を補間しない（秒）
+MAX_INTERPOLATION_GAP = 5 * 60
+
+# 軌跡の長さの上限（分）
+MAX_TRAIL_MINUTES = 30
+
+JST = datetime.timezone(datetime.timedelta(hours=9))
+
+def numbering_of(numbers, values, value):
+    """value の番号（初めてなら values の末尾に足す）。None は -1"""
+    if value is None:
+        return -1
+    number = numbers.get(value)
+    if number is None:
+        number = numbers[value] = len(values)
+        values.append(value)
+    return number
+
+# ==== 書き込み（ポーラー） ====
+class VehicleHistory:
+    """車両 × HISTORY_SIZE の配列に、車両ごとに head の位置から循環して書く"""
+
+    def __init__(self, size=HISTORY_SIZE):
+        import numpy as np
+        self.size = size
+        self.rows = {}  # 車両 → 行
+        self.free = []
+        self.times = np.zeros((0, size), dtype=np.int64)
+        self.lats = np.zeros((0, size), dtype=np.float64)
+        self.lons = np.zeros((0, size), dtype=np.float64)
+        self.stops = np.zeros((0, size), dtype=np.int32)
+        self.occupancies = np.zeros((0, size), dtype=np.int32)
+        self.head = np.zeros(0, dtype=np.int64)
+        self.count = np.zeros(0, dtype=np.int64)
+        self.route = np.zeros(0, dtype=np.int32)
+        # 停留所・混雑・系統の文字列 → 番号（増えるだけなので、日次の作り直しで再起動したときに片付く）
+        self.stop_ids, self.stop_numbers = [], {}
+        self.statuses, self.status_numbers = [], {}
+        self.routes, self.route_numbers = [], {}
+
+    def row(self, vehicle_id):
+        import numpy as np
+        row = self.rows.get(vehicle_id)
+        if row is not None:
+            return row
+        if not self.free:
+            # 足りなくなったら倍に広げる
+            grow = max(16, len(self.head))
+            self.free = list(range(len(self.head) + grow - 1, len(self.head) - 1, -1))
+            for name in ('times', 'lats', 'lons', 'stops', 'occupancies'):
+                values = getattr(self, name)
+                setattr(self, name, np.concatenate([values, np.zeros((grow, self.size), dtype=values.dtype)]))
+            for name in ('head', 'count', 'route'):
+                values = getattr(self, name)
+                setattr(self, name, np.concatenate([values, np.zeros(grow, dtype=values.dtype)]))
+        row = self.rows[vehicle_id] = self.free.pop()
+        self.head[row] = self.count[row] = 0
+        return row
+
+    def append(self, vehicle_id, timestamp, lat, lon, stop_id=None, status=None, route=None):
+        """点を1つ足す（その車両の最後の点より新しくなければ何もしない）"""
+        row = self.row(vehicle_id)
+        if self.count[row] and self.times[row, (self.head[row] - 1) % self.size] >= timestamp:
+            return False
+
+        i = self.head[row]
+        self.times[row, i] = timestamp
+        self.lats[row, i] = lat
+        self.lons[row, i] = lon
+        self.stops[row, i] = numbering_of(self.stop_numbers, self.stop_ids, stop_id)
+        self.occupancies[row, i] = numbering_of(self.status_numbers, self.statuses, status)
+        self.route[row] = numbering_of(self.route_numbers, self.routes, route)
+        self.head[row] = (i + 1) % self.size
+        self.count[row] = min(self.count[row] + 1, self.size)
+        return True
+
+    def expire(self, now, seconds=EXPIRE_SECONDS):
+        """最後の点が now - seconds より古い車両を消す"""
+        for vehicle_id, row in list(self.rows.items()):
+            if self.times[row, (self.head[row] - 1) % self.size] < now - seconds:
+                del self.rows[vehicle_id]
+                self.free.append(row)
+                self.count[row] = 0
+
+    def publish(self, root):
+        """車両の昇順・点の古い順に詰めて書き出す"""
+        import numpy as np
+        vehicle_ids = sorted(self.rows)
+        rows = np.array([self.rows[vehicle_id] for vehicle_id in vehicle_ids], dtype=np.int64)
+        counts = self.count[rows]
+        # 行ごとに head - count から古い順に並べ、入っている点だけを取り出す
+        columns = (self.head[rows, None] - counts[:, None] + np.arange(self.size)) % self.size
+        valid = np.arange(self.size) < counts[:, None]
+        picked = (rows[:, None].repeat(self.size, axis=1)[valid], columns[valid])
+
+        arrays = {
+            'offsets': ('q', np.concatenate([[0], np.cumsum(counts)]).tolist()),
+            'times': ('q', self.times[picked].tolist()),
+            'lats': ('d', self.lats[picked].tolist()),
+            'lons': ('d', self.lons[picked].tolist()),
+            'stops': ('i', self.stops[picked].tolist()),
+            'occupancies': ('i', self.occupancies[picked].tolist()),
+            'vehicle_route': ('i', self.route[rows].tolist()),
+        }
+        strings = {
+            'vehicle_ids': vehicle_ids,
+            'stop_ids': self.stop_ids,
+            'statuses': self.statuses,
+            'routes': self.routes,
+        }
+        return index_store.publish(root, HISTORY_KIND, arrays, strings)
+
+def restore(root, size=HISTORY_SIZE):
+    """書き出してある世代からリングバッファを作り直す（ポーラーを再起動しても軌跡を失わない）"""
+    history = VehicleHistory(size)
+    try:
+        trails = load_history(root)
+    except (FileNotFoundError, index_format.FormatError) as e:
+        print("車両の位置の履歴が存在しないか読み込み失敗:", e)
+        return history
+
+    for v in range(len(trails.vehicle_ids)):
+        route = trails.routes[trails.vehicle_route[v]] if trails.vehicle_route[v] >= 0 else None
+        for i in range(max(trails.offsets[v], trails.offsets[v + 1] - size), trails.offsets[v + 1]):
+            history.append(
+                trails.vehicle_ids[v], int(trails.times[i]), trails.lats[i], trails.lons[i],
+                trails.string(trails.stop_ids, trails.stops[i]), trails.string(trails.statuses, trails.occupancies[i]), route,
+            )
+    return history
+
+# ==== 読み込み（API） ====
+class VehicleTrails:
+    def __init__(self, container):
+        import numpy as np
+        if container.kind != HISTORY_KIND:
+            raise index_format.FormatError(f'{container.file_path}: {container.kind} is not {HISTORY_KIND}')
+
+        self.vehicle_ids = container.strings('vehicle_ids')
+        self.stop_ids = container.strings('stop_ids')
+        self.statuses = container.strings('statuses')
+        self.routes = container.strings('routes')
+        self.offsets = np.asarray(container.array('offsets', 'q'))
+        self.times = np.asarray(container.array('times', 'q'))
+        self.lats = np.asarray(container.array('lats', 'd'))
+        self.lons = np.asarray(container.array('lons', 'd'))
+        self.stops = np.asarray(container.array('stops', 'i'))
+        self.occupancies = np.asarray(container.array('occupancies', 'i'))
+        self.vehicle_route = np.asarray(container.array('vehicle_route', 'i'))
+        # 車両ごとに時刻をずらした列（searchsorted で全車両の前後の点をまとめて探す）
+        owner = np.repeat(np.arange(len(self.vehicle_ids), dtype=np.int64), np.diff(self.offsets))
+        self.keys = (owner << 32) + self.times
+
+    def string(self, table, number):
+        return table[number] if number >= 0 else None
+
+    def point(self, v, i, lat=None, lon=None, timestamp=None):
+        return {
+            'vehicle': self.vehicle_ids[v],
+            'geo': [float(self.lons[i] if lon is None else lon), float(self.lats[i] if lat is None else lat)],
+            'stop': self.string(self.stop_ids, self.stops[i]),
+            'congestion': self.string(self.statuses, self.occupancies[i]),
+            'route': self.string(self.routes, self.vehicle_route[v]),
+            'date': format_time(self.times[i] if timestamp is None else timestamp),
+        }
+
+    def trail(self, v, since):
+        """車両 v の since 以降の点（古い順）"""
+        import numpy as np
+        start = np.searchsorted(self.times[self.offsets[v]:self.offsets[v + 1]], since) + self.offsets[v]
+        return [self.point(v, i) for i in range(start, self.offsets[v + 1])]
+
+    def trails(self, vehicle_id, minutes, now=None):
+        """車両（省略するとすべて）の直近 minutes 分の軌跡"""
+        now = now or int(datetime.datetime.now().timestamp())
+        since = now - max(1, min(int(minutes), MAX_TRAIL_MINUTES)) * 60
+        if vehicle_id is not None:
+            v = self.vehicle_ids.index(vehicle_id)
+            vehicles = [v] if v >= 0 else []
+        else:
+            vehicles = range(len(self.vehicle_ids))
+        results = []
+        for v in vehicles:
+            points = self.trail(v, since)
+            if points:
+                results.append({'vehicle': self.vehicle_ids[v], 'route': self.string(self.routes, self.vehicle_route[v]), 'points': points})
+        return results
+
+    def positions_at(self, timestamp):
+        """timestamp の各車両の位置。前後の点の間は線形に補間し、最後の点より後は最後の点にとどめる"""
+        import numpy as np
+        # 最初の点より前と、最後の点から MAX_INTERPOLATION_GAP より後はどの車両も出ない
+        # 先に返して、範囲外の timestamp で (vehicles << 32) + timestamp が隣の車両のキーにはみ出したり int64 からあふれたりしないようにする
+        if not len(self.times) or not self.times.min() <= timestamp <= self.times.max() + MAX_INTERPOLATION_GAP:
+            return []
+        vehicles = np.arange(len(self.vehicle_ids), dtype=np.int64)
+        # timestamp 以前の最後の点
+        before = np.searchsorted(self.keys, (vehicles << 32) + timestamp, side='right') - 1
+        seen = before >= self.offsets[:-1]
+        # その次の点（同じ車両の中にあって、間が開きすぎていないものだけ補間する）
+        after = np.minimum(before + 1, len(self.times) - 1)
+        between = seen & (before + 1 < self.offsets[1:]) & (self.times[after] - self.times[np.maximum(before, 0)] <= MAX_INTERPOLATION_GAP)
+        # 最後の点からしばらく経った車両は出さない
+        recent = seen & (between | (timestamp - self.times[np.maximum(before, 0)] <= MAX_INTERPOLATION_GAP))
+
+        before = np.maximum(before, 0)
+        span = np.maximum(self.times[after] - self.times[before], 1)
+        ratio = np.where(between, (timestamp - self.times[before]) / span, 0.0)
+        lats = self.lats[before] + (self.lats[after] - self.lats[before]) * ratio
+        lons = self.lons[before] + (self.lons[after] - self.lons[before]) * ratio
+
+        return [self.point(v, before[v], lats[v], lons[v], timestamp) for v in np.flatnonzero(recent).tolist()]
+
+def parse_time(text):
+    """ISO 8601（dc:date など）→ UNIX 時刻"""
+    at = datetime.datetime.fromisoformat(text)
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=JST)
+    return int(at.timestamp())
+
+def format_time(timestamp):
+    return datetime.datetime.fromtimestamp(int(timestamp), JST).isoformat()
+
+def load_history(root, name=None):
+    return index_store.load(root, VehicleTrails, name)
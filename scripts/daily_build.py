@@ -0,0 +1,102 @@
+import yokohamaMunicipal.prepare_gtfs_data
+import rinkoBus.prepare_gtfs_data
+import toBus.prepare_gtfs_data
+import federated_search
+from common import index_store
+from common import stop_index
+from common import timetable
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+# 日次のGTFS更新
+# ダウンロード（I/O）はスレッドで、インデックス等のビルド（純Pythonの重い処理）は事業者・段階ごとに別プロセスで並列に実行する
+# 各段階の結果はファイルに書き出すので、プロセス間で受け渡すのは成否だけ
+# 失敗した段階があっても残りの段階は最後まで実行し、最後に BuildError を投げる（スケジューラがその日のうちにやり直す）
+
+OPERATORS = (
+    yokohamaMunicipal.prepare_gtfs_data,
+    rinkoBus.prepare_gtfs_data,
+    toBus.prepare_gtfs_data
+)
+
+# 並列に動かすビルドのプロセス数
+MAX_BUILD_PROCESSES = max(1, min(6, (os.cpu_count() or 2) - 1))
+
+class BuildError(RuntimeError):
+    pass
+
+def stage_name(stage):
+    return f'{stage.__module__}.{stage.__name__}'
+
+def download(module):
+    # 新しいGTFSがあるときだけ、または前回のインデックスがない（形式が古い）ときにビルドする
+    updated = module.download_gtfs(build=False)
+    return (
+        updated
+        or index_store.current_kind(module.SEARCH_INDEX_DIR) != stop_index.SEARCH_KIND
+        or index_store.current_kind(module.SUGGEST_INDEX_DIR) != stop_index.SUGGEST_KIND
+        or index_store.current_kind(module.TIMETABLE_DIR) != timetable.TIMETABLE_KIND
+    )
+
+def run_stage(stage):
+    started_at = time.monotonic()
+    stage()
+    return time.monotonic() - started_at
+
+def run():
+    started_at = time.monotonic()
+    failures = []
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(OPERATORS)) as executor:
+        downloads = {module: executor.submit(download, module) for module in OPERATORS}
+
+    stages = []
+    for module, future in downloads.items():
+        try:
+            needs_build = future.result()
+        except Exception as e:
+            print(f"❌ Error downloading GTFS for '{module.__name__}': {e}")
+            failures.append(f'{module.__name__}.download_gtfs')
+            needs_build = False
+
+        if needs_build:
+            stages.extend(module.BUILD_STAGES)
+        stages.extend(module.ALWAYS_BUILD_STAGES)
+
+    # fork だと親のスレッドが持っているロックを引き継いでしまうので spawn
+    context = multiprocessing.get_context('spawn')
+    with concurrent.futures.ProcessPoolExecutor(max_workers=MAX_BUILD_PROCESSES, mp_context=context) as executor:
+        futures = {executor.submit(run_stage, stage): stage for stage in stages}
+
+        for future in concurrent.futures.as_completed(futures):
+            name = stage_name(futures[future])
+            try:
+                print(f"✅ Build stage '{name}' completed in {future.result():.1f}s.")
+            except Exception as e:
+                print(f"❌ Error in build stage '{name}': {e}")
+                failures.append(name)
+
+    # 事業者をまたいだ停留所のまとまりは、全事業者の検索インデックスがそろってから
+    search_built = any(stage.__name__ == 'build_search_index' for stage in stages)
+    if search_built or index_store.current_kind(federated_search.STOP_GROUPS_DIR) != stop_index.STOP_GROUPS_KIND:
+        try:
+            stage_started_at = time.monotonic()
+            federated_search.build_stop_groups()
+            print(f"✅ Build stage 'federated_search.build_stop_groups' completed in {time.monotonic() - stage_started_at:.1f}s.")
+        except Exception as e:
+            print(f"❌ Error in build stage 'federated_search.build_stop_groups': {e}")
+            failures.append('federated_search.build_stop_groups')
+
+    # 重複記録の防止用セット
+    for module in OPERATORS:
+        module.reset()
+
+    print(f'daily build done in {time.monotonic() - started_at:.1f}s')
+    if failures:
+        raise BuildError(f"{len(failures)} stage(s) failed: {', '.join(failures)}")
+
+
+if __name__ == "__main__":
+    run()
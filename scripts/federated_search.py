@@ -0,0 +1,124 @@
+import concurrent.futures
+import contextvars
+import json
+import os
+import sys
+
+import yokohamaMunicipal.search_stop
+import rinkoBus.search_stop
+import toBus.search_stop
+from common import index_format
+from common import index_store
+from common import metrics
+from common import stop_index
+
+# 全事業者の停留所検索（/search）
+# 事業者ごとの検索インデックスで上位 limit 件ずつ探し、一致の種類 → 便の多い順で1つの列に並べ直す
+# 同じ名前で近くにある別の事業者の停留所は、日次ビルドで求めておいたまとまり（stop_index.StopGroups）で隣に並べる
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+STOP_GROUPS_DIR = SCRIPTS_DIR + '/cache/stop_groups'
+
+# 事業者 → 検索モジュール（並びが同じなら先の事業者を前に）
+OPERATORS = {
+    'yokohamaMunicipal': yokohamaMunicipal.search_stop,
+    'rinkoBus': rinkoBus.search_stop,
+    'toBus': toBus.search_stop,
+}
+
+# インデックスの読み込み・作り直しを事業者ごとに並行して待つためのスレッド
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(OPERATORS), thread_name_prefix='federated_search')
+
+def build_stop_groups():
+    """全事業者の検索インデックスから停留所のまとまりを求めて書き出す"""
+    stops = []
+    for operator, module in OPERATORS.items():
+        index = module.load_index()
+        for stop in range(len(index.stop_ids)):
+            location = index.location(stop)
+            try:
+                lat, lon = float(location['lat']), float(location['lon'])
+            except ValueError:
+                continue
+            key = stop_index.suggest_key(module.normalize(index.stop_names[stop]))
+            stops.append((operator, index.stop_ids[stop], key, lat, lon))
+
+    return stop_index.publish_stop_groups(STOP_GROUPS_DIR, stops)
+
+def load_stop_groups():
+    try:
+        return stop_index.load_stop_groups(STOP_GROUPS_DIR, f'{__name__}.stop_groups')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        print("停留所のまとまりが存在しないか読み込み失敗:", e)
+        build_stop_groups()
+        return stop_index.load_stop_groups(STOP_GROUPS_DIR, f'{__name__}.stop_groups')
+
+def search_operators(operators, query, limit, fuzzy):
+    """事業者 → search_scored の結果"""
+    # 読み込み済みのインデックスを引くだけなら1ms前後の純 Python の処理なので、スレッドに分けても GIL で速くならない
+    # まだ開いていない（起動直後・世代の切り替え直後・作り直し）事業者があるときだけ並行して待つ
+    if all(index_store.is_loaded(OPERATORS[operator].SEARCH_INDEX_DIR) for operator in operators):
+        return {operator: OPERATORS[operator].search_scored(query, limit, fuzzy) for operator in operators}
+
+    futures = {
+        # metrics.stage がリクエストのラベルを引き継げるように contextvars ごと渡す
+        operator: _executor.submit(contextvars.copy_context().run, OPERATORS[operator].search_scored, query, limit, fuzzy)
+        for operator in operators
+    }
+    return {operator: future.result() for operator, future in futures.items()}
+
+def search_all(query, limit=stop_index.DEFAULT_LIMIT, fuzzy=False, operators=None):
+    """全事業者（operators で絞れる）の停留所を並べ直し、operator と group をつけた結果を limit 件（まとまりは1件と数える）"""
+    operators = [operator for operator in OPERATORS if operators is None or operator in operators]
+    limit = max(1, min(int(limit), stop_index.MAX_LIMIT))
+
+    scored = search_operators(operators, query, limit, fuzzy)
+    candidates = sorted(
+        (kind, minus_services, order, result['stop_id'], operator, result)
+        for order, operator in enumerate(operators)
+        for kind, minus_services, result in scored[operator]
+    )
+
+    with metrics.stage('index_load'):
+        groups = load_stop_groups()
+
+    # 先頭から limit 件の枠に入れていき、まとまりのある停留所は同じ枠に寄せる
+    entries = []
+    group_entries = {}
+    for _, _, _, stop_id, operator, result in candidates:
+        group = groups.group_of(operator, stop_id)
+        entry = group_entries.get(group) if group >= 0 else None
+        if entry is None:
+            if len(entries) >= limit:
+                continue
+            entry = {'group': group if group >= 0 else None, 'stops': []}
+            entries.append(entry)
+            if group >= 0:
+                group_entries[group] = entry
+        entry['stops'].append(dict(result, operator=operator))
+
+    # 検索結果の上位に入らなかったまとまりの残り（便の少ないのりばなど）も足す
+    for group, entry in group_entries.items():
+        found = {(stop['operator'], stop['stop_id']) for stop in entry['stops']}
+        for operator, stop_id in groups.members(group):
+            if operator not in operators or (operator, stop_id) in found:
+                continue
+            result = OPERATORS[operator].get_stop(stop_id)
+            if result is not None:
+                entry['stops'].append(dict(result, operator=operator))
+
+    results = []
+    for entry in entries:
+        for stop in entry['stops']:
+            stop['group'] = entry['group']
+            results.append(stop)
+    return results
+
+def search(query, limit=stop_index.DEFAULT_LIMIT, fuzzy=False, operators=None):
+    if not query:
+        sys.exit()
+
+    results = search_all(query, limit, fuzzy, operators)
+    with metrics.stage('serialization'):
+        return json.dumps(results, ensure_ascii=False)
@@ -5,68 +5,59 @@ import rinkoBus.record_congestion
 import toBus.prepare_gtfs_data
 import toBus.record_congestion
 import map.yokohamaMunicipal.request
-import time
-import datetime
-import concurrent.futures
-
-last_daily_run_date = None
+import daily_build
+from common import feed_fetcher
+from scheduler import Scheduler, now_jst
+import asyncio
+import os
 
 # 実行するタスクをわかりやすくまとめておく
+# 各事業者のGTFS更新・ビルドは daily_build の中でプロセスを分けて並列に動かす
 DAILY_INIT_TASKS = (
-    yokohamaMunicipal.prepare_gtfs_data.init,
-    rinkoBus.prepare_gtfs_data.init,
-    toBus.prepare_gtfs_data.init,
+    daily_build.run,
     map.yokohamaMunicipal.request.init
 )
+
+# フィードごとの取得間隔（秒）。ODPT 側の更新間隔が変わったら環境変数で合わせる
+VEHICLE_INTERVAL = float(os.environ.get('VEHICLE_FEED_INTERVAL', 15))
+TRIP_UPDATE_INTERVAL = float(os.environ.get('TRIP_UPDATE_FEED_INTERVAL', 30))
+MAP_INTERVAL = float(os.environ.get('MAP_FEED_INTERVAL', 30))
+
+# (コルーチン, 実行間隔[秒])
 REALTIME_TASKS = (
-    yokohamaMunicipal.record_congestion.main,
-    rinkoBus.record_congestion.main,
-    toBus.record_congestion.main,
-    map.yokohamaMunicipal.request.main
+    (yokohamaMunicipal.record_congestion.main_async, VEHICLE_INTERVAL),
+    (yokohamaMunicipal.record_congestion.update_trip_update_async, TRIP_UPDATE_INTERVAL),
+    (rinkoBus.record_congestion.main_async, VEHICLE_INTERVAL),
+    (rinkoBus.record_congestion.update_trip_update_async, TRIP_UPDATE_INTERVAL),
+    (toBus.record_congestion.main_async, VEHICLE_INTERVAL),
+    (map.yokohamaMunicipal.request.main_async, MAP_INTERVAL)
 )
 # タイムアウト時間（秒）
 REALTIME_TASK_TIMEOUT = 25 
 DAILY_TASK_TIMEOUT = 300
 
-def should_run_daily():
-    global last_daily_run_date
-    now = datetime.datetime.utcnow() + datetime.timedelta(hours=9) # JST
+# 毎日4時半に1回だけ実行
+DAILY_RUN_HOUR = 4
+DAILY_RUN_MINUTE = 30
 
-    # 毎日4時半に1回だけ実行
-    if now.hour == 4 and now.minute == 30:
-        if last_daily_run_date != now.day:
-            last_daily_run_date = now.day
-            return True
-    return False
+def is_realtime_hours():
+    now = now_jst()
+    return now.hour >= 5 or now.hour == 1
 
-def run_tasks_async(tasks, timeout):
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_task = {executor.submit(task): task for task in tasks}
 
-        for future in concurrent.futures.as_completed(future_to_task):
-            task_name = future_to_task[future].__name__
-            module_name = future_to_task[future].__module__
-            
-            try:
-                future.result(timeout=timeout) 
-                print(f"✅ Task '{module_name}.{task_name}' completed successfully.")
-            except concurrent.futures.TimeoutError:
-                print(f"⏰ Error: Task '{module_name}.{task_name}' timed out after {timeout} seconds.")
-            except Exception as e:
-                print(f"❌ Error in task '{module_name}.{task_name}': {e}")
+async def run():
+    scheduler = Scheduler()
 
+    scheduler.daily(DAILY_RUN_HOUR, DAILY_RUN_MINUTE, DAILY_INIT_TASKS, timeout=DAILY_TASK_TIMEOUT)
 
-if __name__ == "__main__": 
-    while True:
-        # 1日1回早朝に実行
-        if should_run_daily():
-            print("🚀 Running daily init tasks...")
-            run_tasks_async(DAILY_INIT_TASKS, timeout=DAILY_TASK_TIMEOUT)
+    for task, interval in REALTIME_TASKS:
+        scheduler.every(interval, task, timeout=REALTIME_TASK_TIMEOUT, is_active=is_realtime_hours)
+
+    try:
+        await scheduler.run_forever()
+    finally:
+        await feed_fetcher.close_async_client()
 
-        now = datetime.datetime.utcnow() + datetime.timedelta(hours=9) # JST
-        
-        if now.hour >= 5 or now.hour == 1:
-            print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 🚀 Running real-time tasks...")
-            run_tasks_async(REALTIME_TASKS, timeout=REALTIME_TASK_TIMEOUT)
 
-        time.sleep(15)  # 15秒ごと
\ No newline at end of file
+if __name__ == "__main__": 
+    asyncio.run(run())
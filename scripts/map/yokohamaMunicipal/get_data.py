@@ -1,39 +1,74 @@
-import requests
 import csv
 import pickle
 from datetime import datetime, timedelta
-import boto3
-from google.transit import gtfs_realtime_pb2
 import time
 import io
 import os
 import json
+from common import file_cache
+from common import index_format
+from common import vehicle_history
 
 path = os.path.dirname(__file__)
 
 ACCESS_TOKEN = os.environ.get('ODPT_ACCESS_TOKEN', '')
 
+ODPT_API_BASE = os.environ.get('ODPT_API_BASE', 'https://api.odpt.org')
+
 RT_DATA_KEY = path + '/cache/location.json'
 ROUTE_DATA_KEY = path + '/cache/rotes.json'
 POLE_DATA_KEY = path + '/cache/poles.json'
+HISTORY_DIR = path + '/cache/history'
+
+# 軌跡の長さを省略したとき（分、上限は vehicle_history.MAX_TRAIL_MINUTES）
+DEFAULT_TRAIL_MINUTES = 10
 
 def load_file(key):
     with open(key, 'r') as f:
         return f.read()
     
+def load_json(key):
+    return json.loads(load_file(key))
+
+# 更新されるまではパース済みのものを返す
 def get_route():
-    response = load_file(ROUTE_DATA_KEY)
-    return json.loads(response)
+    return file_cache.load(ROUTE_DATA_KEY, load_json, 'map.routes')
 
 def get_location():
-    response = load_file(RT_DATA_KEY)
-    return json.loads(response)
+    return file_cache.load(RT_DATA_KEY, load_json, 'map.location')
 
 def get_poles():
-    response = load_file(POLE_DATA_KEY)
-    return json.loads(response)
+    return file_cache.load(POLE_DATA_KEY, load_json, 'map.poles')
+
+def load_history():
+    try:
+        return vehicle_history.load_history(HISTORY_DIR, 'map.history')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        print("車両の位置の履歴が存在しないか読み込み失敗:", e)
+        return None
+
+# 車両（id を省略するとすべて）の直近 minutes 分の軌跡
+def get_trails(id=None, minutes=DEFAULT_TRAIL_MINUTES):
+    history = load_history()
+    return history.trails(id, minutes) if history is not None else []
+
+# at（UNIX 時刻か ISO 8601、省略すると今）の各車両の位置。受け取った位置の間は補間する
+# at が読めなければ ValueError
+def get_positions(at=None):
+    if not at:
+        timestamp = int(time.time())
+    elif at.isdigit():
+        timestamp = int(at)
+    else:
+        timestamp = vehicle_history.parse_time(at)
+
+    history = load_history()
+    return history.positions_at(timestamp) if history is not None else []
 
 def get_route_information(id):
-    url = 'https://api.odpt.org/api/v4/odpt:BusroutePattern?acl:consumerKey=' + ACCESS_TOKEN + '&owl:sameAs=' + id
+    # ここでしか使わないので必要になってから読み込む
+    import requests
+
+    url = ODPT_API_BASE + '/api/v4/odpt:BusroutePattern?acl:consumerKey=' + ACCESS_TOKEN + '&owl:sameAs=' + id
     response = requests.get(url)
     return json.loads(response.content)
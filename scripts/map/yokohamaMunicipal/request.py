@@ -4,34 +4,86 @@ import pickle
 from datetime import datetime, timedelta
 import boto3
 from google.transit import gtfs_realtime_pb2
+from common import feed_fetcher
+from common import poller_telemetry
+from common import vehicle_history
 import time
 import io
+import json
 import os
+import threading
 
 path = os.path.dirname(__file__)
 
 RT_DATA_KEY = path + '/cache/location.json'
 ROUTE_DATA_KEY = path + '/cache/rotes.json'
 POLE_DATA_KEY = path + '/cache/poles.json'
+HISTORY_DIR = path + '/cache/history'
 
 ACCESS_TOKEN = os.environ.get('ODPT_ACCESS_TOKEN', '')
 
-API_ENDPOINT = 'https://api.odpt.org/api/v4/odpt:Bus?acl:consumerKey=' + ACCESS_TOKEN + '&odpt:operator=odpt.Operator:YokohamaMunicipal'
+ODPT_API_BASE = os.environ.get('ODPT_API_BASE', 'https://api.odpt.org')
 
-ROUTE_API_ENDPOINT = 'https://api.odpt.org/api/v4/odpt:BusroutePattern.json?acl:consumerKey=' + ACCESS_TOKEN
+API_ENDPOINT = ODPT_API_BASE + '/api/v4/odpt:Bus?acl:consumerKey=' + ACCESS_TOKEN + '&odpt:operator=odpt.Operator:YokohamaMunicipal'
 
-POLE_API_ENDPOINT = 'https://api.odpt.org/api/v4/odpt:BusstopPole?acl:consumerKey=' + ACCESS_TOKEN + '&odpt:operator=odpt.Operator:YokohamaMunicipal'
+ROUTE_API_ENDPOINT = ODPT_API_BASE + '/api/v4/odpt:BusroutePattern.json?acl:consumerKey=' + ACCESS_TOKEN
+
+POLE_API_ENDPOINT = ODPT_API_BASE + '/api/v4/odpt:BusstopPole?acl:consumerKey=' + ACCESS_TOKEN + '&odpt:operator=odpt.Operator:YokohamaMunicipal'
+
+# 車両ごとの直近の位置（このプロセスのメモリに持ち、受け取るたびに書き出す）
+_history = None
+_history_lock = threading.Lock()
+
+def record_history(content):
+    global _history
+    with poller_telemetry.phase('parse'):
+        buses = json.loads(content)
+
+    now = int(time.time())
+    with _history_lock:
+        if _history is None:
+            _history = vehicle_history.restore(HISTORY_DIR)
+
+        for bus in buses:
+            # 終着（toBusstopPole が null）や位置のないものは足さない
+            if bus.get('odpt:toBusstopPole') is None or bus.get('geo:lat') is None or bus.get('geo:long') is None:
+                continue
+            timestamp = vehicle_history.parse_time(bus['dc:date']) if bus.get('dc:date') else now
+            _history.append(
+                bus.get('owl:sameAs') or bus.get('odpt:busNumber'), timestamp, bus['geo:lat'], bus['geo:long'],
+                bus.get('odpt:fromBusstopPole'), bus.get('odpt:occupancyStatus'), bus.get('odpt:busroutePattern'),
+            )
+        _history.expire(now)
+
+        with poller_telemetry.phase('write'):
+            _history.publish(HISTORY_DIR)
+
+def save_location(content, version):
+    tmp_key = RT_DATA_KEY + '.tmp'
+    with poller_telemetry.phase('write'):
+        with open(tmp_key, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_key, RT_DATA_KEY)
+
+    record_history(content)
+    feed_fetcher.mark_processed(RT_DATA_KEY, version)
 
 def main():
-    response = requests.get(API_ENDPOINT)
-    with open(RT_DATA_KEY, 'wb') as f:
-        f.write(response.content)
+    # 前回と同じ内容なら書き換えない
+    new_feed = feed_fetcher.fetch_new_feed(API_ENDPOINT, RT_DATA_KEY)
+    if new_feed is not None:
+        save_location(*new_feed)
+
+async def main_async():
+    new_feed = await feed_fetcher.fetch_new_feed_async(API_ENDPOINT, RT_DATA_KEY)
+    if new_feed is not None:
+        await feed_fetcher.run_in_worker(save_location, *new_feed)
 
 def init():
-    response = requests.get(ROUTE_API_ENDPOINT)
+    response = feed_fetcher.fetch(ROUTE_API_ENDPOINT, conditional=False)
     with open(ROUTE_DATA_KEY, 'wb') as f:
         f.write(response.content)
 
-    response = requests.get(POLE_API_ENDPOINT)
+    response = feed_fetcher.fetch(POLE_API_ENDPOINT, conditional=False)
     with open(POLE_DATA_KEY, 'wb') as f:
         f.write(response.content)
@@ -0,0 +1,57 @@
+import datetime
+import json
+import os
+from common import index_format
+from common import metrics
+from common import timetable
+
+path = os.path.dirname(__file__)
+
+TIMETABLE_DIR = path + '/cache/timetable'
+
+def build_timetable():
+    # 展開済みのGTFSから作る（ふだんは日次ビルドで作られているので、ここでだけ import）
+    import rinkoBus.prepare_gtfs_data as prepare_gtfs_data
+    prepare_gtfs_data.build_timetable()
+
+def load_timetable():
+    try:
+        return timetable.load_timetable(TIMETABLE_DIR, f'{__name__}.timetable')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        print("時刻表が存在しないか読み込み失敗:", e)
+        build_timetable()
+        return timetable.load_timetable(TIMETABLE_DIR, f'{__name__}.timetable')
+
+def parse_depart_at(depart_at):
+    """'HH:MM'・'YYYY-MM-DDTHH:MM'（省略すると今）→ (日付, 0時からの秒)"""
+    now = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
+    if not depart_at:
+        return now.date(), now.hour * 3600 + now.minute * 60 + now.second
+    if 'T' in depart_at or '-' in depart_at:
+        at = datetime.datetime.fromisoformat(depart_at)
+        return at.date(), at.hour * 3600 + at.minute * 60 + at.second
+    return now.date(), timetable.parse_time(depart_at if depart_at.count(':') == 2 else depart_at + ':00')
+
+# 経路検索（origin・destination は stop_id か停留所名）
+def plan(origin, destination, depart_at=None):
+    day, seconds = parse_depart_at(depart_at)
+    with metrics.stage('index_load'):
+        table = load_timetable()
+
+    with metrics.stage('journey_search'):
+        journeys = table.plan(origin, destination, day, seconds)
+
+    with metrics.stage('serialization'):
+        return json.dumps(journeys, ensure_ascii=False)
+
+# 到達圏（stop から minutes 分以内に行ける停留所と、一番早く着く時刻）
+def reachable(stop, depart_at=None, minutes=timetable.DEFAULT_ISOCHRONE_MINUTES):
+    day, seconds = parse_depart_at(depart_at)
+    with metrics.stage('index_load'):
+        table = load_timetable()
+
+    with metrics.stage('journey_search'):
+        stops = table.reachable(stop, day, seconds, minutes)
+
+    with metrics.stage('serialization'):
+        return json.dumps(stops, ensure_ascii=False)
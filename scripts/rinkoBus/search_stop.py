@@ -1,19 +1,16 @@
-import boto3
-import csv
-import pickle
 import unicodedata
-import re
-from botocore.exceptions import ClientError
 import json
 import os
 import sys
 import jaconv
+from common import index_format
+from common import stop_index
+from common import metrics
 
 path = os.path.dirname(__file__)
 
-S3_PREFIX_DATA = path + '/gtfs_data/'
-S3_INDEX_PATH = path + '/cache/stop_index.pkl'
-LOCAL_INDEX_PATH = path + '/cache/index.pkl'
+SEARCH_INDEX_DIR = path + '/cache/search_index'
+SUGGEST_INDEX_DIR = path + '/cache/suggest_index'
 
 # 正規化処理（表記ゆれ対応）
 def normalize(text):
@@ -23,141 +20,77 @@ def normalize(text):
     text = text.replace('ヶ', 'ケ').replace('ケ', 'ヶ')  # どちらも考慮
     return text.lower()
 
-def download_csv(file_name):
-    with open(S3_PREFIX_DATA + file_name, newline='', encoding='utf-8') as f:
-        return list(csv.DictReader(f))
+def build_index():
+    # 展開済みのGTFSから作る（ふだんは日次ビルドで作られているので、ここでだけ import）
+    import rinkoBus.prepare_gtfs_data as prepare_gtfs_data
+    prepare_gtfs_data.build_search_index()
 
-# 辞書を構築しS3へ保存
-def build_and_upload_index():
-    stops = download_csv('stops.txt')
-    stop_times = download_csv('stop_times.txt')
-    trips = download_csv('trips.txt')
-    routes = download_csv('routes.txt')
-    translations = download_csv('translations.txt')
-
-    stop_name_map = {}  # normalized name → set of stop_ids
-    stop_name_kana_map = {}  # normalized name → set of stop_ids
-    stop_id_to_name = {}
-    stop_id_to_trips = {}  # stop_id → set of trip_id
-    trip_id_to_info = {}   # trip_id → (route_id, stop_headsign)
-    route_id_to_name = {}  # route_id → route_long_name
-    trip_id_to_last_stop = {}  # ★ trip_id → last stop_id
-
-    # --- stops.txt 読み込み ---
-    for stop in stops:
-        stop_id = stop['stop_id']
-        name = stop['stop_name']
-        norm = normalize(name)
-        stop_name_map.setdefault(norm, set()).add(stop_id)
-        stop_id_to_name[stop_id] = name
-
-        # かな
-        for translation in translations:
-            if translation['language'] == 'ja-Hrkt' and translation['field_value'] == name:
-                norm = normalize(translation['translation'])
-                stop_name_kana_map.setdefault(norm, set()).add(stop_id)
-
-    # --- stop_times.txt を trip_id → stop_sequence でマッピング ---
-    trip_stop_sequences = {}
-    for row in stop_times:
-        trip_id = row['trip_id']
-        stop_id = row['stop_id']
-        seq = int(row.get('stop_sequence', 0))
-        trip_stop_sequences.setdefault(trip_id, []).append((seq, stop_id))
-
-    for trip_id, stops_seq in trip_stop_sequences.items():
-        sorted_stops = sorted(stops_seq)
-        last_stop_id = sorted_stops[-1][1]  # ★ 最終 stop_id
-        trip_id_to_last_stop[trip_id] = last_stop_id
-
-        for _, stop_id in sorted_stops:
-            # stop_id → trip_id の関連付け（終着かどうかは後でフィルタ）
-            stop_id_to_trips.setdefault(stop_id, set()).add(trip_id)
-
-    # --- trips.txt ---
-    for trip in trips:
-        trip_id = trip['trip_id']
-        trip_id_to_info[trip_id] = (trip['route_id'], trip.get('trip_headsign', ''))
-
-    # --- routes.txt ---
-    for route in routes:
-        route_id = route['route_id']
-        if route.get('route_long_name', ''):
-            route_id_to_name[route_id] = route.get('route_long_name', '').lstrip('0')
-        else:
-            route_id_to_name[route_id] = route.get('route_short_name', '').lstrip('0')
-
-    # ★ stop_id_to_trips をフィルタ（終着は除外）
-    for stop_id in list(stop_id_to_trips.keys()):
-        filtered_trips = {
-            tid for tid in stop_id_to_trips[stop_id]
-            if trip_id_to_last_stop.get(tid) != stop_id
-        }
-        stop_id_to_trips[stop_id] = filtered_trips
-
-    index_data = (
-        stop_name_map,
-        stop_name_kana_map,
-        stop_id_to_name,
-        stop_id_to_trips,
-        trip_id_to_info,
-        route_id_to_name
-    )
-
-    with open(LOCAL_INDEX_PATH, 'wb') as f:
-        pickle.dump(index_data, f)
-
-    return index_data
-
-# S3から辞書を読み込み（存在しなければ構築）
+# 辞書を読み込み（存在しなければ構築）
 def load_index():
+    # current の世代が切り替わるまではマップしたものを使う
     try:
-        with open(LOCAL_INDEX_PATH, 'rb') as f:
-            return pickle.load(f)
-    except FileNotFoundError as e:
+        return stop_index.load_search_index(SEARCH_INDEX_DIR, f'{__name__}.index')
+    except (FileNotFoundError, index_format.FormatError) as e:
         print("辞書が存在しないか読み込み失敗:", e)
-        return build_and_upload_index()
+        build_index()
+        return stop_index.load_search_index(SEARCH_INDEX_DIR, f'{__name__}.index')
 
-# 検索処理
-def search_stop(query):
+def load_suggest_index():
+    try:
+        return stop_index.load_suggest_index(SUGGEST_INDEX_DIR, f'{__name__}.suggest_index')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        print("入力補完の辞書が存在しないか読み込み失敗:", e)
+        build_index()
+        return stop_index.load_suggest_index(SUGGEST_INDEX_DIR, f'{__name__}.suggest_index')
+
+def stop_result(index, stop):
+    location = index.location(stop)
+    return {
+        'stop_id': index.stop_ids[stop],
+        'stop_name': index.stop_names[stop],
+        'lat': location['lat'],
+        'lon': location['lon'],
+        'routes': index.route_headsigns(stop),
+        'routes_by_day': index.route_headsigns_by_day(stop)
+    }
+
+# 検索処理（完全一致 → 前方一致 → 部分一致 → かなの一致 → fuzzy なら編集距離の近いもの、同じなら便の多い順に limit 件）
+# 事業者をまたいで並べ直せるよう (一致の種類, -便数, 結果) で返す
+def search_scored(query, limit=stop_index.DEFAULT_LIMIT, fuzzy=False):
     norm_query = normalize(query)
-    (
-        stop_name_map, stop_name_kana_map, stop_id_to_name,
-        stop_id_to_trips, trip_id_to_info,
-        route_id_to_name
-    ) = load_index()
+    limit = max(1, min(int(limit), stop_index.MAX_LIMIT))
+    with metrics.stage('index_load'):
+        index = load_index()
 
-    matched_ids = set()
-    for name_norm, ids in stop_name_map.items():
-        if norm_query in name_norm:
-            matched_ids.update(ids)
+    return [
+        (kind, minus_services, stop_result(index, stop))
+        for kind, minus_services, stop in index.scored(norm_query, jaconv.hira2kata(norm_query), limit, fuzzy)
+    ]
 
-    for name_kana_norm, ids in stop_name_kana_map.items():
-        if jaconv.kata2hira(norm_query) in name_kana_norm:
-            matched_ids.update(ids)
+def search_stop(query, limit=stop_index.DEFAULT_LIMIT, fuzzy=False):
+    return [result for _, _, result in search_scored(query, limit, fuzzy)]
 
-    result = []
-    for stop_id in matched_ids:
-        stop_name = stop_id_to_name.get(stop_id, '')
-        trips = stop_id_to_trips.get(stop_id, set())
-        route_headsigns = set()
-        for trip_id in trips:
-            route_id, headsign = trip_id_to_info.get(trip_id, ('', ''))
-            route_name = route_id_to_name.get(route_id, route_id)
-            route_headsigns.add((route_name, headsign))
+def get_stop(stop_id):
+    """stop_id の停留所の検索結果と同じ形（なければ None）"""
+    index = load_index()
+    stop = index.stop_ids.index(stop_id)
+    return None if stop < 0 else stop_result(index, stop)
 
-        if len(route_headsigns) > 0:
-            result.append({
-                'stop_id': stop_id,
-                'stop_name': stop_name,
-                'routes': list(route_headsigns)
-            })
-
-    return result
-
-def search(query):
+def search(query, limit=stop_index.DEFAULT_LIMIT, fuzzy=False):
     if not query:
         sys.exit()
 
-    results = search_stop(query)
-    return json.dumps(results, ensure_ascii=False)
+    results = search_stop(query, limit, fuzzy)
+    with metrics.stage('serialization'):
+        return json.dumps(results, ensure_ascii=False)
+
+# 入力補完（停留所名・読み・ローマ字の前方一致）
+def suggest(query, limit=stop_index.SUGGEST_LIMIT):
+    prefix = stop_index.suggest_key(normalize(query))
+    limit = max(1, min(int(limit), stop_index.MAX_SUGGEST_LIMIT))
+    with metrics.stage('index_load'):
+        index = load_suggest_index()
+
+    names = index.suggest(prefix, limit)
+    with metrics.stage('serialization'):
+        return json.dumps([{'stop_name': name} for name in names], ensure_ascii=False)
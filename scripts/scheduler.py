@@ -0,0 +1,206 @@
+import asyncio
+import concurrent.futures
+import datetime
+import os
+import time
+
+from common import poller_telemetry
+
+# invoker.py 用のスケジューラ
+# 周期タスクはタスクごとの間隔で monotonic な期限から次回を決める（処理時間で周期がずれない）
+# 前回の実行が終わっていなければその回は飛ばす（重ねて実行しない）
+# 周期タスクはコルーチンとして1つのイベントループ上で動かし、タイムアウトしたら実際にキャンセルする
+# 日次タスクは時間のかかる同期処理なのでワーカースレッドで動かす
+# 各回の所要時間などは poller_telemetry に記録する
+
+path = os.path.dirname(__file__)
+
+LAST_DAILY_RUN_PATH = path + '/cache/last_daily_run'
+
+# 期限がないときでも日次タスクの判定のために起きる間隔（秒）
+MAX_SLEEP = 1.0
+
+# 日次タスクが失敗したとき、同じ日のうちにやり直すまでの間隔（秒）
+DAILY_RETRY_INTERVAL = 30 * 60
+
+def now_jst():
+    return datetime.datetime.utcnow() + datetime.timedelta(hours=9)
+
+def task_name(task):
+    return f'{task.__module__}.{task.__name__}'
+
+class PeriodicJob:
+    def __init__(self, task, interval, timeout, is_active=None):
+        self.task = task
+        self.name = task_name(task)
+        self.interval = interval
+        self.timeout = timeout
+        self.is_active = is_active
+        self.next_run = time.monotonic()
+        self.running = None
+
+    def advance(self, now):
+        # 遅れた分の回は積み上げずに飛ばす
+        missed = int((now - self.next_run) // self.interval) + 1
+        self.next_run += missed * self.interval
+        return missed - 1
+
+class DailyJob:
+    def __init__(self, tasks, hour, minute, timeout, state_path=LAST_DAILY_RUN_PATH):
+        self.tasks = tasks
+        self.hour = hour
+        self.minute = minute
+        self.timeout = timeout
+        self.state_path = state_path
+        self.futures = []
+        self.run_date = None
+        self.started_at = None
+        self.retry_at = None
+        self.timeout_reported = False
+        self.last_run_date = self.load_last_run_date()
+
+    def load_last_run_date(self):
+        try:
+            with open(self.state_path, 'r') as f:
+                return datetime.date.fromisoformat(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_last_run_date(self, date):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(date.isoformat())
+        os.replace(tmp_path, self.state_path)
+        self.last_run_date = date
+
+    def is_due(self, now):
+        # 時刻ちょうどでなく「今日の実行時刻を過ぎていて、今日まだ実行していない」で判定
+        # （1サイクルが長引いても、再起動をまたいでも取りこぼさない）
+        scheduled = now.replace(hour=self.hour, minute=self.minute, second=0, microsecond=0)
+        if self.retry_at is not None and time.monotonic() < self.retry_at:
+            return False
+        return now >= scheduled and self.last_run_date != now.date()
+
+    def is_running(self):
+        return any(not future.done() for future in self.futures)
+
+    def complete(self):
+        """終わったタスクがすべて成功していれば、その日は実行済みにする（失敗・途中で落ちたときは済みにせず、後でやり直す）"""
+        failed = [future for future in self.futures if future.cancelled() or future.exception() is not None]
+        if failed:
+            print(f"🔁 {len(failed)} daily task(s) failed; retrying in {DAILY_RETRY_INTERVAL // 60} minutes.")
+            self.retry_at = time.monotonic() + DAILY_RETRY_INTERVAL
+        else:
+            self.save_last_run_date(self.run_date)
+            self.retry_at = None
+        self.futures = []
+
+class Scheduler:
+    def __init__(self, max_workers=4):
+        # 日次タスク用のワーカーはサイクルごとに作り直さず使い回す
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='daily')
+        self.jobs = []
+        self.daily_jobs = []
+
+    def every(self, interval, task, timeout, is_active=None):
+        """task は引数なしの async 関数"""
+        self.jobs.append(PeriodicJob(task, interval, timeout, is_active))
+        poller_telemetry.register_task(task_name(task), interval, timeout)
+
+    def daily(self, hour, minute, tasks, timeout):
+        self.daily_jobs.append(DailyJob(tasks, hour, minute, timeout))
+        for task in tasks:
+            poller_telemetry.register_task(task_name(task), timeout=timeout)
+
+    def submit(self, task):
+        started_at = time.monotonic()
+        future = self.executor.submit(self.run_daily_task, task)
+        future.add_done_callback(lambda f: self.report(task, f, started_at))
+        return future
+
+    def run_daily_task(self, task):
+        cycle, token = poller_telemetry.start(task_name(task))
+        status = None
+        try:
+            task()
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            poller_telemetry.finish(cycle, token, status)
+
+    def report(self, task, future, started_at):
+        elapsed = time.monotonic() - started_at
+        try:
+            future.result()
+            print(f"✅ Task '{task_name(task)}' completed successfully in {elapsed:.1f}s.")
+        except Exception as e:
+            print(f"❌ Error in task '{task_name(task)}': {e}")
+
+    async def run_periodic(self, job):
+        started_at = time.monotonic()
+        cycle, token = poller_telemetry.start(job.name)
+        status = None
+        try:
+            await asyncio.wait_for(job.task(), job.timeout)
+            print(f"✅ Task '{job.name}' completed successfully in {time.monotonic() - started_at:.1f}s.")
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            print(f"⏰ Error: Task '{job.name}' timed out after {job.timeout} seconds and was cancelled.")
+        except Exception as e:
+            status = 'error'
+            print(f"❌ Error in task '{job.name}': {e}")
+        finally:
+            poller_telemetry.finish(cycle, token, status)
+
+    def run_job(self, job):
+        if job.running is not None and not job.running.done():
+            print(f"⏭️ Skipped '{job.name}': previous run is still in progress.")
+            poller_telemetry.record_skip(job.name, 'overlap')
+            return
+
+        if job.is_active is not None and not job.is_active():
+            return
+
+        job.running = asyncio.create_task(self.run_periodic(job), name=job.name)
+
+    def run_daily_job(self, job):
+        now = now_jst()
+        if job.is_running():
+            if time.monotonic() - job.started_at > job.timeout and not job.timeout_reported:
+                print(f"⏰ Error: Daily tasks are still running after {job.timeout} seconds.")
+                job.timeout_reported = True
+            return
+
+        if job.futures:
+            job.complete()
+
+        if not job.is_due(now):
+            return
+
+        print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] 🚀 Running daily init tasks...")
+        job.run_date = now.date()
+        job.started_at = time.monotonic()
+        job.timeout_reported = False
+        job.futures = [self.submit(task) for task in job.tasks]
+
+    def tick(self):
+        for job in self.daily_jobs:
+            self.run_daily_job(job)
+
+        now = time.monotonic()
+        for job in self.jobs:
+            if now >= job.next_run:
+                self.run_job(job)
+                skipped = job.advance(now)
+                if skipped:
+                    print(f"⏭️ '{job.name}' fell behind by {skipped} tick(s).")
+                    poller_telemetry.record_skip(job.name, 'behind')
+
+    async def run_forever(self):
+        while True:
+            self.tick()
+
+            next_run = min((job.next_run for job in self.jobs), default=time.monotonic() + MAX_SLEEP)
+            await asyncio.sleep(max(0.0, min(next_run - time.monotonic(), MAX_SLEEP)))
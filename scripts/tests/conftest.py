@@ -0,0 +1,60 @@
+import datetime
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common import timetable
+
+# 経路検索・予測時刻のテスト用の小さな時刻表（停留所は歩いて乗り換えられないよう約1km ずつ離す）
+#   T1 (R1): A 08:00 → B 08:10 → C 08:20
+#   T2 (R2): B 08:15 → D 08:30                    … A → D は B で乗り換え
+#   T3 (R3): A 08:01 → D 08:20（D では降りられない）
+#   T4 (R4): E 08:00（乗れない）→ D 08:10
+#   T5 (R5): C 24:30 → E 24:50                    … 前日のダイヤの深夜便
+
+MONDAY = datetime.date(2026, 10, 19)
+
+STOPS = ('A', 'B', 'C', 'D', 'E')
+
+STOP_TIMES = (
+    # trip_id, stop_id, stop_sequence, 時刻, pickup_type, drop_off_type
+    ('T1', 'A', 1, '08:00:00', '', ''),
+    ('T1', 'B', 2, '08:10:00', '', ''),
+    ('T1', 'C', 3, '08:20:00', '', ''),
+    ('T2', 'B', 1, '08:15:00', '', ''),
+    ('T2', 'D', 2, '08:30:00', '', ''),
+    ('T3', 'A', 1, '08:01:00', '', ''),
+    ('T3', 'D', 2, '08:20:00', '', '1'),
+    ('T4', 'E', 1, '08:00:00', '1', ''),
+    ('T4', 'D', 2, '08:10:00', '', ''),
+    ('T5', 'C', 1, '24:30:00', '', ''),
+    ('T5', 'E', 2, '24:50:00', '', ''),
+)
+
+def publish_fixture(root):
+    stops = [
+        {'stop_id': stop_id, 'stop_name': f'{stop_id}停留所', 'stop_lat': str(35.40 + i * 0.01), 'stop_lon': '139.60'}
+        for i, stop_id in enumerate(STOPS)
+    ]
+    trips = [
+        {'trip_id': f'T{i}', 'route_id': f'R{i}', 'service_id': 'WEEKDAY', 'trip_headsign': f'行先{i}'}
+        for i in range(1, 6)
+    ]
+    stop_times = [
+        {'trip_id': trip_id, 'stop_id': stop_id, 'stop_sequence': str(sequence), 'arrival_time': time,
+         'departure_time': time, 'pickup_type': pickup, 'drop_off_type': drop_off}
+        for trip_id, stop_id, sequence, time, pickup, drop_off in STOP_TIMES
+    ]
+    calendar = [{
+        'service_id': 'WEEKDAY', 'start_date': '20260101', 'end_date': '20261231',
+        'monday': '1', 'tuesday': '1', 'wednesday': '1', 'thursday': '1', 'friday': '1', 'saturday': '0', 'sunday': '0',
+    }]
+    timetable.publish_timetable(root, stops, trips, stop_times, calendar, [], {})
+    return timetable.load_timetable(root)
+
+@pytest.fixture
+def table(tmp_path):
+    return publish_fixture(str(tmp_path / 'timetable'))
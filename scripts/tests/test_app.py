@@ -0,0 +1,10 @@
+import os
+import subprocess
+import sys
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_import_does_not_load_numpy():
+    # numpy は使う関数の中で読み込むので、起動しただけでは読み込まれない（別プロセスで確かめる）
+    code = "import sys, app; sys.exit('numpy' in sys.modules)"
+    assert subprocess.run([sys.executable, '-c', code], cwd=SCRIPTS_DIR).returncode == 0
@@ -0,0 +1,67 @@
+import time
+
+import pytest
+from botocore.exceptions import ReadTimeoutError
+
+from bench.fake_dynamodb import FakeResource
+from common import congestion_client
+
+class TimingOutResource:
+    """毎回 boto3 の読み取りタイムアウトになる DynamoDB"""
+    def __init__(self):
+        self.calls = 0
+
+    def batch_get_item(self, RequestItems):
+        self.calls += 1
+        time.sleep(0.01)
+        raise ReadTimeoutError(endpoint_url='https://dynamodb.ap-northeast-1.amazonaws.com')
+
+@pytest.fixture
+def lookups(monkeypatch):
+    congestion_client.clear_cache()
+    counted = []
+    monkeypatch.setattr(congestion_client.metrics, 'cache_lookup', lambda cache, hits=0, misses=0: counted.append((hits, misses)))
+    yield counted
+    congestion_client.clear_cache()
+
+def test_duplicate_pairs_are_counted_once(monkeypatch, lookups):
+    resource = FakeResource()
+    resource.seed_congestion([('T1', 1), ('T1', 2)])
+    monkeypatch.setattr(congestion_client, 'get_resource', lambda remaining=None: resource)
+
+    pairs = [('T1', 1), ('T1', '1'), ('T1', 2), ('T1', 2)]
+    first = congestion_client.batch_get(pairs)
+    second = congestion_client.batch_get(pairs)
+
+    assert first == second
+    assert set(first) == {('T1', 1), ('T1', 2)}
+    assert lookups == [(0, 2), (2, 0)]
+
+def test_unprocessed_keys_are_retried_until_resolved(monkeypatch, lookups):
+    resource = FakeResource(unprocessed_rate=0.5, seed=1)
+    keys = [('T1', sequence) for sequence in range(1, 41)]
+    resource.seed_congestion(keys)
+    monkeypatch.setattr(congestion_client, 'get_resource', lambda remaining=None: resource)
+    monkeypatch.setattr(congestion_client, '_backoff', lambda attempt: 0)
+
+    assert set(congestion_client.batch_get(keys)) == set(keys)
+    assert resource.batch_calls > 1
+
+def test_timeouts_stop_at_the_deadline(monkeypatch, lookups):
+    resource = TimingOutResource()
+    monkeypatch.setattr(congestion_client, 'get_resource', lambda remaining=None: resource)
+
+    started_at = time.monotonic()
+    assert congestion_client.batch_get([('T1', 1)], deadline=0.2) == {}
+    assert time.monotonic() - started_at < 0.5
+    assert resource.calls >= 1
+    # 取れなかったキーはキャッシュせず、次回また問い合わせる
+    congestion_client.batch_get([('T1', 1)], deadline=0.05)
+    assert lookups[-1] == (0, 1)
+
+def test_read_resource_timeout_follows_remaining_deadline():
+    config = congestion_client.get_resource(1.2).meta.client.meta.config
+
+    assert config.read_timeout == config.connect_timeout == 1.5
+    assert config.retries['total_max_attempts'] == 1
+    assert congestion_client.get_resource(1.3) is congestion_client.get_resource(1.2)
@@ -0,0 +1,49 @@
+import datetime
+import math
+
+import pytest
+
+from conftest import MONDAY
+from yokohamaMunicipal import congestion_profile
+
+CALENDAR = '''service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday,start_date,end_date
+DAILY,1,1,1,1,1,1,1,20260101,20261231
+WEEKDAY,1,1,1,1,1,0,0,20260101,20261231
+SATURDAY,0,0,0,0,0,1,0,20260101,20261231
+HOLIDAY,0,0,0,0,0,0,1,20260101,20261231
+'''
+
+@pytest.fixture
+def gtfs_dir(monkeypatch, tmp_path):
+    (tmp_path / 'calendar.txt').write_text(CALENDAR, encoding='utf-8')
+    (tmp_path / 'calendar_dates.txt').write_text(
+        'service_id,date,exception_type\n'
+        # 月曜の祝日: 平日ダイヤをやめて休日ダイヤ
+        'WEEKDAY,20261012,2\nHOLIDAY,20261012,1\n'
+        # 火曜に土曜ダイヤ
+        'WEEKDAY,20261013,2\nSATURDAY,20261013,1\n',
+        encoding='utf-8',
+    )
+    monkeypatch.setattr(congestion_profile, 'S3_PREFIX_DATA', str(tmp_path) + '/')
+    return tmp_path
+
+def test_day_type_follows_weekday_even_with_daily_service(gtfs_dir):
+    assert congestion_profile.get_day_type(MONDAY) == congestion_profile.WEEKDAY
+    assert congestion_profile.get_day_type(MONDAY + datetime.timedelta(days=5)) == congestion_profile.SATURDAY
+    assert congestion_profile.get_day_type(MONDAY + datetime.timedelta(days=6)) == congestion_profile.HOLIDAY
+
+def test_day_type_uses_services_added_by_calendar_dates(gtfs_dir):
+    assert congestion_profile.get_day_type(datetime.date(2026, 10, 12)) == congestion_profile.HOLIDAY
+    assert congestion_profile.get_day_type(datetime.date(2026, 10, 13)) == congestion_profile.SATURDAY
+
+def test_day_type_without_calendar_dates(gtfs_dir):
+    (gtfs_dir / 'calendar_dates.txt').unlink()
+    assert congestion_profile.get_day_type(datetime.date(2026, 10, 12)) == congestion_profile.WEEKDAY
+
+def test_predict_before_first_aggregation(monkeypatch, tmp_path):
+    monkeypatch.setattr(congestion_profile, 'PROFILE_PATH', str(tmp_path / 'missing.npz'))
+
+    assert congestion_profile.load_profile() is None
+    predicted = congestion_profile.predict(['R1', 'R2'], ['S1', 'S2'], [32, 33], congestion_profile.WEEKDAY)
+    assert len(predicted) == 2
+    assert all(math.isnan(value) for value in predicted.tolist())
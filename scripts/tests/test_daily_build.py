@@ -0,0 +1,62 @@
+import datetime
+import types
+
+import pytest
+
+import daily_build
+import scheduler
+from common import index_store
+from common import poller_telemetry
+from common import stop_index
+
+def failing_download(build=False):
+    raise OSError('GTFS download failed')
+
+@pytest.fixture
+def failing_build(monkeypatch, tmp_path):
+    """GTFS のダウンロードが失敗する事業者1つだけの日次ビルド"""
+    operator = types.ModuleType('fake.prepare_gtfs_data')
+    operator.download_gtfs = failing_download
+    operator.BUILD_STAGES = operator.ALWAYS_BUILD_STAGES = ()
+    operator.reset = lambda: None
+    monkeypatch.setattr(daily_build, 'OPERATORS', (operator,))
+    monkeypatch.setattr(index_store, 'current_kind', lambda root: stop_index.STOP_GROUPS_KIND)
+    monkeypatch.setattr(poller_telemetry, 'METRICS_TEXTFILE_PATH', str(tmp_path / 'poller.prom'))
+    monkeypatch.setattr(poller_telemetry, 'STATUS_PATH', str(tmp_path / 'poller_status.json'))
+
+def run_daily(monkeypatch, job, now):
+    """now に日次タスクを起動し、終わってから次のサイクルで結果を反映する"""
+    monkeypatch.setattr(scheduler, 'now_jst', lambda: now)
+    runner = scheduler.Scheduler(max_workers=1)
+    runner.run_daily_job(job)
+    for future in job.futures:
+        future.exception()
+    runner.run_daily_job(job)
+
+def test_run_raises_when_a_stage_fails(failing_build):
+    with pytest.raises(daily_build.BuildError, match='fake.prepare_gtfs_data.download_gtfs'):
+        daily_build.run()
+
+def test_failed_build_is_retried(failing_build, monkeypatch, tmp_path):
+    state_path = str(tmp_path / 'last_daily_run')
+    job = scheduler.DailyJob([daily_build.run], 4, 30, timeout=60, state_path=state_path)
+    now = datetime.datetime(2026, 10, 19, 5, 0)
+    run_daily(monkeypatch, job, now)
+
+    assert job.last_run_date is None
+    assert job.retry_at is not None
+    assert not (tmp_path / 'last_daily_run').exists()
+    # 再試行の時刻までは起動しない
+    assert not job.is_due(now)
+
+def test_successful_build_is_marked_done(monkeypatch, tmp_path):
+    monkeypatch.setattr(poller_telemetry, 'METRICS_TEXTFILE_PATH', str(tmp_path / 'poller.prom'))
+    monkeypatch.setattr(poller_telemetry, 'STATUS_PATH', str(tmp_path / 'poller_status.json'))
+    state_path = str(tmp_path / 'last_daily_run')
+    job = scheduler.DailyJob([lambda: None], 4, 30, timeout=60, state_path=state_path)
+    now = datetime.datetime(2026, 10, 19, 5, 0)
+    run_daily(monkeypatch, job, now)
+
+    assert job.last_run_date == now.date()
+    assert job.retry_at is None
+    assert (tmp_path / 'last_daily_run').read_text() == '2026-10-19'
@@ -0,0 +1,80 @@
+import datetime
+
+from google.transit import gtfs_realtime_pb2
+
+from conftest import MONDAY
+from common import realtime_snapshot
+from common import timetable
+
+BASE = int(datetime.datetime.combine(MONDAY, datetime.time(), realtime_snapshot.JST).timestamp())
+
+def at(text):
+    """MONDAY の HH:MM → UNIX 時刻"""
+    return BASE + timetable.parse_time(text + ':00')
+
+def feed_message(timestamp):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '2.0'
+    feed.header.timestamp = timestamp
+    return feed
+
+def publish(tmp_path, table, feeds, now):
+    root = str(tmp_path / 'realtime')
+    realtime_snapshot.publish_snapshot(root, table, feeds, now)
+    return realtime_snapshot.load_snapshot(root)
+
+def test_empty_feed(tmp_path, table):
+    now = at('08:05')
+    snapshot = publish(tmp_path, table, [feed_message(now)], now)
+
+    assert snapshot.generated_at == now
+    assert len(snapshot.trip_ids) == 0
+    assert snapshot.departure('T1', 'B', now=now) is None
+    assert snapshot.approaching('B', now=now) == []
+
+def test_update_keyed_by_stop_id_only(tmp_path, table):
+    now = at('08:05')
+    feed = feed_message(now)
+    entity = feed.entity.add()
+    entity.id = 'T1'
+    entity.trip_update.trip.trip_id = 'T1'
+    update = entity.trip_update.stop_time_update.add()
+    update.stop_id = 'B'
+    update.departure.delay = 180
+    snapshot = publish(tmp_path, table, [feed], now)
+
+    # 始発は今より前には出ず、B の遅れはその後ろの C にも伸ばす
+    assert snapshot.departure('T1', 'A', now=now) == now
+    assert snapshot.departure('T1', 'B', now=now) == at('08:13')
+    assert snapshot.departure('T1', 'C', now=now) == at('08:23')
+    # 車両位置のない便は停留所に向かっている車両に入れない
+    assert snapshot.approaching('B', now=now) == []
+
+def test_vehicle_is_approaching(tmp_path, table):
+    now = at('08:05')
+    feed = feed_message(now)
+    entity = feed.entity.add()
+    entity.id = 'T1'
+    entity.vehicle.trip.trip_id = 'T1'
+    entity.vehicle.current_stop_sequence = 2
+    entity.vehicle.timestamp = now
+    snapshot = publish(tmp_path, table, [feed], now)
+
+    vehicles = snapshot.approaching('C', now=now)
+    assert [(vehicle['trip_id'], vehicle['stops_away'], vehicle['position']) for vehicle in vehicles] == [('T1', 1, 'B')]
+    assert vehicles[0]['departure'] == '08:20'
+
+def test_stale_snapshot_is_not_served(tmp_path, table):
+    now = at('08:05')
+    feed = feed_message(now)
+    entity = feed.entity.add()
+    entity.id = 'T1'
+    entity.vehicle.trip.trip_id = 'T1'
+    entity.vehicle.current_stop_sequence = 2
+    entity.vehicle.timestamp = now
+    snapshot = publish(tmp_path, table, [feed], now)
+
+    later = now + realtime_snapshot.STALE_SECONDS + 1
+    assert snapshot.is_stale(later)
+    assert snapshot.departure('T1', 'C', now=later) is None
+    assert snapshot.approaching('C', now=later) == []
@@ -0,0 +1,196 @@
+import json
+
+import pytest
+
+from common import stop_index
+
+# 停留所: (stop_id, 停留所名, 読み, 便数)
+STOPS = (
+    ('S01', '桜木町駅前', 'サクラギチョウエキマエ', 120),
+    ('S02', '桜木町駅前', 'サクラギチョウエキマエ', 40),
+    ('S03', '桜木町', 'サクラギチョウ', 30),
+    ('S04', '新桜木町', 'シンサクラギチョウ', 200),
+    ('S05', '桜木愛', 'サクラギアイ', 10),
+    ('S06', '桜木浅', 'サクラギアサ', 10),
+    ('S07', '横浜駅前', 'ヨコハマエキマエ', 300),
+    ('S08', '休止中', 'キュウシチュウ', 0),
+    ('S09', '阿木町', 'アギチョウ', 5),
+    ('S10', '鍵町', 'カギチョウ', 5),
+)
+
+def index_data():
+    stop_name_map = {}
+    stop_name_kana_map = {}
+    for stop_id, name, kana, _ in STOPS:
+        stop_name_map.setdefault(name, set()).add(stop_id)
+        stop_name_kana_map.setdefault(kana, set()).add(stop_id)
+    return (
+        stop_name_map,
+        stop_name_kana_map,
+        {stop_id: name for stop_id, name, _, _ in STOPS},
+        {stop_id: [{('R1', '桜木町駅')}, set(), set()] for stop_id, _, _, _ in STOPS},
+        {stop_id: services for stop_id, _, _, services in STOPS},
+        {stop_id: {'lat': '35.45', 'lon': '139.63'} for stop_id, _, _, _ in STOPS},
+    )
+
+@pytest.fixture
+def search_index(tmp_path):
+    root = str(tmp_path / 'search')
+    stop_index.publish_search_index(root, index_data())
+    return stop_index.load_search_index(root)
+
+def stop_ids(index, stops):
+    return [index.stop_ids[stop] for stop in stops]
+
+def test_fuzzy_keeps_best_overlapping_candidates(monkeypatch, search_index):
+    # 比べる候補を絞っても、番号の小さい弱い候補ではなくバイグラムを多く共有する形が残る
+    monkeypatch.setattr(stop_index, 'MAX_FUZZY_CANDIDATES', 2)
+
+    matched = search_index.fuzzy_match('さくらぎちよう')
+
+    assert stop_ids(search_index, matched) == ['S03']
+    assert matched[search_index.stop_ids.index('S03')] == 1
+
+# ==== 検索の並び順と件数 ====
+
+def test_ranked_orders_by_match_kind_then_services(search_index):
+    # 完全一致 → 前方一致（便の多い順）→ 部分一致
+    ranked = search_index.ranked('桜木町', 'サクラギチョウ', stop_index.DEFAULT_LIMIT)
+
+    assert stop_ids(search_index, ranked) == ['S03', 'S01', 'S02', 'S04']
+
+def test_scored_returns_kind_and_services(search_index):
+    scored = search_index.scored('桜木町', 'サクラギチョウ', 2)
+
+    assert [(kind, minus_services, search_index.stop_ids[stop]) for kind, minus_services, stop in scored] == [
+        (stop_index.MATCH_EXACT, -30, 'S03'),
+        (stop_index.MATCH_PREFIX, -120, 'S01'),
+    ]
+
+def test_kana_matches_ordered_by_services(search_index):
+    # 読みだけで一致したものは同じ種類なので便の多い順
+    ranked = search_index.ranked('さくらぎちょう', 'サクラギチョウ', stop_index.DEFAULT_LIMIT)
+
+    assert stop_ids(search_index, ranked) == ['S04', 'S01', 'S02', 'S03']
+
+def test_stops_without_services_are_excluded(search_index):
+    assert search_index.ranked('休止中', 'キュウシチュウ', stop_index.DEFAULT_LIMIT) == []
+
+def test_limit_keeps_top_results(search_index):
+    ranked = search_index.ranked('さくらぎちょう', 'サクラギチョウ', 2)
+
+    assert stop_ids(search_index, ranked) == ['S04', 'S01']
+
+@pytest.fixture
+def search_stop(monkeypatch, tmp_path):
+    from yokohamaMunicipal import search_stop
+    monkeypatch.setattr(search_stop, 'SEARCH_INDEX_DIR', str(tmp_path / 'search'))
+    monkeypatch.setattr(search_stop, 'SUGGEST_INDEX_DIR', str(tmp_path / 'suggest'))
+    stop_index.publish_search_index(search_stop.SEARCH_INDEX_DIR, index_data())
+    stop_index.publish_suggest_index(search_stop.SUGGEST_INDEX_DIR, index_data())
+    return search_stop
+
+def test_search_limit_is_clamped(monkeypatch, search_stop):
+    monkeypatch.setattr(stop_index, 'MAX_LIMIT', 3)
+
+    assert [result['stop_id'] for result in search_stop.search_stop('さくらぎちょう', limit=0)] == ['S04']
+    assert [result['stop_id'] for result in search_stop.search_stop('さくらぎちょう', limit=-5)] == ['S04']
+    assert len(search_stop.search_stop('さくらぎちょう', limit=10 ** 9)) == 3
+
+def test_search_normalizes_query(search_stop):
+    # 全角カナも NFKC で読みにそろう
+    assert [result['stop_id'] for result in search_stop.search_stop('ｻｸﾗｷﾞﾁｮｳｴｷﾏｴ')] == ['S01', 'S02']
+
+# ==== 入力補完 ====
+
+@pytest.fixture
+def suggest_index(tmp_path):
+    root = str(tmp_path / 'suggest')
+    stop_index.publish_suggest_index(root, index_data())
+    return stop_index.load_suggest_index(root)
+
+SAKURAGI_NAMES = ['桜木町駅前', '桜木町', '桜木愛', '桜木浅']
+
+def test_suggest_orders_names_by_services(suggest_index):
+    # のりば違いの「桜木町駅前」は便数を合わせて 160 便、同じ便数なら名前順
+    assert suggest_index.suggest('さくらぎ') == SAKURAGI_NAMES
+
+def test_suggest_hot_prefix_matches_prefix_range(suggest_index):
+    # 短い入力はあらかじめ求めた上位から、長い入力はキーの前方一致の範囲から引く
+    for prefix in ('さ', 'さく', 'さくら', 'さくらぎち'):
+        start, end = suggest_index.keys.prefix_range(prefix)
+        expected = set()
+        for key in range(start, end):
+            expected.update(suggest_index.key_names[key].tolist())
+        assert suggest_index.suggest(prefix, stop_index.MAX_SUGGEST_LIMIT) == [suggest_index.names[number] for number in sorted(expected)]
+
+def test_suggest_matches_name_reading_and_romaji(suggest_index):
+    assert suggest_index.suggest('桜木') == SAKURAGI_NAMES
+    assert suggest_index.suggest('sakuragi') == SAKURAGI_NAMES
+    assert suggest_index.suggest(stop_index.suggest_key('サクラギ')) == SAKURAGI_NAMES
+    assert suggest_index.suggest('きゅうし') == []
+    assert suggest_index.suggest('') == []
+
+def test_suggest_limit(suggest_index):
+    assert suggest_index.suggest('さく', 2) == SAKURAGI_NAMES[:2]
+    assert suggest_index.suggest('さくらぎ', 2) == SAKURAGI_NAMES[:2]
+
+def test_suggest_limit_is_clamped(monkeypatch, search_stop):
+    monkeypatch.setattr(stop_index, 'MAX_SUGGEST_LIMIT', 3)
+
+    assert json.loads(search_stop.suggest('さくらぎ', limit=0)) == [{'stop_name': '桜木町駅前'}]
+    assert json.loads(search_stop.suggest('さくらぎ', limit=100)) == [{'stop_name': name} for name in SAKURAGI_NAMES[:3]]
+
+# ==== 運行日ごとの系統・行先 ====
+
+CALENDAR = (
+    {'service_id': 'WD', 'monday': '1', 'tuesday': '1', 'wednesday': '1', 'thursday': '1', 'friday': '1', 'saturday': '0', 'sunday': '0'},
+    {'service_id': 'SA', 'monday': '0', 'tuesday': '0', 'wednesday': '0', 'thursday': '0', 'friday': '0', 'saturday': '1', 'sunday': '0'},
+    {'service_id': 'SH', 'monday': '0', 'tuesday': '0', 'wednesday': '0', 'thursday': '0', 'friday': '0', 'saturday': '1', 'sunday': '1'},
+)
+
+def test_service_day_types():
+    assert stop_index.service_day_types(CALENDAR) == {
+        'WD': {stop_index.WEEKDAY},
+        'SA': {stop_index.SATURDAY},
+        'SH': {stop_index.SATURDAY, stop_index.HOLIDAY},
+    }
+
+def test_summarize_routes_by_day_type():
+    trip_id_to_info = {
+        'T1': ('R1', '桜木町駅', 'WD'),
+        'T2': ('R2', '横浜駅', 'SH'),
+        'T3': ('R3', '港南台駅', 'EXTRA'),
+    }
+    route_headsigns, services = stop_index.summarize_routes(
+        {'S01': ['T1', 'T2'], 'S02': ['T3']},
+        trip_id_to_info,
+        {'R1': '8系統', 'R2': '26系統'},
+        stop_index.service_day_types(CALENDAR),
+    )
+
+    assert route_headsigns['S01'] == [{('8系統', '桜木町駅')}, {('26系統', '横浜駅')}, {('26系統', '横浜駅')}]
+    # calendar.txt にない service はどの日にも出し、系統名がなければ route_id のまま
+    assert route_headsigns['S02'] == [{('R3', '港南台駅')}] * 3
+    assert services == {'S01': 2, 'S02': 1}
+
+def test_route_headsigns_by_day(tmp_path):
+    data = index_data()
+    data[3]['S01'] = [{('8系統', '桜木町駅')}, {('26系統', '横浜駅')}, set()]
+    data[3]['S02'] = [set(), set(), set()]
+    root = str(tmp_path / 'search')
+    stop_index.publish_search_index(root, data)
+    index = stop_index.load_search_index(root)
+    s01 = index.stop_ids.index('S01')
+    s02 = index.stop_ids.index('S02')
+
+    assert index.route_headsigns(s01, stop_index.WEEKDAY) == [('8系統', '桜木町駅')]
+    assert index.route_headsigns(s01, stop_index.HOLIDAY) == []
+    # 省略するとすべての運行日をまとめたもの
+    assert index.route_headsigns(s01) == [('26系統', '横浜駅'), ('8系統', '桜木町駅')]
+    assert index.route_headsigns_by_day(s01) == {
+        'weekday': [('8系統', '桜木町駅')],
+        'saturday': [('26系統', '横浜駅')],
+        'holiday': [],
+    }
+    assert index.route_headsigns_by_day(s02) == {'weekday': [], 'saturday': [], 'holiday': []}
@@ -0,0 +1,60 @@
+import datetime
+
+from conftest import MONDAY
+from common import timetable
+
+def seconds(text):
+    return timetable.parse_time(text + ':00')
+
+def test_plan_transfers_at_shared_stop(table):
+    journeys = table.plan('A', 'D', MONDAY, seconds('07:50'))
+
+    assert len(journeys) == 1
+    journey = journeys[0]
+    assert journey['transfers'] == 1
+    assert journey['arrival_time'] == '08:30'
+    assert [(leg['trip_id'], leg['from_stop_id'], leg['to_stop_id']) for leg in journey['legs']] == [
+        ('T1', 'A', 'B'),
+        ('T2', 'B', 'D'),
+    ]
+
+def test_plan_does_not_alight_where_drop_off_is_forbidden(table):
+    # T3 は D に 08:20 に着くが降りられない
+    journeys = table.plan('A', 'D', MONDAY, seconds('07:50'))
+
+    assert all(leg.get('trip_id') != 'T3' for journey in journeys for leg in journey['legs'])
+
+def test_plan_does_not_board_where_pickup_is_forbidden(table):
+    assert table.plan('E', 'D', MONDAY, seconds('07:50')) == []
+
+def test_plan_after_midnight_uses_previous_service_day(table):
+    # 火曜 00:20 は月曜のダイヤの 24:20
+    journeys = table.plan('C', 'E', MONDAY + datetime.timedelta(days=1), seconds('00:20'))
+
+    assert len(journeys) == 1
+    assert journeys[0]['departure_time'] == '24:30'
+    assert journeys[0]['arrival_time'] == '24:50'
+
+def test_plan_after_midnight_on_weekend_finds_nothing(table):
+    # 日曜 00:20 は土曜のダイヤ（WEEKDAY は走らない）
+    assert table.plan('C', 'E', MONDAY - datetime.timedelta(days=1), seconds('00:20')) == []
+
+def test_reachable_agrees_with_plan(table):
+    for origin, day, start in (
+        ('A', MONDAY, seconds('07:55')),
+        ('B', MONDAY, seconds('08:05')),
+        ('C', MONDAY + datetime.timedelta(days=1), seconds('00:20')),
+    ):
+        reached = table.reachable(origin, day, start, minutes=60)
+        assert reached[0]['stop_id'] == origin
+
+        for stop in reached[1:]:
+            journeys = table.plan(origin, stop['stop_id'], day, start)
+            assert journeys, stop
+            assert min(journey['arrival_time'] for journey in journeys) == stop['arrival_time']
+
+        # 到達圏に入らなかった停留所には、plan でも時間内に着けない
+        unreached = set('ABCDE') - {stop['stop_id'] for stop in reached}
+        for stop_id in unreached:
+            for journey in table.plan(origin, stop_id, day, start):
+                assert journey['minutes'] > 60
@@ -0,0 +1,71 @@
+import pytest
+
+from common import vehicle_history
+
+# 2台の車両の点（時刻, 緯度, 経度）
+POINTS = {
+    'V1': [(1000, 35.40, 139.60), (1060, 35.46, 139.66)],
+    'V2': [(1030, 35.50, 139.70)],
+}
+
+@pytest.fixture
+def history_dir(tmp_path):
+    root = str(tmp_path / 'history')
+    history = vehicle_history.VehicleHistory()
+    for vehicle_id, points in POINTS.items():
+        for timestamp, lat, lon in points:
+            history.append(vehicle_id, timestamp, lat, lon, route='R1')
+    history.publish(root)
+    return root
+
+@pytest.fixture
+def trails(history_dir):
+    return vehicle_history.load_history(history_dir)
+
+def test_positions_at_interpolates(trails):
+    positions = {position['vehicle']: position for position in trails.positions_at(1030)}
+
+    assert sorted(positions) == ['V1', 'V2']
+    assert positions['V1']['geo'] == pytest.approx([139.63, 35.43])
+    assert positions['V2']['geo'] == pytest.approx([139.70, 35.50])
+
+def test_positions_at_before_first_point(trails):
+    assert trails.positions_at(0) == []
+    assert [position['vehicle'] for position in trails.positions_at(1010)] == ['V1']
+
+@pytest.mark.parametrize('timestamp', [
+    1060 + vehicle_history.MAX_INTERPOLATION_GAP + 1,
+    # (車両 << 32) + timestamp が次の車両のキーの範囲に入る
+    (1 << 32) + 1030,
+    # int64 に収まらない
+    10 ** 20,
+])
+def test_positions_at_out_of_range(trails, timestamp):
+    assert trails.positions_at(timestamp) == []
+
+@pytest.fixture
+def client(monkeypatch, history_dir):
+    from fastapi.testclient import TestClient
+
+    import app
+    import map.yokohamaMunicipal.get_data as get_data
+    monkeypatch.setattr(get_data, 'HISTORY_DIR', history_dir)
+    return TestClient(app.app)
+
+def test_get_positions(client):
+    response = client.get('/map/yokohamaMunicipal/get_positions', params={'at': '1030'})
+
+    assert response.status_code == 200
+    assert [position['vehicle'] for position in response.json()] == ['V1', 'V2']
+
+@pytest.mark.parametrize('at', ['yesterday', '2026-13-01T00:00:00'])
+def test_get_positions_invalid_at(client, at):
+    response = client.get('/map/yokohamaMunicipal/get_positions', params={'at': at})
+
+    assert response.status_code == 400
+
+def test_get_positions_at_far_future(client):
+    response = client.get('/map/yokohamaMunicipal/get_positions', params={'at': str(10 ** 20)})
+
+    assert response.status_code == 200
+    assert response.json() == []
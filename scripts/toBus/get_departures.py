@@ -1,6 +1,7 @@
 import csv
 import datetime
-import boto3
+from common import congestion_client
+from common import metrics
 import json
 import os
 
@@ -12,17 +13,16 @@ CALENDAR_PATH = "calendar.txt"
 CALENDAR_DATES_PATH = "calendar_dates.txt"
 TRIPS_PATH = "trips.txt"
 
-# DynamoDB 初期化
-REGION = 'ap-northeast-1'
-dynamodb = boto3.resource('dynamodb', region_name=REGION)
-table = dynamodb.Table('BusCongestion')
+# DynamoDB のクライアントは使うときに作る（import を軽くするため）
+def get_table():
+    return congestion_client.get_resource().Table(congestion_client.TABLE_NAME)
 
 def download_csv(file_name):
     with open(S3_PREFIX_DATA + file_name, newline='', encoding='utf-8') as f:
         return list(csv.DictReader(f))
 
 def get_average_congestion(trip_id, stop_sequence):
-    response = table.get_item(
+    response = get_table().get_item(
         Key={
             'trip_id': trip_id,
             'stop_sequence': stop_sequence
@@ -130,23 +130,12 @@ def get_departures_at_stop(target_stop_id, year, month, date):
     return results
 
 def batch_get_congestion(trip_stop_pairs):
-    keys = [{'trip_id': tid, 'stop_sequence': seq} for tid, seq in trip_stop_pairs]
     result_map = {}
-    # DynamoDBのBatchGetItemは最大100件
-    for i in range(0, len(keys), 100):
-        batch_keys = keys[i:i+100]
-        response = dynamodb.batch_get_item(
-            RequestItems={
-                'BusCongestion': {
-                    'Keys': batch_keys
-                }
-            }
-        )
-        for item in response['Responses'].get('BusCongestion', []):
-            key = (item['trip_id'], item['stop_sequence'])
-            if item['count'] > 0:
-                avg = item['congestion_sum'] / item['count']
-                result_map[key] = round(avg, 2)
+    # キャッシュ・並列バッチ・UnprocessedKeys の再試行は congestion_client 側で行う
+    for key, (congestion_sum, count) in congestion_client.batch_get(trip_stop_pairs).items():
+        if count > 0:
+            avg = congestion_sum / count
+            result_map[key] = round(avg, 2)
     return result_map
 
 
@@ -160,7 +149,8 @@ def get(target_stop_id):
     month = now.month
     date = now.day
 
-    departures = get_departures_at_stop(target_stop_id, year, month, date)
+    with metrics.stage('timetable_scan'):
+        departures = get_departures_at_stop(target_stop_id, year, month, date)
 
     result = []
 
@@ -181,4 +171,5 @@ def get(target_stop_id):
             'congestion': float(congestion)
         })
 
-    return json.dumps(result, ensure_ascii=False)
+    with metrics.stage('serialization'):
+        return json.dumps(result, ensure_ascii=False)
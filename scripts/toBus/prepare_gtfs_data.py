@@ -11,21 +11,28 @@ import shutil
 import os
 import sys
 import unicodedata
-import jaconv
+import jaconv
+
+from common import gtfs_archive
+from common import stop_index
+from common import timetable
 
 ACCESS_TOKEN = os.environ.get('ODPT_ACCESS_TOKEN', '')
 path = os.path.dirname(__file__)
 
 # GTFS static ファイルパス
 S3_PREFIX_DATA = path + '/gtfs_data/'
+GTFS_DATA_DIR = path + '/gtfs_data'
 S3_INDEX_PATH = path + '/cache/stop_index.pkl'
-LOCAL_INDEX_PATH = path + '/cache/index.pkl'
+SEARCH_INDEX_DIR = path + '/cache/search_index'
+SUGGEST_INDEX_DIR = path + '/cache/suggest_index'
 CALENDAR_PATH = path + '/gtfs_data/calendar.txt'
 STOP_TIMES_PATH = path + '/gtfs_data/stop_times.txt'
 LAST_RECORDED_PATH = path + '/cache/last_recorded.pkl'
-TRIP_END_TIMES_PATH = path + '/cache/trip_end_times.pkl'
+TRIP_INFO_DIR = path + '/cache/trip_info'
 
-STOP_SEQUENCE_PATH = path + '/cache/stop_sequence.pkl'
+STOP_SEQUENCE_DIR = path + '/cache/stop_sequence'
+TIMETABLE_DIR = path + '/cache/timetable'
 
 # S3 Pickle ユーティリティ
 def load_pickle(path):
@@ -35,8 +42,11 @@ def load_pickle(path):
 def save_pickle(data, path):
     body = pickle.dumps(data)
 
-    with open(path, 'wb') as f:
+    # 読み込み中のAPIに書きかけのファイルを見せないよう、一時ファイルから置き換える
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
         f.write(body)
+    os.replace(tmp_path, path)
 
 def build_trip_end_times(path=STOP_TIMES_PATH):
     trip_end_times = {}
@@ -64,27 +74,57 @@ def normalize(text):
     text = text.replace('ヶ', 'ケ').replace('ケ', 'ヶ')  # どちらも考慮
     return text.lower()
 
-def download_csv(file_name):
+def iter_csv(file_name, archive=None):
+    # archive を渡すと展開済みのファイルではなく zip から直接読む
+    if archive is not None:
+        yield from gtfs_archive.iter_csv(archive, file_name)
+        return
+
     with open(S3_PREFIX_DATA + file_name, newline='', encoding='utf-8') as f:
-        return list(csv.DictReader(f))
+        yield from csv.DictReader(f)
+
+def download_csv(file_name, archive=None):
+    return list(iter_csv(file_name, archive))
     
-# 辞書を構築しS3へ保存
-def build_and_upload_index():
-    stops = download_csv('stops.txt')
-    stop_times = download_csv('stop_times.txt')
-    trips = download_csv('trips.txt')
-    routes = download_csv('routes.txt')
-    translations = download_csv('translations.txt')
+def load_trip_stop_sequences(archive=None):
+    """stop_times.txt を trip_id → [(stop_sequence, stop_id), ...]（順番どおり）にまとめる"""
+    trip_stop_sequences = {}
+    # 一番大きいので1行ずつ
+    for row in iter_csv('stop_times.txt', archive):
+        trip_id = row['trip_id']
+        stop_id = row['stop_id']
+        seq = int(row.get('stop_sequence', 0))
+        trip_stop_sequences.setdefault(trip_id, []).append((seq, stop_id))
+
+    for stops_seq in trip_stop_sequences.values():
+        stops_seq.sort()
+    return trip_stop_sequences
+
+def build_route_names(routes):
+    """route_id → 表示する系統名"""
+    route_id_to_name = {}
+    for route in routes:
+        route_id = route['route_id']
+        if route.get('route_short_name', ''):
+            route_id_to_name[route_id] = route.get('route_short_name', '').lstrip('0')
+    return route_id_to_name
+
+# 検索用の辞書を構築して保存
+def build_search_index(archive=None):
+    stops = download_csv('stops.txt', archive)
+    trips = download_csv('trips.txt', archive)
+    routes = download_csv('routes.txt', archive)
+    translations = download_csv('translations.txt', archive)
+    calendar = download_csv('calendar.txt', archive)
 
     stop_name_map = {}  # normalized name → set of stop_ids
     stop_name_kana_map = {}  # normalized name → set of stop_ids
     stop_id_to_name = {}
     stop_id_to_trips = {}  # stop_id → set of trip_id
-    trip_id_to_info = {}   # trip_id → (route_id, stop_headsign)
-    route_id_to_name = {}  # route_id → route_long_name
+    trip_id_to_info = {}   # trip_id → (route_id, stop_headsign, service_id)
     trip_id_to_last_stop = {}  # ★ trip_id → last stop_id
 
-    route_id_and_stop_sequence_to_stop_name = {}
+    stop_id_to_location = {}
 
     # --- stops.txt 読み込み ---
     for stop in stops:
@@ -94,6 +134,11 @@ def build_and_upload_index():
         stop_name_map.setdefault(norm, set()).add(stop_id)
         stop_id_to_name[stop_id] = name
 
+        stop_id_to_location[stop_id] = {
+            'lat': stop['stop_lat'],
+            'lon': stop['stop_lon']
+        }
+
         # かな
         for translation in translations:
             if translation['language'] == 'ja-Hrkt' and translation['field_value'] == name:
@@ -101,24 +146,12 @@ def build_and_upload_index():
                 stop_name_kana_map.setdefault(norm, set()).add(stop_id)
 
     # --- stop_times.txt を trip_id → stop_sequence でマッピング ---
-    trip_stop_sequences = {}
-    for row in stop_times:
-        trip_id = row['trip_id']
-        stop_id = row['stop_id']
-        seq = int(row.get('stop_sequence', 0))
-        trip_stop_sequences.setdefault(trip_id, []).append((seq, stop_id))
+    trip_stop_sequences = load_trip_stop_sequences(archive)
 
-    for trip_id, stops_seq in trip_stop_sequences.items():
-        sorted_stops = sorted(stops_seq)
+    for trip_id, sorted_stops in trip_stop_sequences.items():
         last_stop_id = sorted_stops[-1][1]  # ★ 最終 stop_id
         trip_id_to_last_stop[trip_id] = last_stop_id
 
-        route_id_and_stop_sequence_to_stop_name[trip_id] = {}
-
-        for stop in sorted_stops:
-            route_id_and_stop_sequence_to_stop_name[trip_id][stop[0]] = stop_id_to_name[stop[1]]
-            
-
         for _, stop_id in sorted_stops:
             # stop_id → trip_id の関連付け（終着かどうかは後でフィルタ）
             stop_id_to_trips.setdefault(stop_id, set()).add(trip_id)
@@ -126,13 +159,10 @@ def build_and_upload_index():
     # --- trips.txt ---
     for trip in trips:
         trip_id = trip['trip_id']
-        trip_id_to_info[trip_id] = (trip['route_id'], trip.get('trip_headsign', ''))
+        trip_id_to_info[trip_id] = (trip['route_id'], trip.get('trip_headsign', ''), trip['service_id'])
 
     # --- routes.txt ---
-    for route in routes:
-        route_id = route['route_id']
-        if route.get('route_short_name', ''):
-            route_id_to_name[route_id] = route.get('route_short_name', '').lstrip('0')
+    route_id_to_name = build_route_names(routes)  # route_id → 系統名
 
     # ★ stop_id_to_trips をフィルタ（終着は除外）
     for stop_id in list(stop_id_to_trips.keys()):
@@ -142,49 +172,108 @@ def build_and_upload_index():
         }
         stop_id_to_trips[stop_id] = filtered_trips
 
+    # 停留所ごとの (系統, 行先) を平日・土曜・休日別にまとめておき、便の集合はインデックスに入れない
+    stop_id_to_route_headsigns, stop_id_to_services = stop_index.summarize_routes(
+        stop_id_to_trips, trip_id_to_info, route_id_to_name, stop_index.service_day_types(calendar)
+    )
+
     index_data = (
         stop_name_map,
         stop_name_kana_map,
         stop_id_to_name,
-        stop_id_to_trips,
-        trip_id_to_info,
-        route_id_to_name
+        stop_id_to_route_headsigns,
+        stop_id_to_services,
+        stop_id_to_location
     )
 
-    with open(LOCAL_INDEX_PATH, 'wb') as f:
-        pickle.dump(index_data, f)
+    stop_index.publish_search_index(SEARCH_INDEX_DIR, index_data)
+    stop_index.publish_suggest_index(SUGGEST_INDEX_DIR, index_data)
+
+    return index_data
 
-    with open(STOP_SEQUENCE_PATH, 'wb') as f:
-        pickle.dump(route_id_and_stop_sequence_to_stop_name, f)
+# trip_id → stop_sequence → 停留所名（リアルタイム情報の現在位置表示用）
+def build_stop_sequence(archive=None):
+    stop_id_to_name = {stop['stop_id']: stop['stop_name'] for stop in iter_csv('stops.txt', archive)}
 
+    route_id_and_stop_sequence_to_stop_name = {}
+    for trip_id, sorted_stops in load_trip_stop_sequences(archive).items():
+        route_id_and_stop_sequence_to_stop_name[trip_id] = {
+            seq: stop_id_to_name[stop_id] for seq, stop_id in sorted_stops
+        }
+
+    stop_index.publish_stop_sequence(STOP_SEQUENCE_DIR, route_id_and_stop_sequence_to_stop_name)
+
+# 経路検索用の時刻表
+def build_timetable(archive=None):
+    try:
+        calendar_dates = download_csv('calendar_dates.txt', archive)
+    except (FileNotFoundError, KeyError):
+        calendar_dates = []  # calendar_dates.txt が存在しない場合もOK
+
+    timetable.publish_timetable(
+        TIMETABLE_DIR,
+        download_csv('stops.txt', archive),
+        download_csv('trips.txt', archive),
+        iter_csv('stop_times.txt', archive),
+        download_csv('calendar.txt', archive),
+        calendar_dates,
+        build_route_names(download_csv('routes.txt', archive)),
+    )
+
+def build_and_upload_index(archive=None):
+    index_data = build_search_index(archive)
+    build_stop_sequence(archive)
+    build_timetable(archive)
     return index_data
 
+def write_trip_end_times():
+    stop_index.publish_trip_info(TRIP_INFO_DIR, build_trip_end_times(STOP_TIMES_PATH))
+
+# 日次ビルドの各段階（それぞれ独立していて、結果はファイルに書く）
+BUILD_STAGES = (build_search_index, build_stop_sequence, build_timetable)
+ALWAYS_BUILD_STAGES = (write_trip_end_times,)
+
 ## ==== 1日のデータ初期化 ====
 def reset():
     last_recorded = set()
     save_pickle(last_recorded, LAST_RECORDED_PATH)
 
-def init():
+def download_gtfs(build=True):
+    """新しいGTFSデータがあれば展開して差し替え、True を返す（build=False ならインデックスは作らない）"""
     now = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
     date_str = now.strftime('%Y%m%d')
 
     endpoint = 'https://api-public.odpt.org/api/v4/files/Toei/data/ToeiBus-GTFS.zip'
 
-    data = requests.get(endpoint)
+    # メモリに載せずに一時ファイルへ保存（新しいGTFSデータがなければ None）
+    archive_path = gtfs_archive.download(endpoint, path)
 
-    # 新しいGTFSデータがある
-    if data.status_code == 200:
-        zipped_gtfs_data = data.content
-        bytes_io = io.BytesIO(zipped_gtfs_data)
-        zip = zipfile.ZipFile(bytes_io)
-        zip.extractall(path + '/gtfs_data')
+    # 新しいGTFSデータがない
+    if archive_path is None:
+        return False
 
-        build_and_upload_index()
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            # 使うファイルだけ別ディレクトリへ展開し、インデックスは zip から直接作る
+            staging_dir = gtfs_archive.extract(archive, GTFS_DATA_DIR)
+            try:
+                if build:
+                    build_and_upload_index(archive)
+            except BaseException:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+
+        # 展開先を差し替え
+        gtfs_archive.publish(staging_dir, GTFS_DATA_DIR)
+    finally:
+        os.remove(archive_path)
+
+    return True
+
+def init():
+    download_gtfs()
 
-    trip_end_times = build_trip_end_times(STOP_TIMES_PATH)
-    with open(TRIP_END_TIMES_PATH, 'wb') as f:
-        pickle.dump(trip_end_times, f)
-        
+    write_trip_end_times()
 
     # 重複記録の防止用セット
     reset()
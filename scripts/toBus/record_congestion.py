@@ -4,24 +4,34 @@ import pickle
 from datetime import datetime, timedelta
 import boto3
 from google.transit import gtfs_realtime_pb2
+from common import feed_fetcher
+from common import index_format
+from common import congestion_client
+from common import poller_telemetry
+from common import realtime_snapshot
+from common import timetable
 import time
 import io
 import os
 
 path = os.path.dirname(__file__)
 
-TRIP_END_TIMES_KEY = path + "/cache/trip_end_times.pkl"
+TRIP_INFO_DIR = path + "/cache/trip_info"
 GTFS_RT_DATA_KEY = path + '/cache/gtfs_rt'
+TIMETABLE_DIR = path + '/cache/timetable'
+REALTIME_DIR = path + '/cache/realtime'
 
 # GTFS static ファイルパス
 CALENDAR_KEY = path + "/gtfs_data/calendar.txt"
 STOP_TIMES_KEY = path + "/gtfs_data/stop_times.txt"
 
 
-API_ENDPOINT = 'https://api-public.odpt.org/api/v4/gtfs/realtime/ToeiBus'
+ODPT_API_BASE = os.environ.get('ODPT_API_BASE', 'https://api-public.odpt.org')
+
+API_ENDPOINT = ODPT_API_BASE + '/api/v4/gtfs/realtime/ToeiBus'
 
 # DynamoDB 初期化
-dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1')  # 東京リージョン
+dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1', config=congestion_client.client_config())  # 東京リージョン
 table = dynamodb.Table('BusCongestion')
 
 # S3 Pickle ユーティリティ
@@ -36,9 +46,44 @@ def save_pickle(data, path):
         f.write(body)
 
 def save_data_to_s3(data, key):
-    with open(key, 'wb') as f:
-        f.write(data)
+    # APIが読み込み中のファイルを書き換えないよう、一時ファイルに書いてから置き換える
+    tmp_key = key + '.tmp'
+    with poller_telemetry.phase('write'):
+        with open(tmp_key, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_key, key)
+
+def load_feed(key):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    try:
+        with open(key, 'rb') as f:
+            feed.ParseFromString(f.read())
+    except FileNotFoundError:
+        pass
+    return feed
+
+def publish_realtime():
+    """保存済みのフィードから、走っている便の残りの停留所の予測時刻を書き出す（API はこれを引くだけ）"""
+    try:
+        table = timetable.load_timetable(TIMETABLE_DIR, f'{__name__}.timetable')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        # 時刻表は日次ビルドで作るので、ポーラーでは作り直さない
+        print("⚠️ 時刻表がないため予測時刻を更新しない:", e)
+        return
+    with poller_telemetry.phase('write'):
+        realtime_snapshot.publish_snapshot(REALTIME_DIR, table, [load_feed(key) for key in (GTFS_RT_DATA_KEY,)])
+
+def process_vehicle_feed(content, version):
+    save_data_to_s3(content, GTFS_RT_DATA_KEY)
+    publish_realtime()
+    feed_fetcher.mark_processed(GTFS_RT_DATA_KEY, version)
 
 def main():
-    response = requests.get(API_ENDPOINT)
-    save_data_to_s3(response.content, GTFS_RT_DATA_KEY)
+    new_feed = feed_fetcher.fetch_new_feed(API_ENDPOINT, GTFS_RT_DATA_KEY)
+    if new_feed is not None:
+        process_vehicle_feed(*new_feed)
+
+async def main_async():
+    new_feed = await feed_fetcher.fetch_new_feed_async(API_ENDPOINT, GTFS_RT_DATA_KEY)
+    if new_feed is not None:
+        await feed_fetcher.run_in_worker(process_vehicle_feed, *new_feed)
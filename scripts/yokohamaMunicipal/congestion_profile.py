@@ -0,0 +1,342 @@
+import csv
+import datetime
+import json
+import math
+import os
+
+import yokohamaMunicipal.get_departures as get_departures
+from common import metrics
+
+path = os.path.dirname(__file__)
+
+# 路線 × 停留所 × 曜日種別 × 15分枠 の混雑プロファイル
+# trip_id はGTFS更新で変わるので (route_id, stop_id) 単位で集計する
+# numpy は集計・予測の関数の中で import する（app の起動時には読み込まない）
+# 観測値（cache/observations）は record_congestion が BusCongestion に書くときに残すもので、それを書いているのは横浜市営バスだけ
+# 臨港バス・都営バスのポーラーはフィードを保存するだけで混雑を記録していないので、集計するものがなくこのモジュールもない
+
+S3_PREFIX_DATA = path + '/gtfs_data/'
+OBSERVATIONS_DIR = path + '/cache/observations/'
+HISTOGRAM_PATH = path + '/cache/congestion_histogram.npz'
+PROFILE_PATH = path + '/cache/congestion_profile.npz'
+
+WEEKDAY = 0
+SATURDAY = 1
+HOLIDAY = 2
+DAY_TYPES = 3
+
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday')
+
+BUCKET_MINUTES = 15
+BUCKETS = 24 * 60 // BUCKET_MINUTES
+
+# occupancy_status 0〜6
+LEVELS = 7
+
+# この件数未満の枠は前後の枠・上位の集計で補完
+MIN_SAMPLES = 3
+SMOOTHING_BUCKETS = 2  # 前後30分
+
+# uint16 の上限に近づいたら全体を半分にする（古い観測ほど薄まる）
+HISTOGRAM_CAP = 60000
+
+# 深夜の観測は前日の運行日として扱う
+SERVICE_DAY_START_HOUR = 4
+
+_profile = None
+_profile_mtime = None
+
+def iter_csv(file_name):
+    with open(S3_PREFIX_DATA + file_name, newline='', encoding='utf-8') as f:
+        yield from csv.DictReader(f)
+
+def get_day_type(date):
+    """日付の曜日から平日/土曜/休日を判定
+
+    毎日走る service もあるので、有効な service の曜日では決めない。
+    平日・土曜でも calendar_dates.txt で平日に走らない日曜の service が足される日（祝日・年末年始）は休日、
+    平日に土曜だけの service が足される日は土曜とする
+    """
+    day_type = {5: SATURDAY, 6: HOLIDAY}.get(date.weekday(), WEEKDAY)
+    if day_type == HOLIDAY:
+        return day_type
+
+    date_str = date.strftime('%Y%m%d')
+    try:
+        added = {
+            row['service_id'] for row in iter_csv(get_departures.CALENDAR_DATES_PATH)
+            if row['date'] == date_str and row['exception_type'] == '1'
+        }
+    except FileNotFoundError:
+        return day_type  # calendar_dates.txt が存在しない場合もOK
+    if not added:
+        return day_type
+
+    for row in iter_csv(get_departures.CALENDAR_PATH):
+        if row['service_id'] not in added or any(row.get(weekday) == '1' for weekday in WEEKDAY_COLUMNS):
+            continue
+        if row.get('sunday') == '1':
+            return HOLIDAY
+        if row.get('saturday') == '1':
+            day_type = SATURDAY
+    return day_type
+
+def time_to_bucket(time_str):
+    """GTFSの HH:MM(:SS) を15分枠へ（24時以降は翌日の時刻として扱う）"""
+    h, m = time_str.split(':')[:2]
+    return ((int(h) % 24) * 60 + int(m)) // BUCKET_MINUTES
+
+# ==== 夜間集計 ====
+def load_observations():
+    files = sorted(f for f in os.listdir(OBSERVATIONS_DIR) if f.endswith('.csv')) if os.path.isdir(OBSERVATIONS_DIR) else []
+    observations = []
+    for file_name in files:
+        with open(OBSERVATIONS_DIR + file_name, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                try:
+                    observations.append((int(row[0]), row[1], int(row[2]), int(row[3])))
+                except (ValueError, IndexError):
+                    continue  # 書き込み途中の行などはスキップ
+    return files, observations
+
+def build_trip_mapping(trip_ids):
+    """観測された trip_id についてだけ route_id と stop_sequence → stop_id を引く"""
+    trip_to_route = {}
+    for row in iter_csv(get_departures.TRIPS_PATH):
+        if row['trip_id'] in trip_ids:
+            trip_to_route[row['trip_id']] = row['route_id']
+
+    trip_stop_ids = {}
+    for row in iter_csv(get_departures.STOP_TIMES_PATH):
+        trip_id = row['trip_id']
+        if trip_id in trip_ids:
+            trip_stop_ids[(trip_id, int(row['stop_sequence']))] = row['stop_id']
+
+    return trip_to_route, trip_stop_ids
+
+def load_histogram():
+    import numpy as np
+    try:
+        with np.load(HISTOGRAM_PATH) as data:
+            routes = list(data['pair_route'])
+            stops = list(data['pair_stop'])
+            return dict(zip(zip(routes, stops), range(len(routes)))), data['hist']
+    except FileNotFoundError:
+        return {}, np.zeros((0, DAY_TYPES, BUCKETS, LEVELS), dtype=np.uint16)
+
+def save_npz(data_path, **arrays):
+    import numpy as np
+    tmp_path = data_path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, data_path)
+
+def smooth(counts):
+    """時間軸方向に前後 SMOOTHING_BUCKETS 枠を足し合わせる（日をまたいで循環させない）"""
+    import numpy as np
+    padded = np.pad(counts, [(0, 0)] * (counts.ndim - 1) + [(SMOOTHING_BUCKETS, SMOOTHING_BUCKETS)])
+    cumulative = np.cumsum(padded, axis=-1, dtype=np.float64)
+    cumulative = np.concatenate([np.zeros(cumulative.shape[:-1] + (1,)), cumulative], axis=-1)
+    width = 2 * SMOOTHING_BUCKETS + 1
+    return cumulative[..., width:] - cumulative[..., :-width]
+
+def fill_mean(sums, counts, *fallbacks):
+    """件数が足りない枠は 前後の枠 → fallbacks の順で補完した平均"""
+    import numpy as np
+    mean = np.full(counts.shape, np.nan, dtype=np.float32)
+
+    smoothed_sums = smooth(sums)
+    smoothed_counts = smooth(counts)
+
+    candidates = [(sums, counts), (smoothed_sums, smoothed_counts)]
+    candidates += [(s, c) for s, c in fallbacks]
+
+    for candidate_sums, candidate_counts in reversed(candidates):
+        candidate_counts = np.broadcast_to(candidate_counts, counts.shape)
+        candidate_sums = np.broadcast_to(candidate_sums, counts.shape)
+        ok = candidate_counts >= MIN_SAMPLES
+        np.divide(candidate_sums, candidate_counts, out=mean, where=ok, casting='unsafe')
+
+    return mean
+
+def build_profile(pair_keys, hist):
+    import numpy as np
+    levels = np.arange(LEVELS, dtype=np.float64)
+    counts = hist.sum(axis=-1, dtype=np.float64)  # (P, D, B)
+    sums = (hist * levels).sum(axis=-1)
+
+    route_ids = sorted({route_id for route_id, _ in pair_keys})
+    route_index = {route_id: i for i, route_id in enumerate(route_ids)}
+    pair_route_idx = np.array([route_index[route_id] for route_id, _ in pair_keys], dtype=np.int32)
+
+    route_counts = np.zeros((len(route_ids), DAY_TYPES, BUCKETS))
+    route_sums = np.zeros((len(route_ids), DAY_TYPES, BUCKETS))
+    np.add.at(route_counts, pair_route_idx, counts)
+    np.add.at(route_sums, pair_route_idx, sums)
+
+    global_counts = counts.sum(axis=0)
+    global_sums = sums.sum(axis=0)
+
+    # 路線単位・全体は時間帯を広めに取った値で補完
+    global_fallback = (smooth(global_sums), smooth(global_counts))
+    route_mean = fill_mean(route_sums, route_counts, global_fallback)
+    global_mean = fill_mean(global_sums, global_counts)
+
+    mean = fill_mean(
+        sums, counts,
+        # 同じ路線・停留所の終日平均
+        (sums.sum(axis=-1, keepdims=True), counts.sum(axis=-1, keepdims=True)),
+        # 同じ路線の同じ時間帯
+        (smooth(route_sums)[pair_route_idx], smooth(route_counts)[pair_route_idx]),
+        global_fallback,
+    )
+
+    return {
+        'pair_route': np.array([route_id for route_id, _ in pair_keys], dtype=str),
+        'pair_stop': np.array([stop_id for _, stop_id in pair_keys], dtype=str),
+        'mean': mean,
+        'route_ids': np.array(route_ids, dtype=str),
+        'route_mean': route_mean,
+        'global_mean': global_mean,
+        'samples': counts.astype(np.uint32),
+    }
+
+def aggregate():
+    """前日までの観測値をヒストグラムへ積み上げてプロファイルを作り直す（GTFS更新前に実行）"""
+    import numpy as np
+    files, observations = load_observations()
+    pair_index, hist = load_histogram()
+
+    if observations:
+        trip_to_route, trip_stop_ids = build_trip_mapping({trip_id for _, trip_id, _, _ in observations})
+
+        day_types = {}
+        rows = []
+        for observed_at, trip_id, stop_sequence, occupancy in observations:
+            route_id = trip_to_route.get(trip_id)
+            stop_id = trip_stop_ids.get((trip_id, stop_sequence))
+            if route_id is None or stop_id is None or not 0 <= occupancy < LEVELS:
+                continue
+
+            observed = datetime.datetime.utcfromtimestamp(observed_at) + datetime.timedelta(hours=9)
+            service_date = (observed - datetime.timedelta(hours=SERVICE_DAY_START_HOUR)).date()
+            if service_date not in day_types:
+                day_types[service_date] = get_day_type(service_date)
+
+            key = (route_id, stop_id)
+            if key not in pair_index:
+                pair_index[key] = len(pair_index)
+
+            bucket = (observed.hour * 60 + observed.minute) // BUCKET_MINUTES
+            rows.append((pair_index[key], day_types[service_date], bucket, occupancy))
+
+        if len(pair_index) > hist.shape[0]:
+            grown = np.zeros((len(pair_index), DAY_TYPES, BUCKETS, LEVELS), dtype=np.uint16)
+            grown[:hist.shape[0]] = hist
+            hist = grown
+
+        if rows:
+            idx = np.array(rows, dtype=np.intp).T
+            updated = hist.astype(np.uint32)
+            np.add.at(updated, tuple(idx), 1)
+            while updated.max() > HISTOGRAM_CAP:
+                updated //= 2
+            hist = updated.astype(np.uint16)
+
+    pair_keys = sorted(pair_index, key=pair_index.get)
+    save_npz(
+        HISTOGRAM_PATH,
+        pair_route=np.array([route_id for route_id, _ in pair_keys], dtype=str),
+        pair_stop=np.array([stop_id for _, stop_id in pair_keys], dtype=str),
+        hist=hist
+    )
+    save_npz(PROFILE_PATH, **build_profile(pair_keys, hist))
+
+    for file_name in files:
+        os.remove(OBSERVATIONS_DIR + file_name)
+
+    print('congestion profile: %d observations, %d route/stop pairs' % (len(observations), len(pair_keys)))
+
+# ==== 予測値の取得 ====
+def load_profile():
+    """プロファイル（まだ一度も集計していなければ None）"""
+    import numpy as np
+    global _profile, _profile_mtime
+
+    try:
+        mtime = os.path.getmtime(PROFILE_PATH)
+    except FileNotFoundError:
+        return None
+    if _profile is not None and mtime == _profile_mtime:
+        metrics.cache_lookup('congestion_profile', hits=1)
+        return _profile
+
+    metrics.cache_lookup('congestion_profile', misses=1)
+    with metrics.stage('profile_load'):
+        with np.load(PROFILE_PATH) as data:
+            profile = {key: data[key] for key in data.files}
+        profile['pair_index'] = {
+            key: i for i, key in enumerate(zip(profile['pair_route'].tolist(), profile['pair_stop'].tolist()))
+        }
+        profile['route_index'] = {route_id: i for i, route_id in enumerate(profile['route_ids'].tolist())}
+        _profile, _profile_mtime = profile, mtime
+    return _profile
+
+def predict(route_ids, stop_ids, buckets, day_type):
+    """(route_id, stop_id, 15分枠) の配列に対する予測混雑度。データがなければ nan"""
+    import numpy as np
+    profile = load_profile()
+    if profile is None:
+        return np.full(len(route_ids), np.nan)
+    pair_index = profile['pair_index']
+    route_index = profile['route_index']
+
+    pair_idx = np.array([pair_index.get(key, -1) for key in zip(route_ids, stop_ids)], dtype=np.intp)
+    route_idx = np.array([route_index.get(route_id, -1) for route_id in route_ids], dtype=np.intp)
+    buckets = np.asarray(buckets, dtype=np.intp)
+
+    result = profile['global_mean'][day_type, buckets].astype(np.float64)
+
+    if len(profile['route_ids']):
+        by_route = profile['route_mean'][np.maximum(route_idx, 0), day_type, buckets]
+        result = np.where((route_idx >= 0) & ~np.isnan(by_route), by_route, result)
+
+    if len(profile['pair_route']):
+        by_pair = profile['mean'][np.maximum(pair_idx, 0), day_type, buckets]
+        result = np.where((pair_idx >= 0) & ~np.isnan(by_pair), by_pair, result)
+
+    return result
+
+def get(target_stop_id):
+    now = datetime.datetime.utcnow() + datetime.timedelta(hours=9)
+
+    with metrics.stage('timetable_scan'):
+        departures = [
+            dep for dep in get_departures.get_departures_at_stop(target_stop_id, now.year, now.month, now.day)
+            if not dep['should_ignore']
+        ]
+
+    if not departures:
+        return json.dumps([], ensure_ascii=False)
+
+    day_type = get_day_type(now.date())
+    predicted = predict(
+        [dep['route_id'] for dep in departures],
+        [target_stop_id] * len(departures),
+        [time_to_bucket(dep['departure_time']) for dep in departures],
+        day_type
+    )
+
+    result = []
+    for dep, congestion in zip(departures, predicted.tolist()):
+        result.append({
+            'trip_id': dep['trip_id'],
+            'stop_sequence': dep['stop_sequence'],
+            'departure_time': dep['departure_time'][:5],
+            'route_name': dep['route_name'],
+            'destination': dep['trip_headsign'],
+            # get_departures と同じく小数点以下2桁で切り上げ
+            'congestion': -2.0 if math.isnan(congestion) else math.ceil(congestion * 100) / 100
+        })
+
+    with metrics.stage('serialization'):
+        return json.dumps(result, ensure_ascii=False)
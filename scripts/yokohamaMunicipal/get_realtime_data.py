@@ -1,22 +1,23 @@
 from google.transit import gtfs_realtime_pb2
-import requests
 import json
-import boto3
-import datetime
 import os
-import pickle
+from common import index_format
+from common import realtime_snapshot
+from common import stop_index
+from common import metrics
 
 path = os.path.dirname(__file__)
 
 GTFS_RT_DATA_KEY = path + '/cache/gtfs_rt'
-TRIP_UPDATE_KEY = path + '/cache/trip_update'
-TRIP_UPDATE_KEY = path + '/cache/trip_update'
 
-STOP_SEQUENCE_PATH = path + '/cache/stop_sequence.pkl'
+STOP_SEQUENCE_DIR = path + '/cache/stop_sequence'
+REALTIME_DIR = path + '/cache/realtime'
 
 def load_stop_sequence():
-    with open(STOP_SEQUENCE_PATH, 'rb') as f:
-        return pickle.load(f)
+    return stop_index.load_stop_sequence(STOP_SEQUENCE_DIR, f'{__name__}.stop_sequence')
+
+def load_realtime():
+    return realtime_snapshot.load_snapshot(REALTIME_DIR, f'{__name__}.realtime')
 
 def load_from_s3(key):
     with open(key, 'rb') as f:
@@ -29,11 +30,13 @@ def get(event):
     if not trips:
         return {'statusCode': 400, 'body': 'query parameter required'}
 
-    response = load_from_s3(GTFS_RT_DATA_KEY)
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(response)
+    with metrics.stage('feed_parse'):
+        response = load_from_s3(GTFS_RT_DATA_KEY)
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(response)
 
-    stop_sequence = load_stop_sequence()
+    with metrics.stage('index_load'):
+        stop_sequence = load_stop_sequence()
 
     result = {}
 
@@ -53,19 +56,34 @@ def get(event):
                     vehicle_information['congestion'] = vehicle.occupancy_status
 
                 result[trip] = vehicle_information
-    
-    trip_update = load_from_s3(TRIP_UPDATE_KEY)
-    feed.ParseFromString(trip_update)
-
-    for entity in feed.entity:
-        if entity.HasField('trip_update'):
-            trip_id = entity.trip_update.trip.trip_id
-
-            if trip_id in trips and trip_id in result:
-                for stop_time_update in entity.trip_update.stop_time_update:
-                    if stop_time_update.stop_id == stop:
-                        dep_time = datetime.datetime.fromtimestamp(stop_time_update.departure.time) + datetime.timedelta(hours=9)
-
-                        result[trip_id].update({'departure': dep_time.strftime('%H:%M')})
 
-    return json.dumps(result, ensure_ascii=False)
+    with metrics.stage('index_load'):
+        try:
+            snapshot = load_realtime()
+        except (FileNotFoundError, index_format.FormatError) as e:
+            print("予測時刻が存在しないか読み込み失敗:", e)
+            snapshot = None
+
+    # ポーラーが求めた予測時刻（TripUpdate にこの停留所がない便も、手前の遅れから求めてある）
+    if snapshot is not None:
+        for trip_id in trips:
+            departure = snapshot.departure(trip_id, stop)
+            if departure is not None:
+                result.setdefault(trip_id, {})['departure'] = realtime_snapshot.format_departure(departure)
+
+    with metrics.stage('serialization'):
+        return json.dumps(result, ensure_ascii=False)
+
+# 停留所に向かっている車両（次に来るバス）。trip_id を送らなくてもポーラーの作った索引を1回引くだけ
+def live(stop, limit=realtime_snapshot.LIVE_LIMIT):
+    with metrics.stage('index_load'):
+        try:
+            snapshot = load_realtime()
+        except (FileNotFoundError, index_format.FormatError) as e:
+            print("予測時刻が存在しないか読み込み失敗:", e)
+            snapshot = None
+
+    vehicles = snapshot.approaching(stop, limit) if snapshot is not None else []
+
+    with metrics.stage('serialization'):
+        return json.dumps(vehicles, ensure_ascii=False)
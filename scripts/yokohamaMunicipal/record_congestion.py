@@ -4,16 +4,27 @@ import pickle
 from datetime import datetime, timedelta
 import boto3
 from google.transit import gtfs_realtime_pb2
+from common import feed_fetcher
+from common import index_format
+from common import index_store
+from common import congestion_client
+from common import poller_telemetry
+from common import realtime_snapshot
+from common import stop_index
+from common import timetable
 import time
 import io
 import os
 
 path = os.path.dirname(__file__)
 
-TRIP_END_TIMES_KEY = path + "/cache/trip_end_times.pkl"
+TRIP_INFO_DIR = path + "/cache/trip_info"
 LAST_RECORDED_KEY = path + "/cache/last_recorded.pkl"
 GTFS_RT_DATA_KEY = path + '/cache/gtfs_rt'
+TIMETABLE_DIR = path + '/cache/timetable'
+REALTIME_DIR = path + '/cache/realtime'
 TRIP_UPDATE_KEY = path + '/cache/trip_update'
+OBSERVATIONS_DIR = path + '/cache/observations/'
 
 # GTFS static ファイルパス
 CALENDAR_KEY = path + "/gtfs_data/calendar.txt"
@@ -21,13 +32,23 @@ STOP_TIMES_KEY = path + "/gtfs_data/stop_times.txt"
 
 ACCESS_TOKEN = os.environ.get('ODPT_ACCESS_TOKEN', '')
 
-API_ENDPOINT = 'https://api.odpt.org/api/v4/gtfs/realtime/YokohamaMunicipalBus_vehicle?acl:consumerKey=' + ACCESS_TOKEN
-TRIP_UPDATE_API_ENDPOINT = 'https://api.odpt.org/api/v4/gtfs/realtime/YokohamaMunicipalBus_trip_update?acl:consumerKey=' + ACCESS_TOKEN
+# 負荷試験では bench/feed_simulator.py などのローカルサーバーに向ける
+ODPT_API_BASE = os.environ.get('ODPT_API_BASE', 'https://api.odpt.org')
+
+API_ENDPOINT = ODPT_API_BASE + '/api/v4/gtfs/realtime/YokohamaMunicipalBus_vehicle?acl:consumerKey=' + ACCESS_TOKEN
+TRIP_UPDATE_API_ENDPOINT = ODPT_API_BASE + '/api/v4/gtfs/realtime/YokohamaMunicipalBus_trip_update?acl:consumerKey=' + ACCESS_TOKEN
 
 # DynamoDB 初期化
-dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1')  # 東京リージョン
+dynamodb = boto3.resource('dynamodb', region_name='ap-northeast-1', config=congestion_client.client_config())  # 東京リージョン
 table = dynamodb.Table('BusCongestion')
 
+def count_throttle(response=None, **kwargs):
+    # boto3 の自動リトライに吸収されるスロットリングも数える
+    if response is not None and response[1].get('Error', {}).get('Code') in congestion_client.RETRYABLE_ERRORS:
+        poller_telemetry.add('throttles')
+
+dynamodb.meta.client.meta.events.register('needs-retry.dynamodb', count_throttle)
+
 # 重複記録の防止用セット
 last_recorded = set()
 
@@ -54,8 +75,33 @@ def save_pickle(data, path):
         f.write(body)
 
 def save_data_to_s3(data, key):
-    with open(key, 'wb') as f:
-        f.write(data)
+    # APIが読み込み中のファイルを書き換えないよう、一時ファイルに書いてから置き換える
+    tmp_key = key + '.tmp'
+    with poller_telemetry.phase('write'):
+        with open(tmp_key, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_key, key)
+
+def load_feed(key):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    try:
+        with open(key, 'rb') as f:
+            feed.ParseFromString(f.read())
+    except FileNotFoundError:
+        pass
+    return feed
+
+def publish_realtime():
+    """保存済みのフィードから、走っている便の残りの停留所の予測時刻を書き出す（API はこれを引くだけ）"""
+    try:
+        table = timetable.load_timetable(TIMETABLE_DIR, f'{__name__}.timetable')
+    except (FileNotFoundError, index_format.FormatError) as e:
+        # 時刻表は日次ビルドで作るので、ポーラーでは作り直さない
+        print("⚠️ 時刻表がないため予測時刻を更新しない:", e)
+        return
+    # 車両位置と TripUpdate のタスクが別々のワーカーから呼ぶので、最後に書いた世代が最新のフィードを反映するように読み込みから直列にする
+    with poller_telemetry.phase('write'), index_store.publish_lock(REALTIME_DIR):
+        realtime_snapshot.publish_snapshot(REALTIME_DIR, table, [load_feed(key) for key in (GTFS_RT_DATA_KEY, TRIP_UPDATE_KEY)])
 
 
 def load_service_ids_for_today():
@@ -99,6 +145,17 @@ def build_trip_end_times(key=STOP_TIMES_KEY):
 
     return trip_end_times
 
+def append_observations(observations):
+    """時間帯別の混雑プロファイル集計用に生の観測値を日付ごとのCSVへ追記"""
+    if not observations:
+        return
+
+    os.makedirs(OBSERVATIONS_DIR, exist_ok=True)
+    now = datetime.utcnow() + timedelta(hours=9)
+    with open(OBSERVATIONS_DIR + now.strftime('%Y%m%d') + '.csv', 'a', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerows(observations)
+
 def get_current_seconds():
     now = datetime.utcnow() + timedelta(hours=9)
     return now.hour * 3600 + now.minute * 60 + now.second
@@ -119,7 +176,8 @@ def record_congestion(trip_id, stop_sequence, occupancy_status, last_recorded):
         return
 
     key = {'trip_id': trip_id, 'stop_sequence': int(stop_sequence)}
-    response = table.get_item(Key=key)
+    with poller_telemetry.phase('write'):
+        response = table.get_item(Key=key)
 
     if 'Item' in response:
         item = response['Item']
@@ -131,26 +189,32 @@ def record_congestion(trip_id, stop_sequence, occupancy_status, last_recorded):
 
     ttl = datetime.utcnow() + timedelta(days=30)
 
-    table.put_item(Item={
-        'trip_id': trip_id,
-        'stop_sequence': int(stop_sequence),
-        'congestion_sum': new_sum,
-        'count': new_count,
-        'last_updated': datetime.utcnow().isoformat(),
-        'time_to_live': int(ttl.timestamp())
-    })
+    with poller_telemetry.phase('write'):
+        table.put_item(Item={
+            'trip_id': trip_id,
+            'stop_sequence': int(stop_sequence),
+            'congestion_sum': new_sum,
+            'count': new_count,
+            'last_updated': datetime.utcnow().isoformat(),
+            'time_to_live': int(ttl.timestamp())
+        })
+    poller_telemetry.add('writes')
 
     last_recorded.add((trip_id, stop_sequence))
+    return True
 
-def main():
+def process_vehicle_feed(content, version):
     service_ids = load_service_ids_for_today()
-    trip_end_times = load_pickle_from_s3(TRIP_END_TIMES_KEY)
+    # mmap するだけなので毎サイクル読み直さない（日次ビルドで切り替わったら開き直す）
+    trip_end_times = stop_index.load_trip_info(TRIP_INFO_DIR, f'{__name__}.trip_info')
     last_recorded = set(load_pickle_from_s3(LAST_RECORDED_KEY))
+    observations = []
 
-    response = requests.get(API_ENDPOINT)
-    save_data_to_s3(response.content, GTFS_RT_DATA_KEY)
+    save_data_to_s3(content, GTFS_RT_DATA_KEY)
     feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(response.content)
+    with poller_telemetry.phase('parse'):
+        feed.ParseFromString(content)
+    poller_telemetry.add('entities', len(feed.entity))
 
     for entity in feed.entity:
         if entity.HasField('vehicle'):
@@ -166,18 +230,46 @@ def main():
                 if not is_trip_operating(trip_id, trip_end_times):
                     continue
 
-                record_congestion(trip_id, stop_seq, vehicle.occupancy_status, last_recorded)
+                if record_congestion(trip_id, stop_seq, vehicle.occupancy_status, last_recorded):
+                    observed_at = vehicle.timestamp or int(time.time())
+                    observations.append((observed_at, trip_id, stop_seq, vehicle.occupancy_status))
 
     # 3. 記録済みセットを更新
     save_pickle(last_recorded, LAST_RECORDED_KEY)
+    append_observations(observations)
+    publish_realtime()
+
+    feed_fetcher.mark_processed(GTFS_RT_DATA_KEY, version)
 
-    response = requests.get(TRIP_UPDATE_API_ENDPOINT)
-    save_data_to_s3(response.content, TRIP_UPDATE_KEY)
+def main():
+    # 前回から更新されていなければ何もしない
+    new_feed = feed_fetcher.fetch_new_feed(API_ENDPOINT, GTFS_RT_DATA_KEY)
+    if new_feed is not None:
+        process_vehicle_feed(*new_feed)
+
+async def main_async():
+    new_feed = await feed_fetcher.fetch_new_feed_async(API_ENDPOINT, GTFS_RT_DATA_KEY)
+    if new_feed is not None:
+        # デコードと DynamoDB への書き込みはワーカーで
+        await feed_fetcher.run_in_worker(process_vehicle_feed, *new_feed)
+
+def process_trip_update_feed(content, version):
+    save_data_to_s3(content, TRIP_UPDATE_KEY)
+    publish_realtime()
+    feed_fetcher.mark_processed(TRIP_UPDATE_KEY, version)
+
+def update_trip_update():
+    new_feed = feed_fetcher.fetch_new_feed(TRIP_UPDATE_API_ENDPOINT, TRIP_UPDATE_KEY)
+    if new_feed is not None:
+        process_trip_update_feed(*new_feed)
+
+async def update_trip_update_async():
+    new_feed = await feed_fetcher.fetch_new_feed_async(TRIP_UPDATE_API_ENDPOINT, TRIP_UPDATE_KEY)
+    if new_feed is not None:
+        await feed_fetcher.run_in_worker(process_trip_update_feed, *new_feed)
 
 def init():
-    trip_end_times = build_trip_end_times(STOP_TIMES_KEY)
-    with open(TRIP_END_TIMES_KEY, "wb") as f:
-        pickle.dump(trip_end_times, f)
+    stop_index.publish_trip_info(TRIP_INFO_DIR, build_trip_end_times(STOP_TIMES_KEY))
 
 def reset():
     last_recorded = set()